@@ -1,54 +1,51 @@
 """Обработчики медиа (голосовые, аудио, видео)."""
-import io
-import os
-import tempfile
-import asyncio
-import aiohttp
-from pathlib import Path
 from aiogram import Router, Bot, F
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile, BufferedInputFile
-from aiogram.filters import StateFilter
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
-from bot.models.database import User, ProcessingTask
-from bot.services.queue_service import QueueService
+from bot.models.database import User, ProcessingTask, TaskStatus
+from bot.services.queue_service import get_queue_service, QueueLimitExceeded
+from bot.services.results import analyze_and_send
 from bot.utils.logger import logger
-from bot.handlers.media_results import _send_text_or_file, clean_text
 
 router = Router()
 
 
 @router.message(F.voice | F.audio | F.video_note)
 async def handle_media(message: Message, bot: Bot, state: FSMContext):
-    """Обработчик голосовых сообщений, аудио и видео-кружков."""
+    """
+    Обработчик голосовых сообщений, аудио и видео-кружков.
+    
+    Только подтверждает получение и ставит задачу в очередь: скачивание,
+    расшифровка и обработка через LLM выполняются воркерами QueueService.
+    """
     try:
         # Определяем тип файла
         if message.voice:
-            file_id = message.voice.file_id
+            media = message.voice
             file_type = "voice"
-            duration = message.voice.duration
         elif message.audio:
-            file_id = message.audio.file_id
+            media = message.audio
             file_type = "audio"
-            duration = message.audio.duration
         elif message.video_note:
-            file_id = message.video_note.file_id
+            media = message.video_note
             file_type = "video_note"
-            duration = message.video_note.duration
         else:
             return
         
+        duration = media.duration
         user_id = message.from_user.id
         
         # Отправляем подтверждение
         status_msg = await message.answer(
-            f"🎤 Принял {file_type}, расшифровываю...\n"
+            f"🎤 Принял {file_type}, задача в очереди...\n"
             f"⏱ Длительность: {duration} сек.\n"
             f"⏳ Это может занять некоторое время..."
         )
         
         # Получаем или создаём пользователя
         from bot.storage.database import AsyncSessionLocal
+        from bot.utils.languages import get_language_for_whisper
         from sqlalchemy import select
         
         async with AsyncSessionLocal() as session:
@@ -68,300 +65,85 @@ async def handle_media(message: Message, bot: Bot, state: FSMContext):
                 await session.refresh(user)
             
             # Добавляем задачу в очередь
-            queue_service = QueueService(session)
-            task = await queue_service.add_task(
-                user_id=user.id,
-                file_id=file_id,
-                file_type=file_type
-            )
-            
-            # Скачиваем файл на диск (для больших файлов)
-            await status_msg.edit_text("📥 Скачиваю файл...")
-            file = await bot.get_file(file_id)
-            file_path = file.file_path
-            
-            # Проверяем размер файла (если доступен)
-            file_size = getattr(file, 'file_size', None)
-            # Лимит Bot API для скачивания: 50 МБ, но лучше ограничить до 20 МБ для надежности
-            max_size = 20 * 1024 * 1024  # 20 МБ
-            if file_size and file_size > max_size:
-                await status_msg.edit_text(
-                    f"❌ Файл слишком большой ({file_size / 1024 / 1024:.1f} MB).\n"
-                    f"Максимальный размер: 20 MB.\n"
-                    f"Пожалуйста, отправьте файл меньшего размера."
-                )
-                return
-            
-            # Создаём временный файл для скачивания
-            temp_dir = Path(tempfile.gettempdir()) / "bot_hnushka"
-            temp_dir.mkdir(exist_ok=True)
-            temp_file = temp_dir / f"{file_id}_{user_id}.ogg"
-            
+            queue_service = get_queue_service()
             try:
-                # Скачиваем файл на диск
-                await bot.download_file(file_path, destination=str(temp_file))
-                
-                # Проверяем, что файл скачался
-                if not temp_file.exists() or temp_file.stat().st_size == 0:
-                    raise Exception("Файл не был скачан или пуст")
-                
-                # Читаем файл с диска
-                with open(temp_file, 'rb') as f:
-                    audio_bytes = f.read()
-                
-                # Обновляем статус
-                file_size_mb = len(audio_bytes) / 1024 / 1024
+                task = await queue_service.add_task(
+                    session,
+                    user_id=user.id,
+                    file_id=media.file_id,
+                    file_type=file_type,
+                    file_unique_id=media.file_unique_id,
+                    duration=duration,
+                    file_size=media.file_size,
+                    language=get_language_for_whisper(user.language or "auto"),
+                    chat_id=message.chat.id,
+                    message_id=message.message_id,
+                    status_message_id=status_msg.message_id
+                )
+            except QueueLimitExceeded as e:
                 await status_msg.edit_text(
-                    f"🎤 Файл скачан ({file_size_mb:.1f} MB), начинаю расшифровку...\n"
-                    f"📝 Задача #{task.id} в очереди"
+                    f"⚠️ У тебя уже {e.active} задач в обработке (максимум {e.limit}).\n"
+                    f"Дождись их завершения и отправь это сообщение ещё раз."
                 )
-            except Exception as download_error:
-                error_msg = str(download_error)
-                if "too big" in error_msg.lower() or "file is too big" in error_msg.lower():
-                    await status_msg.edit_text(
-                        f"❌ Файл слишком большой для скачивания через Bot API.\n"
-                        f"Максимальный размер: 20 MB.\n"
-                        f"Пожалуйста, отправьте файл меньшего размера или разделите его на части."
-                    )
-                else:
-                    logger.error(f"Ошибка скачивания файла: {download_error}", exc_info=True)
-                    await status_msg.edit_text(
-                        f"❌ Ошибка скачивания файла: {error_msg}\n"
-                        f"Попробуйте отправить файл ещё раз."
-                    )
-                return
-            finally:
-                # Удаляем временный файл после использования
-                if temp_file.exists():
-                    try:
-                        temp_file.unlink()
-                    except Exception as e:
-                        logger.warning(f"Не удалось удалить временный файл {temp_file}: {e}")
-            
-            # Здесь должна быть обработка через очередь
-            # Пока что делаем простую обработку напрямую
-            from bot.services.whisper_service import WhisperService
-            from bot.services.llm_service import LLMClient
-            
-            whisper = WhisperService()
-            llm = LLMClient()
-            
-            # Расшифровка с прогрессом
-            async def update_transcription_progress(progress: int):
-                """Обновить прогресс расшифровки."""
-                try:
-                    await status_msg.edit_text(f"🎤 Расшифровываю аудио...\n📊 Прогресс: {progress}%")
-                except Exception as e:
-                    logger.warning(f"Не удалось обновить прогресс: {e}")
-            
-            await status_msg.edit_text("🎤 Расшифровываю аудио...\n📊 Прогресс: 0%")
-            # Получаем язык пользователя
-            from bot.utils.languages import get_language_for_whisper
-            user_language = get_language_for_whisper(user.language or "auto")
-            transcription = await whisper.transcribe(audio_bytes, language=user_language, progress_callback=update_transcription_progress)
-            
-            if not transcription or len(transcription.strip()) == 0:
-                await status_msg.edit_text("❌ Не удалось расшифровать аудио. Попробуй ещё раз.")
                 return
             
-            # Классификация
-            await status_msg.edit_text("🤖 Анализирую содержимое...\n📊 Прогресс обработки: 20%")
-            classification = await llm.classify_message(transcription)
-            message_type = classification.get("type", "UNKNOWN").lower()
-            
-            # Обработка в зависимости от типа
-            await status_msg.edit_text("📝 Формирую результат...\n📊 Прогресс обработки: 60%")
-            
-            if message_type == "meeting":
-                result = await llm.process_meeting(transcription)
-                await _send_meeting_result(message, status_msg, result, task.id)
-            elif message_type == "reminder":
-                result = await llm.process_reminder(transcription)
-                await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
-                await _send_reminder_result(message, status_msg, result, task.id)
-            elif message_type == "archive":
-                result = await llm.process_archive(transcription)
-                await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
-                await _send_archive_result(message, status_msg, result, task.id)
-            elif message_type == "diary":
-                result = await llm.process_diary(transcription)
-                await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
-                from bot.handlers.media_results import _send_diary_result
-                await _send_diary_result(message, status_msg, result, task.id)
-            elif message_type == "work":
-                result = await llm.process_work(transcription)
-                await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
-                from bot.handlers.media_results import _send_work_result
-                await _send_work_result(message, status_msg, result, task.id)
-            elif message_type == "home":
-                result = await llm.process_home(transcription)
-                await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
-                from bot.handlers.media_results import _send_home_result
-                await _send_home_result(message, status_msg, result, task.id)
-            elif message_type == "study":
-                result = await llm.process_study(transcription)
-                await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
-                from bot.handlers.media_results import _send_study_result
-                await _send_study_result(message, status_msg, result, task.id)
-            elif message_type == "ideas":
-                result = await llm.process_ideas(transcription)
-                await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
-                from bot.handlers.media_results import _send_ideas_result
-                await _send_ideas_result(message, status_msg, result, task.id)
-            elif message_type == "health":
-                result = await llm.process_health(transcription)
-                await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
-                from bot.handlers.media_results import _send_health_result
-                await _send_health_result(message, status_msg, result, task.id)
-            elif message_type == "finance":
-                result = await llm.process_finance(transcription)
-                await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
-                from bot.handlers.media_results import _send_finance_result
-                await _send_finance_result(message, status_msg, result, task.id)
-            else:
+            ahead, eta = await queue_service.queue_position(session, task)
+            await session.refresh(task)
+            # Статусное сообщение дальше обновляет воркер; если задачу уже
+            # взяли в работу, не перебиваем его
+            if task.status == TaskStatus.QUEUED:
                 await status_msg.edit_text(
-                    f"📝 Расшифровка:\n\n{transcription}\n\n"
-                    f"⚠️ Не удалось определить тип сообщения."
+                    f"🎤 Принял {file_type}, задача #{task.id} в очереди\n"
+                    f"📋 Перед ней задач: {ahead}\n"
+                    f"⏳ Примерно через {_format_eta(eta)}"
                 )
-            
-            # Обновляем задачу
-            task.transcription = transcription
-            from bot.models.database import TaskStatus
-            task.status = TaskStatus.DONE
-            await session.commit()
-            
+    
     except Exception as e:
         logger.error(f"Ошибка обработки медиа: {e}", exc_info=True)
         await message.answer(f"❌ Произошла ошибка при обработке: {str(e)}")
 
 
-# Функции _send_text_or_file и _delete_file_after_delay перенесены в media_results.py
-
-
-async def _send_meeting_result(
-    message: Message,
-    status_msg: Message,
-    result: dict,
-    task_id: int
-):
-    """Отправить результат обработки собрания."""
-    if "error" in result:
-        await status_msg.edit_text(f"❌ Ошибка обработки: {result['error']}")
+@router.callback_query(F.data.startswith("reprocess_"))
+async def callback_reprocess(callback: CallbackQuery):
+    """Повторно обработать расшифровку через LLM (без повторной расшифровки)."""
+    try:
+        task_id = int(callback.data.split("_")[1])
+    except (IndexError, ValueError):
+        await callback.answer("Некорректная задача")
         return
     
-    title = clean_text(str(result.get('title', 'Собрание')))
-    summary = clean_text(str(result.get('summary', '')))
-    
-    text = f"👥 {title}\n\n"
-    text += f"📋 {summary}\n\n"
-    
-    if result.get("participants"):
-        participants = [clean_text(str(p)) for p in result['participants']]
-        text += f"👤 Участники: {', '.join(participants)}\n\n"
+    from bot.storage.database import AsyncSessionLocal
+    from bot.services.llm_service import get_llm_client
+    from sqlalchemy import select
     
-    if result.get("tasks"):
-        text += "✅ Задачи:\n"
-        for i, task in enumerate(result["tasks"], 1):
-            task_title = clean_text(str(task.get('title', '')))
-            text += f"{i}. {task_title}"
-            if task.get("assignee"):
-                assignee = clean_text(str(task['assignee']))
-                text += f" → {assignee}"
-            if task.get("due_date"):
-                due_date = clean_text(str(task['due_date']))
-                text += f" (до {due_date})"
-            text += "\n"
-        text += "\n"
-    
-    if result.get("decisions"):
-        text += "💡 Решения:\n"
-        for i, decision in enumerate(result["decisions"], 1):
-            decision_text = clean_text(str(decision))
-            text += f"{i}. {decision_text}\n"
-        text += "\n"
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="🔄 Переформулировать", callback_data=f"reprocess_{task_id}"),
-            InlineKeyboardButton(text="✏️ Изменить тип", callback_data=f"change_type_{task_id}")
-        ],
-        [
-            InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_{task_id}")
-        ]
-    ])
+    async with AsyncSessionLocal() as session:
+        stmt = select(ProcessingTask).join(User).where(
+            ProcessingTask.id == task_id,
+            User.telegram_id == callback.from_user.id
+        )
+        task = (await session.execute(stmt)).scalar_one_or_none()
     
-    await _send_text_or_file(message, status_msg, text, "Собрание", keyboard)
-
-
-async def _send_reminder_result(
-    message: Message,
-    status_msg: Message,
-    result: dict,
-    task_id: int
-):
-    """Отправить результат обработки напоминания."""
-    if "error" in result:
-        await status_msg.edit_text(f"❌ Ошибка обработки: {result['error']}")
+    if not task:
+        await callback.answer("Задача не найдена")
         return
     
-    reminder_text = clean_text(str(result.get('text', '')))
-    text = f"⏰ Напоминание создано\n\n"
-    text += f"📝 {reminder_text}\n\n"
-    
-    if result.get("reminder_date"):
-        date = clean_text(str(result['reminder_date']))
-        text += f"📅 Дата: {date}\n"
-    elif result.get("relative_time"):
-        time = clean_text(str(result['relative_time']))
-        text += f"⏱ Время: {time}\n"
-    
-    if result.get("needs_clarification"):
-        text += "\n⚠️ Нужно уточнить дату/время"
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="📅 Уточнить время", callback_data=f"clarify_time_{task_id}")
-        ],
-        [
-            InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_{task_id}")
-        ]
-    ])
-    
-    await _send_text_or_file(message, status_msg, text, "Напоминание", keyboard)
-
-
-async def _send_archive_result(
-    message: Message,
-    status_msg: Message,
-    result: dict,
-    task_id: int
-):
-    """Отправить результат обработки архива."""
-    if "error" in result:
-        await status_msg.edit_text(f"❌ Ошибка обработки: {result['error']}")
+    # Whisper повторно не запускается
+    transcription = task.transcription
+    if not transcription:
+        await callback.answer("Расшифровка не найдена, отправь аудио ещё раз")
         return
     
-    title = clean_text(str(result.get('title', 'Заметка')))
-    summary = clean_text(str(result.get('summary', '')))
-    content = clean_text(str(result.get('content', '')))
-    
-    text = f"📚 {title}\n\n"
-    text += f"📋 {summary}\n\n"
-    text += f"{content}\n\n"
-    
-    if result.get("tags"):
-        tags = [clean_text(str(tag)) for tag in result['tags']]
-        text += f"🏷 Теги: {', '.join(tags)}\n"
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="🔄 Переформулировать", callback_data=f"reprocess_{task_id}"),
-            InlineKeyboardButton(text="✏️ Изменить тип", callback_data=f"change_type_{task_id}")
-        ],
-        [
-            InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_{task_id}")
-        ]
-    ])
-    
-    await _send_text_or_file(message, status_msg, text, "Собрание", keyboard)
+    await callback.answer("Переформулирую...")
+    status_msg = await callback.message.answer("🤖 Анализирую содержимое...\n📊 Прогресс обработки: 20%")
+    try:
+        await analyze_and_send(get_llm_client(), transcription, callback.message, status_msg, task.id)
+    except Exception as e:
+        logger.error(f"Ошибка повторной обработки задачи {task_id}: {e}", exc_info=True)
+        await status_msg.edit_text(f"❌ Произошла ошибка при обработке: {str(e)}")
+
 
+def _format_eta(seconds: float) -> str:
+    """Оценка времени для пользователя: «40 сек.», «3 мин.»."""
+    if seconds < 60:
+        return f"{max(1, round(seconds))} сек."
+    return f"{round(seconds / 60)} мин."
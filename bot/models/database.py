@@ -3,6 +3,7 @@ from datetime import datetime
 from enum import Enum
 from typing import Optional
 
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel, Relationship
 
 
@@ -44,10 +45,30 @@ class User(SQLModel, table=True):
 
 class ProcessingTask(SQLModel, table=True):
     """Задача обработки медиа."""
+    # Выборка следующей задачи: WHERE status = ... ORDER BY created_at
+    __table_args__ = (
+        Index("ix_processingtask_status_created_at", "status", "created_at"),
+        # Очереди по пользователям (справедливое планирование)
+        Index("ix_processingtask_status_user_id_created_at", "status", "user_id", "created_at"),
+        # Следующая задача пользователя: ORDER BY queue_rank LIMIT 1
+        Index("ix_processingtask_status_user_id_queue_rank", "status", "user_id", "queue_rank"),
+    )
+    
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id", index=True)
     file_id: str
+    file_unique_id: Optional[str] = Field(default=None, index=True)  # Постоянный ID файла в Telegram
     file_type: str  # voice, audio, video_note
+    duration: Optional[float] = None  # Длительность аудио, сек.
+    file_size: Optional[int] = None  # Размер файла, байт
+    estimated_cost: float = Field(default=0.0)  # Ожидаемое время обработки, сек.
+    priority: int = Field(default=0)  # Больше - раньше (сдвигает на queue_priority_step сек.)
+    queue_rank: float = Field(default=0.0)  # Ключ очерёдности в очереди пользователя (меньше - раньше)
+    language: Optional[str] = None  # Язык расшифровки (None - автоопределение)
+    # Где отвечать: исходное сообщение и статусное сообщение бота
+    chat_id: Optional[int] = None
+    message_id: Optional[int] = None
+    status_message_id: Optional[int] = None
     status: TaskStatus = Field(default=TaskStatus.QUEUED, index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     started_at: Optional[datetime] = None
@@ -56,11 +77,41 @@ class ProcessingTask(SQLModel, table=True):
     transcription: Optional[str] = None
     message_type: Optional[MessageType] = None
     result_data: Optional[str] = None  # JSON строка с результатом
+    whisper_model: Optional[str] = None  # Модель Whisper, которой выполнена расшифровка
+    # Аренда задачи воркером: пока lease_expires_at не прошёл, задачу не трогают другие
+    worker_id: Optional[str] = None
+    lease_expires_at: Optional[datetime] = Field(default=None, index=True)
+    attempts: int = Field(default=0)  # Сколько раз задача бралась в работу
     
     # Relationships
     user: User = Relationship()
 
 
+class TranscriptionCache(SQLModel, table=True):
+    """Кэш расшифровок (по file_unique_id и хэшу содержимого)."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    file_unique_id: Optional[str] = Field(default=None, index=True)
+    content_hash: Optional[str] = Field(default=None, index=True)  # sha256 аудио
+    whisper_model: str
+    language: str = Field(default="auto")
+    transcription: str
+    hits: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_used_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
+class LLMResponseCache(SQLModel, table=True):
+    """Кэш ответов LLM (ключ - хэш провайдера, модели, сообщений и температуры)."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    key: str = Field(index=True, unique=True)  # sha256
+    provider: str
+    model: str
+    response: str
+    hits: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_used_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
 class Task(SQLModel, table=True):
     """Задача из собрания."""
     id: Optional[int] = Field(default=None, primary_key=True)
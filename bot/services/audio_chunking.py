@@ -0,0 +1,103 @@
+"""Нарезка длинного аудио на фрагменты по паузам и склейка расшифровок."""
+import re
+from typing import List, Dict, Tuple
+
+
+# Частота дискретизации, с которой работает Whisper
+SAMPLE_RATE = 16000
+
+# Сколько слов на стыке фрагментов проверяется на повтор
+MAX_OVERLAP_WORDS = 20
+# Совпадение короче этого не считается перекрытием: одно общее слово
+# на стыке («и», «the») - обычно просто совпадение, а не повтор
+MIN_OVERLAP_WORDS = 2
+
+
+def plan_chunks(
+    speech_timestamps: List[Dict[str, int]],
+    total_samples: int,
+    chunk_seconds: float,
+    overlap_seconds: float,
+    sample_rate: int = SAMPLE_RATE
+) -> List[Tuple[int, int]]:
+    """
+    Разбить аудио на фрагменты, разрезая его в паузах.
+
+    Args:
+        speech_timestamps: Участки речи от VAD ([{"start": ..., "end": ...}] в сэмплах)
+        total_samples: Длина аудио в сэмплах
+        chunk_seconds: Желаемая длина фрагмента
+        overlap_seconds: Перекрытие соседних фрагментов
+        sample_rate: Частота дискретизации
+
+    Returns:
+        Список фрагментов (начало, конец) в сэмплах, по порядку
+    """
+    if not speech_timestamps:
+        return []
+
+    target = int(chunk_seconds * sample_rate)
+    overlap = int(overlap_seconds * sample_rate)
+
+    # Кандидаты на разрез - середины пауз между участками речи
+    cut_points = [
+        (prev["end"] + cur["start"]) // 2
+        for prev, cur in zip(speech_timestamps, speech_timestamps[1:])
+        if cur["start"] > prev["end"]
+    ]
+
+    start = speech_timestamps[0]["start"]
+    end_of_speech = speech_timestamps[-1]["end"]
+    cuts = []
+
+    while end_of_speech - start > target * 1.5:
+        ideal = start + target
+        # Ищем паузу около желаемой границы, не дальше половины фрагмента
+        candidates = [p for p in cut_points if start + target // 2 < p <= start + target + target // 2]
+        cut = min(candidates, key=lambda p: abs(p - ideal)) if candidates else ideal
+        cuts.append(cut)
+        start = cut
+
+    bounds = [speech_timestamps[0]["start"]] + cuts + [end_of_speech]
+    return [
+        (max(0, chunk_start - overlap), min(total_samples, chunk_end + overlap))
+        for chunk_start, chunk_end in zip(bounds, bounds[1:])
+    ]
+
+
+def _normalize_word(word: str) -> str:
+    """Слово без регистра и пунктуации - для сравнения на стыках."""
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+def merge_chunk_texts(
+    texts: List[str],
+    max_overlap_words: int = MAX_OVERLAP_WORDS,
+    min_overlap_words: int = MIN_OVERLAP_WORDS
+) -> str:
+    """
+    Склеить расшифровки соседних фрагментов, убрав слова из перекрытия.
+
+    Ищется самое длинное совпадение конца уже склеенного текста с началом
+    следующего фрагмента (не короче min_overlap_words слов), и повтор
+    отбрасывается.
+    """
+    merged: List[str] = []
+
+    for text in texts:
+        words = text.split()
+        if not words:
+            continue
+
+        tail = [_normalize_word(w) for w in merged[-max_overlap_words:]]
+        head = [_normalize_word(w) for w in words[:max_overlap_words]]
+
+        skip = 0
+        for size in range(min(len(tail), len(head)), min_overlap_words - 1, -1):
+            if tail[-size:] == head[:size] and any(head[:size]):
+                skip = size
+                break
+
+        merged.extend(words[skip:])
+
+    return " ".join(merged)
@@ -0,0 +1,107 @@
+"""Подготовка аудио для Whisper: декодирование, ресемплинг, обрезка тишины."""
+import time
+from dataclasses import dataclass
+
+import av
+import numpy as np
+
+from config import settings
+from bot.services.audio_chunking import SAMPLE_RATE
+from bot.services.media_download import AudioSource, open_audio
+from bot.utils.logger import logger
+
+
+# Длина кадра для оценки энергии сигнала
+ENERGY_FRAME_MS = 20
+
+
+@dataclass
+class PreparedAudio:
+    """Аудио, готовое для модели: 16 кГц, моно, float32."""
+    audio: np.ndarray
+    decode_time: float  # Время декодирования, сек.
+    trimmed: float  # Сколько секунд тишины обрезано
+
+    @property
+    def duration(self) -> float:
+        return len(self.audio) / SAMPLE_RATE
+
+
+def decode_audio(source: AudioSource) -> np.ndarray:
+    """
+    Декодировать OGG/Opus, MP3, MP4 и т.п. в 16 кГц моно float32.
+
+    Из контейнеров с видео (video_note) демультиплексируется только
+    звуковая дорожка, видеопакеты не декодируются.
+    """
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+    chunks = []
+
+    with av.open(open_audio(source), mode="r", metadata_errors="ignore") as container:
+        if not container.streams.audio:
+            raise ValueError("В файле нет звуковой дорожки")
+
+        stream = container.streams.audio[0]
+        for packet in container.demux(stream):
+            for frame in packet.decode():
+                for resampled in resampler.resample(frame):
+                    chunks.append(resampled.to_ndarray().reshape(-1))
+
+        # Остаток в буфере ресемплера
+        for resampled in resampler.resample(None):
+            chunks.append(resampled.to_ndarray().reshape(-1))
+
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+
+    audio = np.concatenate(chunks)
+    return audio.astype(np.float32) / 32768.0
+
+
+def trim_silence(audio: np.ndarray, threshold_db: float, padding: float) -> np.ndarray:
+    """
+    Обрезать тишину в начале и в конце.
+
+    Энергия считается векторно по кадрам ENERGY_FRAME_MS, тишина - кадры
+    с RMS ниже threshold_db (dBFS). По краям оставляется padding секунд.
+
+    Returns:
+        Представление исходного массива (без копирования)
+    """
+    frame = SAMPLE_RATE * ENERGY_FRAME_MS // 1000
+    frames_count = len(audio) // frame
+    if frames_count == 0:
+        return audio
+
+    frames = audio[:frames_count * frame].reshape(frames_count, frame)
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    loud = np.flatnonzero(rms > 10 ** (threshold_db / 20))
+    if loud.size == 0:
+        return audio[:0]
+
+    pad = int(padding * SAMPLE_RATE)
+    start = max(0, loud[0] * frame - pad)
+    end = min(len(audio), (loud[-1] + 1) * frame + pad)
+    return audio[start:end]
+
+
+def preprocess_audio(source: AudioSource) -> PreparedAudio:
+    """Декодировать аудио и обрезать тишину (синхронно, для воркера пула)."""
+    started = time.perf_counter()
+    audio = decode_audio(source)
+    decode_time = time.perf_counter() - started
+
+    original_length = len(audio)
+    if settings.audio_trim_silence:
+        audio = trim_silence(audio, settings.audio_silence_threshold_db, settings.audio_silence_padding)
+
+    prepared = PreparedAudio(
+        audio=audio,
+        decode_time=decode_time,
+        trimmed=(original_length - len(audio)) / SAMPLE_RATE
+    )
+    logger.info(
+        f"Аудио декодировано за {decode_time:.2f} сек.: {prepared.duration:.1f} сек., "
+        f"обрезано тишины {prepared.trimmed:.1f} сек."
+    )
+    return prepared
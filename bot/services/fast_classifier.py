@@ -0,0 +1,333 @@
+"""
+Быстрая локальная классификация сообщений без LLM.
+
+Очевидные случаи ("напомни завтра...", "потратил 500 на...", "купить молоко")
+определяются правилами на регулярных выражениях. Если правила не уверены,
+используется (если обучена) логистическая регрессия по хэшированным
+n-граммам на NumPy. Если не уверена и она - решение остаётся за LLM.
+
+Обучение модели на JSONL-файле со строками {"text": "...", "type": "finance"}:
+    python -m bot.services.fast_classifier train data.jsonl model.npz
+Проверка:
+    python -m bot.services.fast_classifier eval data.jsonl model.npz
+"""
+import re
+import json
+import zlib
+import argparse
+from dataclasses import dataclass
+from typing import Optional, List, Tuple, Dict, TYPE_CHECKING
+
+from config import settings
+from bot.models.database import MessageType
+from bot.utils.logger import logger
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+# Правила: (тип, регулярное выражение, вес). Вес 3 - явный признак,
+# 2 - сильный, 1 - слабый (сам по себе решения не даёт).
+RULES: List[Tuple[MessageType, str, float]] = [
+    (MessageType.REMINDER, r"\bнапомни(ть|те)?\b|\bнапоминани[ея]\b", 3),
+    (MessageType.REMINDER, r"\bне забыть\b|\bне забудь\b", 2),
+    (MessageType.REMINDER, r"\bзавтра\b|\bпослезавтра\b|\bчерез (час|\d+ (минут|час|дн|недел))|\bв \d{1,2}(:\d{2})?\b", 1),
+
+    (MessageType.FINANCE, r"\b(потратил|потратила|заплатил|заплатила|оплатил|оплатила)\b.*\d", 3),
+    (MessageType.FINANCE, r"\b(получил|получила|пришла|пришло)\b.*\b(зарплат|аванс|преми)", 3),
+    (MessageType.FINANCE, r"\d+\s*(руб|р\.|₽|тыс|\$|долл|евро|€)", 2),
+    (MessageType.FINANCE, r"\b(трат[аыи]|расход|доход|бюджет|кэшбэк)\w*", 1),
+
+    (MessageType.HOME, r"\b(купить|починить|убрать|помыть|постирать|погладить|пропылесосить|вынести мусор)\b", 2),
+    (MessageType.HOME, r"\b(молоко|хлеб|продукты|стиральн|посудомо|кран|лампочк)\w*", 1),
+
+    (MessageType.HEALTH, r"\b(болит|болела|болело|заболел|заболела|таблетк\w*|температур\w*|давлени\w*)\b", 3),
+    (MessageType.HEALTH, r"\b(плохо|хорошо|мало) спал[аи]?\b|\bсамочувстви\w*|\bтренировк\w*", 2),
+
+    (MessageType.STUDY, r"\b(лекци|конспект|семинар|вебинар)\w*", 3),
+    (MessageType.STUDY, r"\b(глав[аеуы]|курс[аеу]?|в книге|в статье|учебник\w*)\b", 1),
+
+    (MessageType.IDEAS, r"\bу меня (есть )?иде[яи]\b|\bбрейншторм\w*", 3),
+    (MessageType.IDEAS, r"\b(иде[яюи]|придумал|придумала|а что если|стартап\w*)\b", 2),
+
+    (MessageType.WORK, r"\b(созвон\w*|релиз\w*|деплой\w*|ретро|ревью|спринт\w*|баг\w*|тикет\w*)\b", 2),
+    (MessageType.WORK, r"\b(задач[аиу]|проект\w*|клиент\w*|дедлайн\w*)\b", 1),
+
+    (MessageType.DIARY, r"\b(я чувствую|чувствую себя|сегодня был[аи]? (день|тяжело|хорошо)|мне грустно|мне радостно)\b", 2),
+]
+
+COMPILED_RULES = [(message_type, re.compile(pattern, re.IGNORECASE), weight) for message_type, pattern, weight in RULES]
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Размерность хэшированного пространства признаков по умолчанию
+DEFAULT_DIM = 2 ** 16
+
+
+@dataclass
+class FastClassification:
+    """Результат локальной классификации."""
+    type: MessageType
+    confidence: float
+    source: str  # "rules" или "model"
+
+
+def hashed_features(text: str, dim: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Хэшированные признаки текста: слова, пары слов и символьные триграммы.
+
+    Returns:
+        (индексы признаков, нормированные количества)
+    """
+    import numpy as np
+
+    words = WORD_RE.findall(text.lower())
+    features = list(words)
+    features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+    for word in words:
+        padded = f"<{word}>"
+        features.extend(f"#{padded[i:i + 3]}" for i in range(len(padded) - 2))
+
+    if not features:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    # crc32 стабилен между процессами, в отличие от hash()
+    indices = np.fromiter((zlib.crc32(f.encode("utf-8")) % dim for f in features), dtype=np.int64, count=len(features))
+    indices, counts = np.unique(indices, return_counts=True)
+    # Нормировка, чтобы длинные тексты не давали слишком больших логитов
+    values = counts.astype(np.float32) / np.sqrt(len(features))
+    return indices, values
+
+
+def _softmax(logits: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+
+    exp = np.exp(logits - logits.max())
+    return exp / exp.sum()
+
+
+class HashedNgramModel:
+    """Многоклассовая логистическая регрессия по хэшированным n-граммам."""
+
+    def __init__(self, weights: "np.ndarray", bias: "np.ndarray", classes: List[str]):
+        self.weights = weights  # (классы, dim)
+        self.bias = bias
+        self.classes = classes
+
+    @property
+    def dim(self) -> int:
+        return self.weights.shape[1]
+
+    def predict_proba(self, text: str) -> "np.ndarray":
+        indices, values = hashed_features(text, self.dim)
+        logits = self.weights[:, indices] @ values + self.bias
+        return _softmax(logits)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        proba = self.predict_proba(text)
+        best = int(proba.argmax())
+        return self.classes[best], float(proba[best])
+
+    @classmethod
+    def load(cls, path: str) -> "HashedNgramModel":
+        import numpy as np
+
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                weights=data["weights"].astype(np.float32),
+                bias=data["bias"].astype(np.float32),
+                classes=[str(c) for c in data["classes"]]
+            )
+
+    def save(self, path: str):
+        import numpy as np
+
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, classes=np.array(self.classes))
+
+    @classmethod
+    def train(
+        cls,
+        texts: List[str],
+        labels: List[str],
+        dim: int = DEFAULT_DIM,
+        epochs: int = 10,
+        learning_rate: float = 0.5,
+        l2: float = 1e-5
+    ) -> "HashedNgramModel":
+        """Обучить модель стохастическим градиентным спуском."""
+        import numpy as np
+
+        classes = sorted(set(labels))
+        class_index = {c: i for i, c in enumerate(classes)}
+        weights = np.zeros((len(classes), dim), dtype=np.float32)
+        bias = np.zeros(len(classes), dtype=np.float32)
+
+        samples = [(hashed_features(text, dim), class_index[label]) for text, label in zip(texts, labels)]
+        rng = np.random.default_rng(0)
+
+        for epoch in range(epochs):
+            rate = learning_rate / (1 + epoch)
+            loss = 0.0
+            for i in rng.permutation(len(samples)):
+                (indices, values), target = samples[i]
+                proba = _softmax(weights[:, indices] @ values + bias)
+                loss -= float(np.log(proba[target] + 1e-9))
+
+                grad = proba
+                grad[target] -= 1.0
+                weights[:, indices] -= rate * (np.outer(grad, values) + l2 * weights[:, indices])
+                bias -= rate * grad
+            logger.info(f"Эпоха {epoch + 1}/{epochs}: loss {loss / max(1, len(samples)):.4f}")
+
+        return cls(weights, bias, classes)
+
+
+class FastClassifier:
+    """
+    Локальный классификатор: правила, затем (если есть) обученная модель.
+
+    Решение принимается только при достаточной уверенности, иначе
+    возвращается None и тип определяет LLM. Ведёт счётчики попаданий.
+    """
+
+    def __init__(self, model_path: Optional[str] = None):
+        self.model: Optional[HashedNgramModel] = None
+        if model_path:
+            try:
+                self.model = HashedNgramModel.load(model_path)
+                logger.info(f"Загружена модель быстрой классификации: {model_path} ({len(self.model.classes)} классов)")
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить модель быстрой классификации {model_path}: {e}")
+
+        self.total = 0
+        self.rule_hits = 0
+        self.model_hits = 0
+
+    def _classify_rules(self, text: str) -> Optional[FastClassification]:
+        scores: Dict[MessageType, float] = {}
+        for message_type, pattern, weight in COMPILED_RULES:
+            if pattern.search(text):
+                scores[message_type] = scores.get(message_type, 0.0) + weight
+
+        if not scores:
+            return None
+
+        best = max(scores, key=scores.get)
+        # Конкурирующие совпадения снижают уверенность
+        confidence = scores[best] / (sum(scores.values()) + 1.0)
+        if confidence < settings.fast_classifier_min_confidence:
+            return None
+        return FastClassification(type=best, confidence=confidence, source="rules")
+
+    def _classify_model(self, text: str) -> Optional[FastClassification]:
+        if self.model is None:
+            return None
+
+        label, confidence = self.model.predict(text)
+        if confidence < settings.fast_classifier_model_min_confidence:
+            return None
+        try:
+            message_type = MessageType(label)
+        except ValueError:
+            return None
+        if message_type == MessageType.UNKNOWN:
+            return None
+        return FastClassification(type=message_type, confidence=confidence, source="model")
+
+    def classify(self, text: str) -> Optional[FastClassification]:
+        """
+        Классифицировать текст локально.
+
+        Returns:
+            Результат или None, если решение нужно оставить LLM
+        """
+        self.total += 1
+
+        result = None
+        # Длинные тексты обычно смешанные (собрания, дневник) - только модель
+        if len(WORD_RE.findall(text)) <= settings.fast_classifier_max_words:
+            result = self._classify_rules(text)
+        if result is None:
+            result = self._classify_model(text)
+
+        if result is not None:
+            if result.source == "rules":
+                self.rule_hits += 1
+            else:
+                self.model_hits += 1
+            logger.info(
+                f"Быстрая классификация: {result.type.value} ({result.source}, {result.confidence:.2f}), "
+                f"доля без LLM {self.hit_rate:.0%}"
+            )
+        return result
+
+    @property
+    def hit_rate(self) -> float:
+        """Доля сообщений, классифицированных без LLM."""
+        return (self.rule_hits + self.model_hits) / self.total if self.total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "total": self.total,
+            "rule_hits": self.rule_hits,
+            "model_hits": self.model_hits,
+            "deferred": self.total - self.rule_hits - self.model_hits,
+            "hit_rate": round(self.hit_rate, 3)
+        }
+
+
+# Глобальный экземпляр
+_fast_classifier: Optional[FastClassifier] = None
+
+
+def get_fast_classifier() -> FastClassifier:
+    """Получить экземпляр быстрого классификатора."""
+    global _fast_classifier
+
+    if _fast_classifier is None:
+        _fast_classifier = FastClassifier(settings.fast_classifier_model_path)
+
+    return _fast_classifier
+
+
+def _read_dataset(path: str) -> Tuple[List[str], List[str]]:
+    texts, labels = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            texts.append(item["text"])
+            labels.append(str(item["type"]).lower())
+    return texts, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Быстрый классификатор сообщений")
+    parser.add_argument("command", choices=["train", "eval"])
+    parser.add_argument("dataset", help="JSONL со строками {\"text\": ..., \"type\": ...}")
+    parser.add_argument("model", help="Путь к файлу модели (.npz)")
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    parser.add_argument("--epochs", type=int, default=10)
+    options = parser.parse_args()
+
+    texts, labels = _read_dataset(options.dataset)
+
+    if options.command == "train":
+        model = HashedNgramModel.train(texts, labels, dim=options.dim, epochs=options.epochs)
+        model.save(options.model)
+        print(f"Модель сохранена: {options.model} ({len(texts)} примеров, классы: {', '.join(model.classes)})")
+        return
+
+    classifier = FastClassifier(options.model)
+    correct = 0
+    for text, label in zip(texts, labels):
+        result = classifier.classify(text)
+        if result is not None and result.type.value == label:
+            correct += 1
+    decided = classifier.total - classifier.stats()["deferred"]
+    print(f"Решено локально: {decided}/{len(texts)} ({classifier.hit_rate:.0%}), верно: {correct}/{decided or 1}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Кэш ответов LLM с объединением одинаковых одновременных запросов."""
+import json
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Tuple, Callable, Awaitable
+
+from sqlalchemy import select, delete, func
+
+from config import settings
+from bot.models.database import LLMResponseCache as CacheEntry
+from bot.storage.database import AsyncSessionLocal
+from bot.utils.logger import logger
+
+
+# Как часто (в записях) запускать вытеснение старых записей из базы
+EVICT_EVERY = 100
+
+
+def make_cache_key(provider: str, model: str, messages: List[Dict[str, str]], temperature: Optional[float]) -> str:
+    """Ключ кэша: sha256 от провайдера, модели, сообщений и температуры."""
+    payload = json.dumps(
+        {"provider": provider, "model": model, "messages": messages, "temperature": temperature},
+        ensure_ascii=False,
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Кэш ответов LLM в два уровня: LRU в памяти и (llm_cache_persistent)
+    таблица в базе бота, которая переживает перезапуск.
+
+    Одинаковые запросы, пришедшие одновременно, выполняются одним
+    обращением к провайдеру (singleflight): остальные ждут его результат.
+    """
+
+    def __init__(self):
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._puts = 0
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        created, response = item
+        if time.monotonic() - created > settings.llm_cache_ttl:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return response
+
+    def _put_memory(self, key: str, response: str):
+        self._memory[key] = (time.monotonic(), response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > settings.llm_cache_max_entries:
+            self._memory.popitem(last=False)
+
+    async def _get_db(self, keys: List[str]) -> Optional[Tuple[str, str]]:
+        ttl_border = datetime.utcnow() - timedelta(seconds=settings.llm_cache_ttl)
+        stmt = select(CacheEntry).where(CacheEntry.key.in_(keys), CacheEntry.created_at >= ttl_border)
+        try:
+            async with AsyncSessionLocal() as session:
+                entries = {entry.key: entry for entry in (await session.execute(stmt)).scalars()}
+                for key in keys:
+                    entry = entries.get(key)
+                    if entry is not None:
+                        entry.hits += 1
+                        entry.last_used_at = datetime.utcnow()
+                        await session.commit()
+                        return key, entry.response
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кэша LLM: {e}")
+        return None
+
+    async def get(self, keys: List[str]) -> Optional[Tuple[str, str]]:
+        """
+        Найти ответ по одному из ключей (в порядке предпочтения провайдеров).
+
+        Returns:
+            (ключ, ответ) или None
+        """
+        for key in keys:
+            response = self._get_memory(key)
+            if response is not None:
+                self.memory_hits += 1
+                return key, response
+
+        if settings.llm_cache_persistent:
+            found = await self._get_db(keys)
+            if found is not None:
+                key, response = found
+                self._put_memory(key, response)
+                self.db_hits += 1
+                return found
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, response: str, provider: str, model: str):
+        """Сохранить ответ."""
+        self._put_memory(key, response)
+        if not settings.llm_cache_persistent:
+            return
+
+        try:
+            async with AsyncSessionLocal() as session:
+                entry = (await session.execute(select(CacheEntry).where(CacheEntry.key == key))).scalar_one_or_none()
+                if entry is None:
+                    session.add(CacheEntry(key=key, provider=provider, model=model, response=response))
+                else:
+                    entry.response = response
+                    entry.created_at = entry.last_used_at = datetime.utcnow()
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка записи в кэш LLM: {e}")
+            return
+
+        self._puts += 1
+        if self._puts % EVICT_EVERY == 0:
+            await self.evict()
+
+    async def evict(self):
+        """Удалить из базы устаревшие записи и самые давно использованные сверх лимита."""
+        ttl_border = datetime.utcnow() - timedelta(seconds=settings.llm_cache_ttl)
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(delete(CacheEntry).where(CacheEntry.created_at < ttl_border))
+
+                count = (await session.execute(select(func.count(CacheEntry.id)))).scalar_one()
+                excess = count - settings.llm_cache_max_db_entries
+                if excess > 0:
+                    oldest = select(CacheEntry.id).order_by(CacheEntry.last_used_at).limit(excess)
+                    await session.execute(delete(CacheEntry).where(CacheEntry.id.in_(oldest)))
+
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка очистки кэша LLM: {e}")
+
+    async def singleflight(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполнить call, объединив одновременные вызовы с одинаковым ключом.
+        """
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # Отменён исходный запрос, а не ожидающий - выполняем сами
+                return await call()
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await call()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Исключение получат ожидающие, здесь пробрасываем сами
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> Dict[str, float]:
+        """Счётчики попаданий, промахов и объединённых запросов."""
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": hits / total if total else 0.0,
+            "memory_entries": len(self._memory)
+        }
+
+
+# Общий экземпляр кэша
+llm_cache = LLMCache()
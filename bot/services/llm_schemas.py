@@ -0,0 +1,245 @@
+"""Схемы структурированных ответов LLM и их разбор."""
+import json
+import re
+from typing import Optional, List, Dict, Any, Type, Tuple, Union
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator, model_validator
+
+from bot.models.database import MessageType
+
+
+class LLMResult(BaseModel):
+    """
+    Базовая схема ответа.
+
+    Лишние поля сохраняются, null вместо строки или списка заменяется
+    значением по умолчанию, одиночное значение вместо списка
+    оборачивается в список.
+    """
+    model_config = ConfigDict(extra="allow")
+
+    @model_validator(mode="before")
+    @classmethod
+    def _from_string(cls, value):
+        # Элемент списка строкой вместо объекта: "купить хлеб" -> {"title": "купить хлеб"}
+        if isinstance(value, str) and "title" in cls.model_fields:
+            return {"title": value}
+        return value
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def _coerce(cls, value, info):
+        field = cls.model_fields.get(info.field_name)
+        if field is None:
+            return value
+        if field.annotation in (str, Optional[str]):
+            # null - значение по умолчанию (если поле не Optional), число - строкой
+            if value is None and field.annotation is str:
+                return field.get_default(call_default_factory=True)
+            if isinstance(value, (int, float)):
+                return str(value)
+            return value
+        if getattr(field.annotation, "__origin__", None) is not list:
+            return value
+        if value is None:
+            return []
+        if not isinstance(value, list):
+            return [value]
+        return value
+
+
+class MeetingTask(LLMResult):
+    title: str = ""
+    assignee: Optional[str] = None
+    due_date: Optional[str] = None
+    description: Optional[str] = None
+
+
+class MeetingResult(LLMResult):
+    title: str = "Собрание"
+    summary: str = ""
+    participants: List[str] = Field(default_factory=list)
+    tasks: List[MeetingTask] = Field(default_factory=list)
+    decisions: List[str] = Field(default_factory=list)
+    key_points: List[str] = Field(default_factory=list)
+
+
+class ReminderResult(LLMResult):
+    text: str = ""
+    reminder_date: Optional[str] = None
+    relative_time: Optional[str] = None
+    needs_clarification: bool = False
+
+
+class ArchiveResult(LLMResult):
+    title: str = "Заметка"
+    summary: str = ""
+    content: str = ""
+    tags: List[str] = Field(default_factory=list)
+
+
+class DiaryResult(LLMResult):
+    title: str = "Дневник"
+    summary: str = ""
+    content: str = ""
+    thoughts: List[str] = Field(default_factory=list)
+    emotions: List[str] = Field(default_factory=list)
+
+
+class WorkResult(LLMResult):
+    title: str = "Рабочая заметка"
+    project_context: Optional[str] = None
+    done: List[str] = Field(default_factory=list)
+    planned: List[str] = Field(default_factory=list)
+    problems: List[str] = Field(default_factory=list)
+    ideas: List[str] = Field(default_factory=list)
+
+
+class HomeTask(LLMResult):
+    category: Optional[str] = None
+    title: str = ""
+    description: Optional[str] = None
+
+
+class HomeResult(LLMResult):
+    tasks: List[HomeTask] = Field(default_factory=list)
+
+
+class StudyResult(LLMResult):
+    topic: str = ""
+    key_points: List[str] = Field(default_factory=list)
+    definitions: List[str] = Field(default_factory=list)
+    examples: List[str] = Field(default_factory=list)
+    questions: List[str] = Field(default_factory=list)
+    follow_up_tasks: List[str] = Field(default_factory=list)
+
+
+class Idea(LLMResult):
+    title: str = ""
+    description: Optional[str] = None
+    category: Optional[str] = None
+    next_step: Optional[str] = None
+
+
+class IdeasResult(LLMResult):
+    ideas: List[Idea] = Field(default_factory=list)
+
+
+class HealthResult(LLMResult):
+    symptoms: List[str] = Field(default_factory=list)
+    actions: List[str] = Field(default_factory=list)
+    triggers: List[str] = Field(default_factory=list)
+    notes: Optional[str] = None
+
+
+class Transaction(LLMResult):
+    amount: Union[float, str, None] = None
+    category: Optional[str] = None
+    subcategory: Optional[str] = None
+    description: Optional[str] = None
+
+
+class FinanceResult(LLMResult):
+    transactions: List[Transaction] = Field(default_factory=list)
+
+
+class Classification(LLMResult):
+    type: str = "UNKNOWN"
+    confidence: float = 0.0
+    reason: str = ""
+
+
+class CombinedResult(Classification):
+    data: Dict[str, Any] = Field(default_factory=dict)
+
+
+# Схема данных по типу сообщения
+RESULT_SCHEMAS: Dict[str, Type[LLMResult]] = {
+    MessageType.MEETING.value: MeetingResult,
+    MessageType.REMINDER.value: ReminderResult,
+    MessageType.ARCHIVE.value: ArchiveResult,
+    MessageType.DIARY.value: DiaryResult,
+    MessageType.WORK.value: WorkResult,
+    MessageType.HOME.value: HomeResult,
+    MessageType.STUDY.value: StudyResult,
+    MessageType.IDEAS.value: IdeasResult,
+    MessageType.HEALTH.value: HealthResult,
+    MessageType.FINANCE.value: FinanceResult,
+}
+
+# JSON Schema для режима структурированного вывода провайдеров (строится один раз)
+JSON_SCHEMAS: Dict[Type[LLMResult], Dict[str, Any]] = {
+    schema: schema.model_json_schema()
+    for schema in (*RESULT_SCHEMAS.values(), Classification, CombinedResult)
+}
+
+
+TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+
+def extract_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Найти JSON-объект в ответе LLM.
+
+    Пропускает текст до и после объекта (пояснения, ```json), находит
+    парную закрывающую скобку с учётом строк, допускает запятую перед
+    закрывающей скобкой.
+    """
+    start = text.find("{")
+    while start >= 0:
+        depth = 0
+        in_string = False
+        escape = False
+        for i in range(start, len(text)):
+            ch = text[i]
+            if in_string:
+                if escape:
+                    escape = False
+                elif ch == "\\":
+                    escape = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    candidate = text[start:i + 1]
+                    for attempt in (candidate, TRAILING_COMMA_RE.sub(r"\1", candidate)):
+                        try:
+                            result = json.loads(attempt)
+                        except json.JSONDecodeError:
+                            continue
+                        if isinstance(result, dict):
+                            return result
+                    break
+        start = text.find("{", start + 1)
+    return None
+
+
+def parse_result(response: str, schema: Type[LLMResult]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Разобрать ответ по схеме.
+
+    Returns:
+        (данные, None) или (None, описание ошибки для запроса исправления)
+    """
+    data = extract_json_object(response)
+    if data is None:
+        return None, "в ответе нет корректного JSON-объекта"
+    try:
+        return schema.model_validate(data).model_dump(), None
+    except ValidationError as e:
+        return None, "; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()[:5]
+        )
+
+
+def validate_result(message_type: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Проверить данные по схеме типа (None, если не подходят)."""
+    try:
+        return RESULT_SCHEMAS[message_type].model_validate(data).model_dump()
+    except (KeyError, ValidationError):
+        return None
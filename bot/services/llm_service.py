@@ -1,14 +1,42 @@
 """Сервис для работы с LLM."""
 import json
-from typing import Optional, Dict, Any, List
+import time
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, List, Tuple, Type, Callable, Awaitable
 from enum import Enum
 
 import httpx
 
+try:
+    import h2  # noqa: F401 - нужен httpx для HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 from config import settings
+from bot.services.fast_classifier import get_fast_classifier
+from bot.services.text_chunking import estimate_tokens, split_text, merge_extractions
+from bot.services.llm_cache import llm_cache, make_cache_key
+from bot.services.llm_schemas import (
+    LLMResult, Classification, CombinedResult, RESULT_SCHEMAS, JSON_SCHEMAS,
+    parse_result, validate_result
+)
+from bot.utils.partial_json import parse_partial_json
 from bot.utils.logger import logger
 
 
+# Температура генерации (входит в ключ кэша ответов)
+TEMPERATURE = 0.7
+
+# Получает накопленный текст потокового ответа
+TextCallback = Callable[[str], Awaitable[None]]
+# Получает тип сообщения (если уже известен) и частично разобранные данные
+PartialCallback = Callable[[Optional[str], Dict[str, Any]], Awaitable[None]]
+
+
 class LLMProvider(str, Enum):
     """Провайдеры LLM."""
     FREEWEN = "freewen"
@@ -16,6 +44,567 @@ class LLMProvider(str, Enum):
     LOCAL = "local"
 
 
+# Описание типов для классификации
+MESSAGE_TYPES_DESCRIPTION = """Типы сообщений:
+1. MEETING - собрание/митинг: диалог нескольких людей, обсуждение задач, планов
+2. REMINDER - напоминание: короткая фраза с явным будущим действием/датой ("напомни", "завтра", "через час")
+3. ARCHIVE - архив: описательная речь о том, что сделано/делается, без явного запроса
+4. DIARY - личный дневник: поток мыслей, переживаний, планов ("сегодня было...", "я чувствую...", "надо подумать о...")
+5. WORK - работа: наброски по задачам, размышления о проекте, технические идеи, ретро, ревью дня
+6. HOME - дом/быт: домашние дела ("купить", "починить", "убрать", "сделать с детьми/родителями")
+7. STUDY - обучение: конспекты с лекций, курсов, книг, статей
+8. IDEAS - идеи/брейншторм: поток идей, стартапы, фичи, сценарии, "надо бы сделать..."
+9. HEALTH - здоровье: заметки о самочувствии ("плохо спал", "болит голова", "выпил таблетки", "тренировка")
+10. FINANCE - финансы: надиктовка трат и доходов ("потратил столько-то на...", "получил зарплату...")"""
+
+TYPE_CHOICES = '"MEETING" | "REMINDER" | "ARCHIVE" | "DIARY" | "WORK" | "HOME" | "STUDY" | "IDEAS" | "HEALTH" | "FINANCE"'
+
+# Типы, длинные расшифровки которых обрабатываются по частям
+MAP_REDUCE_TYPES = ("meeting", "archive", "study")
+
+# Извлечение данных по типу сообщения: (роль помощника, задание, формат JSON)
+EXTRACTION_SPECS: Dict[str, Tuple[str, str, str]] = {
+    "meeting": (
+        "анализа собраний",
+        "Проанализируй расшифровку собрания и создай структурированный отчёт.",
+        """{
+    "title": "краткий заголовок встречи",
+    "summary": "краткое резюме (2-3 предложения)",
+    "participants": ["имя1", "имя2", ...],
+    "tasks": [
+        {
+            "title": "название задачи",
+            "assignee": "исполнитель (если известен)",
+            "due_date": "срок (если упомянут)",
+            "description": "описание"
+        }
+    ],
+    "decisions": ["решение1", "решение2", ...],
+    "key_points": ["важный момент1", "важный момент2", ...]
+}"""
+    ),
+    "reminder": (
+        "обработки напоминаний",
+        "Проанализируй расшифровку напоминания и извлеки информацию.",
+        """{
+    "text": "текст напоминания",
+    "reminder_date": "дата/время если указано явно (YYYY-MM-DD HH:MM или null)",
+    "relative_time": "относительное время если указано ('через час', 'завтра', 'через неделю' или null)",
+    "needs_clarification": true/false
+}"""
+    ),
+    "archive": (
+        "создания структурированных заметок",
+        "Преобразуй расшифровку в структурированную статью/заметку.",
+        """{
+    "title": "заголовок статьи",
+    "summary": "краткое резюме (2-3 предложения)",
+    "content": "структурированный текст с подзаголовками и списками (markdown формат)",
+    "tags": ["тег1", "тег2", ...]
+}"""
+    ),
+    "diary": (
+        "ведения личного дневника",
+        "Преобразуй расшифровку в запись личного дневника.",
+        """{
+    "title": "заголовок записи",
+    "summary": "краткое резюме (2-3 предложения)",
+    "content": "полный текст записи",
+    "thoughts": ["мысль1", "мысль2", ...],
+    "emotions": ["эмоция1", "эмоция2", ...]
+}"""
+    ),
+    "work": (
+        "ведения рабочих заметок",
+        "Преобразуй расшифровку в рабочую заметку.",
+        """{
+    "title": "заголовок заметки",
+    "project_context": "контекст проекта/задачи",
+    "done": ["выполненная задача1", "выполненная задача2", ...],
+    "planned": ["запланированная задача1", "запланированная задача2", ...],
+    "problems": ["проблема/риск1", "проблема/риск2", ...],
+    "ideas": ["идея1", "идея2", ...]
+}"""
+    ),
+    "home": (
+        "управления бытовыми задачами",
+        "Извлеки бытовые задачи из расшифровки.",
+        """{
+    "tasks": [
+        {
+            "category": "покупки" | "ремонт" | "бытовые" | "семейные",
+            "title": "название задачи",
+            "description": "описание (опционально)"
+        }
+    ]
+}"""
+    ),
+    "study": (
+        "создания учебных конспектов",
+        "Преобразуй расшифровку в структурированный учебный конспект.",
+        """{
+    "topic": "тема конспекта",
+    "key_points": ["ключевой тезис1", "ключевой тезис2", ...],
+    "definitions": ["определение1", "определение2", ...],
+    "examples": ["пример1", "пример2", ...],
+    "questions": ["вопрос для самопроверки1", "вопрос2", ...],
+    "follow_up_tasks": ["задача1 (например, 'разобрать главу 3')", "задача2", ...]
+}"""
+    ),
+    "ideas": (
+        "фиксации идей",
+        "Извлеки идеи из расшифровки брейншторма.",
+        """{
+    "ideas": [
+        {
+            "title": "название идеи",
+            "description": "описание идеи",
+            "category": "работа" | "личное" | "проект" | null,
+            "next_step": "MVP-шаг или следующий минимальный шаг"
+        }
+    ]
+}"""
+    ),
+    "health": (
+        "ведения лога здоровья",
+        "Извлеки информацию о здоровье из расшифровки.",
+        """{
+    "symptoms": ["симптом1", "симптом2", ...],
+    "actions": ["действие1 (лекарство, тренировка и т.п.)", "действие2", ...],
+    "triggers": ["возможный триггер1", "триггер2", ...],
+    "notes": "дополнительные заметки"
+}"""
+    ),
+    "finance": (
+        "учёта финансов",
+        "Извлеки финансовую информацию из расшифровки.",
+        """{
+    "transactions": [
+        {
+            "amount": число (сумма),
+            "category": "доход" | "расход",
+            "subcategory": "еда" | "транспорт" | "зарплата" | "развлечения" | "другое",
+            "description": "описание операции"
+        }
+    ]
+}"""
+    ),
+}
+
+
+def _parse_stream_line(line: str, ollama: bool) -> Optional[str]:
+    """Фрагмент текста из строки потокового ответа (NDJSON Ollama или SSE)."""
+    line = line.strip()
+    if not line:
+        return None
+    
+    if ollama:
+        chunk = json.loads(line)
+        return chunk.get("message", {}).get("content")
+    
+    # SSE: "data: {...}", комментарии (": ...") пропускаются
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return None
+    choices = json.loads(data).get("choices") or []
+    if not choices:
+        return None
+    return (choices[0].get("delta") or {}).get("content")
+
+
+def _partial_json_callback(on_partial: Optional[PartialCallback], message_type: Optional[str] = None) -> Optional[TextCallback]:
+    """
+    Обёртка для chat(on_text=...): разбирает неполный JSON и передаёт
+    в on_partial новые данные.
+    
+    Без message_type ожидается ответ комбинированного запроса
+    ({"type": ..., "data": {...}}), и в on_partial уходит поле data.
+    """
+    if on_partial is None:
+        return None
+    last = None
+    
+    async def on_text(text: str):
+        nonlocal last
+        partial = parse_partial_json(text)
+        if not partial or partial == last:
+            return
+        last = partial
+        
+        if message_type is not None:
+            await on_partial(message_type, partial)
+            return
+        
+        data = partial.get("data")
+        if isinstance(data, dict) and data:
+            partial_type = partial.get("type")
+            await on_partial(str(partial_type).lower() if partial_type else None, data)
+    
+    return on_text
+
+
+def _openai_response_format(schema: Optional[Dict[str, Any]], allow_json_object: bool = True) -> Dict[str, Any]:
+    """Поле response_format OpenAI-совместимого API по llm_json_mode."""
+    if schema is None or settings.llm_json_mode == "off":
+        return {}
+    if settings.llm_json_mode == "schema":
+        return {"response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": schema.get("title", "result"), "schema": schema}
+        }}
+    if not allow_json_object:
+        return {}
+    return {"response_format": {"type": "json_object"}}
+
+
+def _ollama_format(schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Поле format Ollama по llm_json_mode (JSON Schema поддерживается с Ollama 0.5)."""
+    if schema is None or settings.llm_json_mode == "off":
+        return {}
+    return {"format": schema if settings.llm_json_mode == "schema" else "json"}
+
+
+class LatencyWindow:
+    """Скользящее окно времени успешных ответов провайдера."""
+    
+    def __init__(self, size: int):
+        self._samples = deque(maxlen=size)
+    
+    def record(self, latency: float):
+        self._samples.append(latency)
+    
+    def __len__(self) -> int:
+        return len(self._samples)
+    
+    def percentile(self, q: float) -> Optional[float]:
+        """Перцентиль (q от 0 до 1) или None, если замеров нет."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
+
+
+class CircuitState(str, Enum):
+    """Состояния автомата отключения провайдера."""
+    CLOSED = "closed"  # Работает
+    OPEN = "open"  # Отключён, запросы не отправляются
+    HALF_OPEN = "half_open"  # Пробный запрос после паузы
+
+
+class CircuitBreaker:
+    """
+    Автомат отключения провайдера по окну последних вызовов.
+    
+    Окно - последние llm_breaker_window вызовов не старше
+    llm_breaker_window_seconds. Неудачным считается вызов с ошибкой или
+    дольше llm_breaker_slow_call. Если доля неудачных в окне достигла
+    llm_breaker_error_rate, провайдер
+    отключается на llm_breaker_open_seconds, затем пропускается один
+    пробный запрос: успех возвращает провайдера, ошибка - снова отключает.
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CircuitState.CLOSED
+        self._outcomes = deque(maxlen=settings.llm_breaker_window)  # (время, удачный ли вызов)
+        self._opened_at = 0.0
+        # Номера вызовов: последний выданный, пробный и последний до закрытия
+        self._last_call = 0
+        self._probe: Optional[int] = None
+        self._closed_after = 0
+        self.trips = 0
+    
+    def _prune(self):
+        expire_before = time.monotonic() - settings.llm_breaker_window_seconds
+        while self._outcomes and self._outcomes[0][0] < expire_before:
+            self._outcomes.popleft()
+    
+    @property
+    def calls(self) -> int:
+        self._prune()
+        return len(self._outcomes)
+    
+    @property
+    def error_rate(self) -> float:
+        self._prune()
+        if not self._outcomes:
+            return 0.0
+        return 1 - sum(success for _, success in self._outcomes) / len(self._outcomes)
+    
+    @property
+    def health(self) -> float:
+        """
+        Оценка здоровья от 0 до 1 (для порядка провайдеров).
+        
+        Пока вызовов мало, а также для пробного запроса провайдер
+        считается здоровым, чтобы не лишать его трафика навсегда.
+        """
+        if self.state == CircuitState.OPEN:
+            return 0.0
+        if self.state == CircuitState.HALF_OPEN or self.calls < settings.llm_breaker_min_calls:
+            return 1.0
+        return 1 - self.error_rate
+    
+    def available(self) -> bool:
+        """Можно ли отправить запрос сейчас (без резервирования пробного)."""
+        if self.state == CircuitState.OPEN:
+            if time.monotonic() - self._opened_at < settings.llm_breaker_open_seconds:
+                return False
+            self._set_state(CircuitState.HALF_OPEN)
+        
+        return not (self.state == CircuitState.HALF_OPEN and self._probe is not None)
+    
+    def allow(self) -> Optional[int]:
+        """
+        Занять право на запрос.
+        
+        Returns:
+            Номер вызова для record/release или None, если запрос сейчас
+            отправлять нельзя. В полуоткрытом состоянии выдаётся единственный
+            пробный вызов.
+        """
+        if not self.available():
+            return None
+        self._last_call += 1
+        if self.state == CircuitState.HALF_OPEN:
+            self._probe = self._last_call
+        return self._last_call
+    
+    def record(self, call: int, success: bool, latency: Optional[float] = None):
+        """
+        Записать результат вызова call (номер из allow).
+        
+        Состояние после отключения меняет только пробный вызов. Результаты
+        вызовов, начатых до отключения или до закрытия автомата, не
+        учитываются: медленный старый запрос не должен ни закрыть, ни снова
+        открыть автомат.
+        """
+        if success and latency is not None and latency > settings.llm_breaker_slow_call:
+            success = False
+        
+        if call == self._probe:
+            self._probe = None
+            if success:
+                self._outcomes.clear()
+                self._closed_after = self._last_call
+                self._set_state(CircuitState.CLOSED)
+            else:
+                self._open()
+            return
+        
+        if self.state != CircuitState.CLOSED or call <= self._closed_after:
+            return
+        
+        self._outcomes.append((time.monotonic(), success))
+        if (
+            self.calls >= settings.llm_breaker_min_calls
+            and self.error_rate >= settings.llm_breaker_error_rate
+        ):
+            self._open()
+    
+    def release(self, call: int):
+        """Вызов отменён без результата (например, проиграл хеджирование)."""
+        if call == self._probe:
+            self._probe = None
+    
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self.trips += 1
+        self._set_state(CircuitState.OPEN)
+    
+    def _set_state(self, state: CircuitState):
+        if state != self.state:
+            logger.warning(f"Провайдер LLM {self.name}: {self.state.value} -> {state.value}")
+            self.state = state
+    
+    def stats(self) -> dict:
+        return {
+            "state": self.state.value,
+            "error_rate": round(self.error_rate, 3),
+            "health": round(self.health, 3),
+            "calls": self.calls,
+            "trips": self.trips
+        }
+
+
+class ProviderOverloaded(Exception):
+    """Провайдер перегружен: ответ 429/503 или таймаут."""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Заголовок Retry-After (секунды или HTTP-дата) в секундах ожидания."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveLimiter:
+    """
+    Адаптивный предел одновременных запросов к провайдеру (AIMD).
+    
+    Предел растёт на llm_limit_increase за каждые limit успешных ответов,
+    пока запросы упираются в него, и умножается на llm_limit_backoff при
+    перегрузке: 429/503, таймаут или ответ дольше медианы в
+    llm_limit_latency_factor раз. Снижение срабатывает один раз на волну:
+    запросы, начатые до предыдущего снижения, его не повторяют.
+    
+    После 429/503 провайдер ставится на паузу по Retry-After. Ожидающие
+    запросы обслуживаются строго по очереди (FIFO).
+    """
+    
+    def __init__(self, name: str, max_limit: int, latency: LatencyWindow):
+        self.name = name
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(settings.llm_limit_min, self.max_limit))
+        self.limit = float(min(self.max_limit, max(self.min_limit, settings.llm_limit_initial)))
+        self.in_flight = 0
+        self._latency = latency
+        self._waiters: deque = deque()
+        self._paused_until = 0.0
+        self._wake_handle: Optional[asyncio.TimerHandle] = None
+        self._last_decrease = 0.0
+        # Время ожидания в очереди
+        self.wait = LatencyWindow(settings.llm_latency_window)
+        self.acquired = 0
+        self.queued = 0
+        self.throttled = 0
+        self.decreases = 0
+    
+    @property
+    def paused_for(self) -> float:
+        """Сколько ещё длится пауза по Retry-After, секунд."""
+        return max(0.0, self._paused_until - time.monotonic())
+    
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit) and self.paused_for == 0
+    
+    async def acquire(self) -> float:
+        """
+        Занять место, при необходимости дождавшись очереди.
+        
+        Returns:
+            Момент начала запроса (передаётся в release)
+        """
+        requested = time.monotonic()
+        if not self._waiters and self._has_capacity():
+            self.in_flight += 1
+        else:
+            self.queued += 1
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            self._schedule_wake()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Место уже выдано - возвращаем его следующему
+                    self.in_flight -= 1
+                    self._wake()
+                else:
+                    try:
+                        self._waiters.remove(future)
+                    except ValueError:
+                        pass
+                raise
+        
+        started = time.monotonic()
+        self.acquired += 1
+        self.wait.record(started - requested)
+        return started
+    
+    def release(self, started: float, success: bool, latency: Optional[float] = None):
+        """Освободить место и подстроить предел по результату запроса."""
+        saturated = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        
+        if success:
+            if self._is_slow(latency):
+                self._decrease(started, f"ответ за {latency:.1f} с")
+            elif saturated and self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + settings.llm_limit_increase / self.limit)
+        self._wake()
+    
+    def overloaded(self, started: float, retry_after: Optional[float] = None):
+        """
+        Освободить место после перегрузки провайдера.
+        
+        retry_after - пауза из Retry-After; None означает таймаут
+        (предел снижается, пауза не ставится).
+        """
+        self.in_flight -= 1
+        self.throttled += 1
+        self._decrease(started, "перегрузка")
+        if retry_after is not None:
+            pause = min(settings.llm_retry_after_max, retry_after)
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            logger.warning(f"Провайдер LLM {self.name}: пауза {pause:.1f} с по Retry-After")
+        self._wake()
+    
+    def _is_slow(self, latency: Optional[float]) -> bool:
+        factor = settings.llm_limit_latency_factor
+        if not factor or latency is None or len(self._latency) < settings.llm_hedge_min_samples:
+            return False
+        return latency > factor * self._latency.percentile(0.5)
+    
+    def _decrease(self, started: float, reason: str):
+        if started < self._last_decrease:
+            return
+        self._last_decrease = time.monotonic()
+        self.decreases += 1
+        self.limit = max(self.min_limit, self.limit * settings.llm_limit_backoff)
+        logger.info(f"Провайдер LLM {self.name}: предел снижен до {int(self.limit)} ({reason})")
+    
+    def _wake(self):
+        """Выдать освободившиеся места первым в очереди."""
+        while self._waiters and self._has_capacity():
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+        self._schedule_wake()
+    
+    def _schedule_wake(self):
+        """Разбудить очередь, когда закончится пауза."""
+        if not self._waiters or self._wake_handle is not None:
+            return
+        pause = self.paused_for
+        if pause > 0:
+            def wake():
+                self._wake_handle = None
+                self._wake()
+            self._wake_handle = asyncio.get_running_loop().call_later(pause, wake)
+    
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "paused_for": round(self.paused_for, 1),
+            "queued": self.queued,
+            "throttled": self.throttled,
+            "limit_decreases": self.decreases,
+            "queue_wait_p50": self.wait.percentile(0.5),
+            "queue_wait_p95": self.wait.percentile(0.95)
+        }
+
+
 class LLMClient:
     """Клиент для работы с различными LLM."""
     
@@ -26,8 +615,132 @@ class LLMClient:
             LLMProvider.LOCAL         # Fallback: локальный Ollama (Qwen)
         ]
         self.timeout = 60.0
+        # Долгоживущие клиенты (пулы соединений) по провайдерам
+        self._clients: Dict[LLMProvider, httpx.AsyncClient] = {}
+        # Время ответов по провайдерам (для задержки хеджирования)
+        self.latency: Dict[LLMProvider, LatencyWindow] = {
+            prov: LatencyWindow(settings.llm_latency_window) for prov in LLMProvider
+        }
+        self.breakers: Dict[LLMProvider, CircuitBreaker] = {
+            prov: CircuitBreaker(prov.value) for prov in LLMProvider
+        }
+        # Разбор структурированных ответов по провайдерам
+        self.parse_stats: Dict[LLMProvider, Dict[str, int]] = {
+            prov: {"parsed": 0, "failed": 0, "repairs": 0, "repaired": 0} for prov in LLMProvider
+        }
+        # Обработчики потокового ответа объединённых запросов (по ключу singleflight)
+        self._listeners: Dict[str, List[TextCallback]] = {}
+        # Адаптивный предел одновременных запросов к каждому провайдеру
+        self.limiters: Dict[LLMProvider, AdaptiveLimiter] = {
+            prov: AdaptiveLimiter(
+                prov.value,
+                settings.local_llm_max_concurrency if prov == LLMProvider.LOCAL
+                else settings.llm_provider_max_concurrency,
+                self.latency[prov]
+            )
+            for prov in LLMProvider
+        }
     
-    async def _call_freewen(self, messages: List[Dict[str, str]]) -> Optional[str]:
+    def _get_client(self, provider: LLMProvider) -> httpx.AsyncClient:
+        """Получить HTTP-клиент провайдера (создаётся один раз, соединения переиспользуются)."""
+        client = self._clients.get(provider)
+        if client is None or client.is_closed:
+            http2 = settings.llm_http2 and HTTP2_AVAILABLE
+            if settings.llm_http2 and not HTTP2_AVAILABLE:
+                logger.warning("Пакет h2 не установлен, HTTP/2 для LLM отключён")
+            
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=settings.llm_max_connections,
+                    max_keepalive_connections=settings.llm_max_keepalive_connections,
+                    keepalive_expiry=settings.llm_keepalive_expiry
+                )
+            )
+            self._clients[provider] = client
+        return client
+    
+    async def aclose(self):
+        """Закрыть все HTTP-клиенты."""
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+    
+    async def _request(
+        self,
+        provider: LLMProvider,
+        url: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]] = None,
+        ollama: bool = False,
+        on_text: Optional[TextCallback] = None
+    ) -> str:
+        """
+        Отправить запрос провайдеру.
+        
+        Если передан on_text (и включён llm_streaming), ответ читается
+        потоком: SSE для OpenAI-совместимых API, NDJSON для Ollama;
+        on_text получает накопленный текст после каждого фрагмента.
+        
+        Raises:
+            ProviderOverloaded: ответ 429/503 или таймаут
+        """
+        client = self._get_client(provider)
+        
+        try:
+            return await self._send(client, url, payload, headers, ollama, on_text)
+        except httpx.TimeoutException as e:
+            raise ProviderOverloaded(f"таймаут: {e!r}") from e
+    
+    @staticmethod
+    def _check_status(response: httpx.Response):
+        if response.status_code in (429, 503):
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            raise ProviderOverloaded(
+                f"HTTP {response.status_code}",
+                settings.llm_retry_after_default if retry_after is None else retry_after
+            )
+        response.raise_for_status()
+    
+    async def _send(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        payload: Dict[str, Any],
+        headers: Optional[Dict[str, str]],
+        ollama: bool,
+        on_text: Optional[TextCallback]
+    ) -> str:
+        if on_text is None or not settings.llm_streaming:
+            response = await client.post(url, json=payload, headers=headers)
+            self._check_status(response)
+            data = response.json()
+            if ollama:
+                return data.get("message", {}).get("content", "")
+            return data["choices"][0]["message"]["content"]
+        
+        parts = []
+        async with client.stream("POST", url, json={**payload, "stream": True}, headers=headers) as response:
+            self._check_status(response)
+            async for line in response.aiter_lines():
+                delta = _parse_stream_line(line, ollama)
+                if not delta:
+                    continue
+                parts.append(delta)
+                try:
+                    await on_text("".join(parts))
+                except Exception as e:
+                    # Ошибка отображения не должна прерывать ответ
+                    logger.debug(f"Ошибка обработки фрагмента ответа: {e}")
+        return "".join(parts)
+    
+    async def _call_freewen(
+        self,
+        messages: List[Dict[str, str]],
+        on_text: Optional[TextCallback] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
         """Вызов FreeQwenApi."""
         try:
             # FreeQwenApi использует OpenAI-совместимый эндпоинт
@@ -41,20 +754,23 @@ class LLMClient:
             payload = {
                 "model": settings.freewen_model,
                 "messages": messages,
-                "temperature": 0.7,
+                "temperature": TEMPERATURE,
                 "max_tokens": 2000
             }
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(url, json=payload, headers=headers)
-                response.raise_for_status()
-                data = response.json()
-                return data["choices"][0]["message"]["content"]
+            return await self._request(LLMProvider.FREEWEN, url, payload, headers, on_text=on_text)
+        except ProviderOverloaded:
+            raise
         except Exception as e:
             logger.warning(f"Ошибка вызова FreeQwenApi: {e}")
             return None
     
-    async def _call_openrouter(self, messages: List[Dict[str, str]]) -> Optional[str]:
+    async def _call_openrouter(
+        self,
+        messages: List[Dict[str, str]],
+        on_text: Optional[TextCallback] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
         """Вызов OpenRouter."""
         try:
             if not settings.openrouter_api_key:
@@ -71,20 +787,24 @@ class LLMClient:
             payload = {
                 "model": settings.openrouter_model,
                 "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 2000
+                "temperature": TEMPERATURE,
+                "max_tokens": 2000,
+                **_openai_response_format(schema)
             }
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(url, json=payload, headers=headers)
-                response.raise_for_status()
-                data = response.json()
-                return data["choices"][0]["message"]["content"]
+            return await self._request(LLMProvider.OPENROUTER, url, payload, headers, on_text=on_text)
+        except ProviderOverloaded:
+            raise
         except Exception as e:
             logger.warning(f"Ошибка вызова OpenRouter: {e}")
             return None
     
-    async def _call_local(self, messages: List[Dict[str, str]]) -> Optional[str]:
+    async def _call_local(
+        self,
+        messages: List[Dict[str, str]],
+        on_text: Optional[TextCallback] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
         """Вызов локальной LLM."""
         try:
             if settings.local_llm_api_type == "ollama":
@@ -92,7 +812,8 @@ class LLMClient:
                 payload = {
                     "model": settings.local_llm_model,
                     "messages": messages,
-                    "stream": False
+                    "stream": False,
+                    **_ollama_format(schema)
                 }
             elif settings.local_llm_api_type in ["lmstudio", "textgen"]:
                 # OpenAI-совместимый API
@@ -100,60 +821,444 @@ class LLMClient:
                 payload = {
                     "model": settings.local_llm_model,
                     "messages": messages,
-                    "temperature": 0.7,
-                    "max_tokens": 2000
+                    "temperature": TEMPERATURE,
+                    "max_tokens": 2000,
+                    # LM Studio и text-generation-webui не знают json_object
+                    **_openai_response_format(schema, allow_json_object=False)
                 }
             else:
                 logger.error(f"Неизвестный тип локального API: {settings.local_llm_api_type}")
                 return None
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(url, json=payload)
-                response.raise_for_status()
-                data = response.json()
-                
-                if settings.local_llm_api_type == "ollama":
-                    return data.get("message", {}).get("content", "")
-                else:
-                    return data["choices"][0]["message"]["content"]
+            return await self._request(
+                LLMProvider.LOCAL,
+                url,
+                payload,
+                ollama=settings.local_llm_api_type == "ollama",
+                on_text=on_text
+            )
+        except ProviderOverloaded:
+            raise
         except Exception as e:
             logger.warning(f"Ошибка вызова локальной LLM: {e}")
             return None
     
-    async def chat(self, messages: List[Dict[str, str]], provider: Optional[LLMProvider] = None) -> Optional[str]:
+    async def _call_provider(
+        self,
+        provider: LLMProvider,
+        messages: List[Dict[str, str]],
+        on_text: Optional[TextCallback] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
+        """
+        Вызвать провайдера и записать время успешного ответа.
+        
+        Запрос ждёт места в очереди провайдера (AdaptiveLimiter), ожидание
+        во время ответа не входит. После 429/503 запрос повторяется
+        до llm_rate_limit_retries раз, когда закончится пауза по Retry-After.
+        """
+        if not self._configured(provider):
+            # Ошибка настройки, а не сбой провайдера: автомат не трогаем
+            logger.warning(f"Провайдер {provider.value} не настроен")
+            return None
+        
+        breaker = self.breakers[provider] if settings.llm_breaker_enabled else None
+        call = breaker.allow() if breaker is not None else None
+        if breaker is not None and call is None:
+            logger.info(f"Провайдер {provider.value} временно отключён")
+            return None
+        
+        try:
+            result, latency = await self._call_limited(provider, messages, on_text, schema)
+        except asyncio.CancelledError:
+            if breaker is not None:
+                breaker.release(call)
+            raise
+        
+        if result:
+            self.latency[provider].record(latency)
+        if breaker is not None:
+            breaker.record(call, bool(result), latency)
+        return result
+    
+    async def _call_limited(
+        self,
+        provider: LLMProvider,
+        messages: List[Dict[str, str]],
+        on_text: Optional[TextCallback] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Optional[str], float]:
+        """Вызов провайдера под его AdaptiveLimiter: (ответ, время ответа)."""
+        limiter = self.limiters[provider]
+        latency = 0.0
+        
+        for attempt in range(settings.llm_rate_limit_retries + 1):
+            started_at = await limiter.acquire()
+            logger.info(f"Попытка вызова LLM через {provider.value}")
+            started = time.perf_counter()
+            
+            try:
+                if provider == LLMProvider.FREEWEN:
+                    result = await self._call_freewen(messages, on_text, schema)
+                elif provider == LLMProvider.OPENROUTER:
+                    result = await self._call_openrouter(messages, on_text, schema)
+                elif provider == LLMProvider.LOCAL:
+                    result = await self._call_local(messages, on_text, schema)
+                else:
+                    result = None
+            except ProviderOverloaded as e:
+                latency = time.perf_counter() - started
+                limiter.overloaded(started_at, e.retry_after)
+                logger.warning(f"Провайдер {provider.value} перегружен: {e}")
+                if e.retry_after is None:
+                    break
+                continue
+            except BaseException:
+                limiter.release(started_at, False)
+                raise
+            
+            latency = time.perf_counter() - started
+            limiter.release(started_at, bool(result), latency)
+            return result, latency
+        
+        return None, latency
+    
+    def _configured(self, provider: LLMProvider) -> bool:
+        """Настроен ли провайдер (OpenRouter без ключа не вызывается)."""
+        if provider == LLMProvider.OPENROUTER:
+            return bool(settings.openrouter_api_key)
+        return True
+    
+    def _available_providers(self, providers: List[LLMProvider]) -> List[LLMProvider]:
+        """
+        Провайдеры, которым можно отправить запрос, по убыванию здоровья.
+        
+        Ненастроенные провайдеры пропускаются. При равном здоровье
+        (с точностью до 0.1) сохраняется порядок provider_priority.
+        Провайдеры на паузе по Retry-After идут последними.
+        """
+        providers = [prov for prov in providers if self._configured(prov)]
+        if not settings.llm_breaker_enabled:
+            return sorted(providers, key=lambda prov: self.limiters[prov].paused_for > 0)
+        
+        available = [prov for prov in providers if self.breakers[prov].available()]
+        return sorted(available, key=lambda prov: (
+            self.limiters[prov].paused_for > 0,
+            -round(self.breakers[prov].health, 1)
+        ))
+    
+    def provider_stats(self) -> Dict[str, dict]:
+        """Состояние провайдеров для мониторинга."""
+        stats = {}
+        for prov in LLMProvider:
+            window = self.latency[prov]
+            parse = self.parse_stats[prov]
+            parsed_total = parse["parsed"] + parse["failed"]
+            stats[prov.value] = {
+                **self.breakers[prov].stats(),
+                **self.limiters[prov].stats(),
+                "latency_p50": window.percentile(0.5),
+                "latency_p95": window.percentile(0.95),
+                **parse,
+                "parse_failure_rate": parse["failed"] / parsed_total if parsed_total else 0.0
+            }
+        return stats
+    
+    def hedge_delay(self, provider: LLMProvider) -> float:
+        """
+        Сколько ждать ответа провайдера до запуска следующего параллельно.
+        
+        Берётся перцентиль llm_hedge_percentile времени ответа провайдера,
+        пока замеров мало - llm_hedge_default_delay.
+        """
+        window = self.latency[provider]
+        if len(window) < settings.llm_hedge_min_samples:
+            delay = settings.llm_hedge_default_delay
+        else:
+            delay = window.percentile(settings.llm_hedge_percentile)
+        return min(self.timeout, max(settings.llm_hedge_min_delay, delay))
+    
+    async def _chat_hedged(
+        self,
+        providers: List[LLMProvider],
+        messages: List[Dict[str, str]],
+        on_text: Optional[TextCallback] = None,
+        schema: Optional[Dict[str, Any]] = None,
+        validate: Optional[Callable[[str], bool]] = None
+    ) -> Tuple[Optional[str], Optional[LLMProvider]]:
+        """
+        Хеджированный вызов: если провайдер не ответил за hedge_delay
+        (или ответил ошибкой), параллельно запускается следующий.
+        Побеждает первый непустой ответ, прошедший validate, остальные
+        запросы отменяются. Ответ, не прошедший проверку, возвращается,
+        только если подходящего не дал никто (его исправит _structured).
+        
+        Фрагменты потокового ответа передаются в on_text только от
+        провайдера, который начал отвечать первым.
+        """
+        tasks: Dict[asyncio.Task, LLMProvider] = {}
+        next_index = 0
+        streaming_provider = None
+        rejected: Tuple[Optional[str], Optional[LLMProvider]] = (None, None)
+        
+        def forward(prov: LLMProvider) -> Optional[TextCallback]:
+            if on_text is None:
+                return None
+            
+            async def callback(text: str):
+                nonlocal streaming_provider
+                if streaming_provider is None:
+                    streaming_provider = prov
+                if streaming_provider == prov:
+                    await on_text(text)
+            return callback
+        
+        def launch():
+            nonlocal next_index
+            prov = providers[next_index]
+            next_index += 1
+            tasks[asyncio.create_task(self._call_provider(prov, messages, forward(prov), schema))] = prov
+            return prov
+        
+        last = launch()
+        try:
+            while tasks:
+                timeout = self.hedge_delay(last) if next_index < len(providers) else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                if not done:
+                    prov = launch()
+                    logger.info(f"{last.value} не ответил за {timeout:.1f} сек., параллельно запущен {prov.value}")
+                    last = prov
+                    continue
+                
+                for task in done:
+                    prov = tasks.pop(task)
+                    result = task.result()
+                    if result and (validate is None or validate(result)):
+                        logger.info(f"Успешный ответ от {prov.value}")
+                        return result, prov
+                    if result:
+                        logger.warning(f"Ответ {prov.value} не прошёл проверку, ждём остальных провайдеров")
+                        if rejected[0] is None:
+                            rejected = (result, prov)
+                    if streaming_provider == prov:
+                        # Поток оборвался, показываем следующего ответившего
+                        streaming_provider = None
+                
+                # Ответ с ошибкой или не прошёл проверку: следующий провайдер запускается сразу
+                if next_index < len(providers):
+                    last = launch()
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        return rejected
+    
+    async def _dispatch(
+        self,
+        providers: List[LLMProvider],
+        messages: List[Dict[str, str]],
+        on_text: Optional[TextCallback] = None,
+        schema: Optional[Dict[str, Any]] = None,
+        validate: Optional[Callable[[str], bool]] = None
+    ) -> Tuple[Optional[str], Optional[LLMProvider]]:
+        """Получить ответ от первого подходящего провайдера (ответ, провайдер)."""
+        if settings.llm_hedging and len(providers) > 1:
+            return await self._chat_hedged(providers, messages, on_text, schema, validate)
+        
+        for prov in providers:
+            result = await self._call_provider(prov, messages, on_text, schema)
+            if result:
+                logger.info(f"Успешный ответ от {prov.value}")
+                return result, prov
+        return None, None
+    
+    def _model_name(self, provider: LLMProvider) -> str:
+        if provider == LLMProvider.FREEWEN:
+            return settings.freewen_model
+        if provider == LLMProvider.OPENROUTER:
+            return settings.openrouter_model
+        return settings.local_llm_model
+    
+    def _cache_key(self, provider: LLMProvider, messages: List[Dict[str, str]]) -> str:
+        return make_cache_key(provider.value, self._model_name(provider), messages, TEMPERATURE)
+    
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        provider: Optional[LLMProvider] = None,
+        on_text: Optional[TextCallback] = None,
+        use_cache: bool = True,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
         """
         Вызвать LLM с автоматическим fallback.
         
+        Провайдеры упорядочиваются по здоровью, отключённые автоматом
+        (CircuitBreaker) пропускаются. При llm_hedging резервный провайдер
+        запускается, не дожидаясь таймаута основного (см. _chat_hedged),
+        иначе провайдеры перебираются по очереди.
+        
+        Ответы кэшируются (llm_cache_enabled) по провайдеру, модели,
+        сообщениям и температуре; одинаковые одновременные запросы
+        выполняются одним обращением к провайдеру.
+        
         Args:
             messages: Список сообщений в формате [{"role": "user", "content": "..."}]
             provider: Принудительный выбор провайдера (опционально)
+            on_text: Вызывается с накопленным текстом по мере потокового ответа
+            use_cache: Использовать кэш ответов
+            schema: JSON Schema ответа для режима структурированного вывода (llm_json_mode)
         
         Returns:
             Ответ от LLM или None
         """
+        result, _ = await self._chat(messages, provider, on_text, use_cache, schema)
+        return result
+    
+    async def _chat(
+        self,
+        messages: List[Dict[str, str]],
+        provider: Optional[LLMProvider] = None,
+        on_text: Optional[TextCallback] = None,
+        use_cache: bool = True,
+        schema: Optional[Dict[str, Any]] = None,
+        validate: Optional[Callable[[str], bool]] = None
+    ) -> Tuple[Optional[str], Optional[LLMProvider]]:
+        """
+        chat(), дополнительно возвращает провайдера, чей ответ получен.
+        
+        validate - проверка ответа перед записью в кэш: ответ, который
+        её не прошёл, не кэшируется (иначе он возвращался бы из кэша
+        и каждый раз требовал исправления).
+        """
+        candidates = [provider] if provider else self.provider_priority
+        use_cache = settings.llm_cache_enabled and use_cache
+        
+        keys: Dict[LLMProvider, str] = {}
+        if use_cache:
+            keys = {prov: self._cache_key(prov, messages) for prov in candidates}
+            cached = await llm_cache.get(list(keys.values()))
+            if cached is not None:
+                key, result = cached
+                logger.info("Ответ LLM взят из кэша")
+                return result, next(prov for prov, prov_key in keys.items() if prov_key == key)
+        
         if provider:
             providers = [provider]
         else:
-            providers = self.provider_priority
+            # Отключённые провайдеры пропускаются без ожидания таймаута
+            providers = self._available_providers(self.provider_priority)
+            if not providers:
+                logger.error("Все провайдеры LLM временно отключены")
+                return None, None
         
-        for prov in providers:
-            logger.info(f"Попытка вызова LLM через {prov.value}")
+        if not use_cache:
+            result, answered_by = await self._dispatch(providers, messages, on_text, schema, validate)
+        else:
+            # Без выбранного провайдера одинаковые запросы объединяются, кто бы
+            # ни ответил; запрос к конкретному провайдеру - только с такими же
+            flight_key = make_cache_key(provider.value if provider else "", "", messages, TEMPERATURE)
             
-            if prov == LLMProvider.FREEWEN:
-                result = await self._call_freewen(messages)
-            elif prov == LLMProvider.OPENROUTER:
-                result = await self._call_openrouter(messages)
-            elif prov == LLMProvider.LOCAL:
-                result = await self._call_local(messages)
-            else:
-                continue
+            async def call():
+                # Потоковый ответ получают все объединённые запросы с on_text
+                stream = self._broadcast(flight_key) if self._listeners.get(flight_key) else None
+                response, answered_by = await self._dispatch(providers, messages, stream, schema, validate)
+                if response and (validate is None or validate(response)):
+                    await llm_cache.put(keys[answered_by], response, answered_by.value, self._model_name(answered_by))
+                return response, answered_by
             
-            if result:
-                logger.info(f"Успешный ответ от {prov.value}")
-                return result
+            if on_text is not None:
+                self._listeners.setdefault(flight_key, []).append(on_text)
+            try:
+                result, answered_by = await llm_cache.singleflight(flight_key, call)
+            finally:
+                if on_text is not None:
+                    listeners = self._listeners[flight_key]
+                    listeners.remove(on_text)
+                    if not listeners:
+                        del self._listeners[flight_key]
+        
+        if result:
+            return result, answered_by
         
         logger.error("Все провайдеры LLM недоступны")
-        return None
+        return None, None
+    
+    def _broadcast(self, flight_key: str) -> TextCallback:
+        """on_text, который передаёт текст всем ожидающим запроса flight_key."""
+        async def on_text(text: str):
+            for listener in list(self._listeners.get(flight_key, ())):
+                try:
+                    await listener(text)
+                except Exception as e:
+                    logger.debug(f"Ошибка обработчика потокового ответа: {e}")
+        return on_text
+    
+    async def _structured(
+        self,
+        messages: List[Dict[str, str]],
+        schema: Type[LLMResult],
+        on_text: Optional[TextCallback] = None,
+        accept: Optional[Callable[[Dict[str, Any]], bool]] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Запрос со структурированным ответом по схеме.
+        
+        Провайдер получает JSON Schema (нативный режим JSON, если включён),
+        ответ разбирается терпимо к тексту вокруг JSON и проверяется
+        схемой. Если ответ не подошёл, делается одна попытка исправления:
+        модели возвращается её ответ с описанием ошибки. В кэш попадают
+        только ответы, прошедшие схему и проверку accept.
+        
+        Returns:
+            (данные, None) или (None, текст ошибки для пользователя)
+        """
+        json_schema = JSON_SCHEMAS[schema]
+        
+        def valid(response: str) -> bool:
+            data, error = parse_result(response, schema)
+            return error is None and (accept is None or accept(data))
+        
+        response, provider = await self._chat(messages, on_text=on_text, schema=json_schema, validate=valid)
+        if not response:
+            return None, "LLM недоступен"
+        
+        data, error = parse_result(response, schema)
+        self._record_parse(provider, error is None)
+        if error is None:
+            return data, None
+        
+        logger.warning(f"Ответ {provider.value} не прошёл проверку схемы {schema.__name__}: {error}")
+        repair_messages = messages + [
+            {"role": "assistant", "content": response},
+            {"role": "user", "content": (
+                f"Ответ не соответствует требуемому формату: {error}. "
+                "Верни только исправленный JSON, без пояснений."
+            )}
+        ]
+        response, provider = await self._chat(repair_messages, schema=json_schema, validate=valid)
+        if not response:
+            return None, "LLM недоступен"
+        
+        data, error = parse_result(response, schema)
+        self._record_parse(provider, error is None, repair=True)
+        if error is None:
+            return data, None
+        
+        logger.error(f"Не удалось разобрать ответ после исправления: {error}, ответ: {response}")
+        return None, "Ошибка обработки"
+    
+    def _record_parse(self, provider: LLMProvider, success: bool, repair: bool = False):
+        """Учесть результат разбора ответа провайдера."""
+        stats = self.parse_stats[provider]
+        if repair:
+            stats["repairs"] += 1
+            if success:
+                stats["repaired"] += 1
+        else:
+            stats["parsed" if success else "failed"] += 1
     
     async def classify_message(self, transcription: str) -> Dict[str, Any]:
         """
@@ -164,24 +1269,14 @@ class LLMClient:
         """
         prompt = f"""Проанализируй следующую расшифровку аудио и определи её тип.
 
-Типы сообщений:
-1. MEETING - собрание/митинг: диалог нескольких людей, обсуждение задач, планов
-2. REMINDER - напоминание: короткая фраза с явным будущим действием/датой ("напомни", "завтра", "через час")
-3. ARCHIVE - архив: описательная речь о том, что сделано/делается, без явного запроса
-4. DIARY - личный дневник: поток мыслей, переживаний, планов ("сегодня было...", "я чувствую...", "надо подумать о...")
-5. WORK - работа: наброски по задачам, размышления о проекте, технические идеи, ретро, ревью дня
-6. HOME - дом/быт: домашние дела ("купить", "починить", "убрать", "сделать с детьми/родителями")
-7. STUDY - обучение: конспекты с лекций, курсов, книг, статей
-8. IDEAS - идеи/брейншторм: поток идей, стартапы, фичи, сценарии, "надо бы сделать..."
-9. HEALTH - здоровье: заметки о самочувствии ("плохо спал", "болит голова", "выпил таблетки", "тренировка")
-10. FINANCE - финансы: надиктовка трат и доходов ("потратил столько-то на...", "получил зарплату...")
+{MESSAGE_TYPES_DESCRIPTION}
 
 Расшифровка:
 {transcription}
 
 Верни JSON в формате:
 {{
-    "type": "MEETING" | "REMINDER" | "ARCHIVE" | "DIARY" | "WORK" | "HOME" | "STUDY" | "IDEAS" | "HEALTH" | "FINANCE",
+    "type": {TYPE_CHOICES},
     "confidence": 0.0-1.0,
     "reason": "краткое объяснение"
 }}"""
@@ -191,146 +1286,321 @@ class LLMClient:
             {"role": "user", "content": prompt}
         ]
         
-        response = await self.chat(messages)
-        if not response:
-            return {"type": "UNKNOWN", "confidence": 0.0, "reason": "LLM недоступен"}
+        result, error = await self._structured(messages, Classification)
+        if result is None:
+            return {"type": "UNKNOWN", "confidence": 0.0, "reason": error}
+        return result
+    
+    def _is_long(self, transcription: str) -> bool:
+        """Не помещается ли расшифровка в один запрос."""
+        return estimate_tokens(transcription, settings.llm_chars_per_token) > settings.llm_chunk_max_tokens
+    
+    def _split(self, transcription: str) -> List[str]:
+        return split_text(
+            transcription,
+            settings.llm_chunk_max_tokens,
+            settings.llm_chunk_overlap_tokens,
+            settings.llm_chars_per_token
+        )
+    
+    async def extract(
+        self,
+        message_type: str,
+        transcription: str,
+        on_partial: Optional[PartialCallback] = None
+    ) -> Dict[str, Any]:
+        """
+        Извлечь структурированные данные для известного типа сообщения.
         
-        try:
-            # Пытаемся извлечь JSON из ответа
-            response = response.strip()
-            if response.startswith("```"):
-                # Убираем markdown код блоки
-                response = response.split("```")[1]
-                if response.startswith("json"):
-                    response = response[4:]
-            response = response.strip()
-            
-            result = json.loads(response)
-            return result
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка парсинга JSON от LLM: {e}, ответ: {response}")
-            return {"type": "UNKNOWN", "confidence": 0.0, "reason": "Ошибка парсинга ответа"}
+        Длинные расшифровки собраний, архивных заметок и конспектов
+        (MAP_REDUCE_TYPES) обрабатываются по частям, см. _extract_map_reduce.
+        
+        Args:
+            message_type: Тип сообщения (ключ EXTRACTION_SPECS, например "meeting")
+            transcription: Текст расшифровки
+            on_partial: Вызывается с частично полученными данными (потоковый ответ)
+        """
+        if message_type in MAP_REDUCE_TYPES and self._is_long(transcription):
+            return await self._extract_map_reduce(message_type, transcription, on_partial)
+        return await self._extract_single(message_type, transcription, on_partial)
     
-    async def process_meeting(self, transcription: str) -> Dict[str, Any]:
-        """Обработать собрание и извлечь задачи."""
-        prompt = f"""Проанализируй расшифровку собрания и создай структурированный отчёт.
+    async def _extract_single(
+        self,
+        message_type: str,
+        transcription: str,
+        on_partial: Optional[PartialCallback] = None,
+        part: Optional[Tuple[int, int]] = None
+    ) -> Dict[str, Any]:
+        """Извлечение одним запросом (part - номер части и число частей)."""
+        role, instruction, schema = EXTRACTION_SPECS[message_type]
+        if part is not None:
+            instruction += f"\nЭто часть {part[0]} из {part[1]} длинной расшифровки, извлекай только то, что есть в ней."
+        prompt = f"""{instruction}
 
 Расшифровка:
 {transcription}
 
 Создай JSON в формате:
-{{
-    "title": "краткий заголовок встречи",
-    "summary": "краткое резюме (2-3 предложения)",
-    "participants": ["имя1", "имя2", ...],
-    "tasks": [
-        {{
-            "title": "название задачи",
-            "assignee": "исполнитель (если известен)",
-            "due_date": "срок (если упомянут)",
-            "description": "описание"
-        }}
-    ],
-    "decisions": ["решение1", "решение2", ...],
-    "key_points": ["важный момент1", "важный момент2", ...]
-}}"""
+{schema}"""
         
         messages = [
-            {"role": "system", "content": "Ты помощник для анализа собраний. Отвечай только валидным JSON."},
+            {"role": "system", "content": f"Ты помощник для {role}. Отвечай только валидным JSON."},
             {"role": "user", "content": prompt}
         ]
         
-        response = await self.chat(messages)
-        if not response:
-            return {"error": "LLM недоступен"}
+        result, error = await self._structured(
+            messages,
+            RESULT_SCHEMAS[message_type],
+            on_text=_partial_json_callback(on_partial, message_type)
+        )
+        if result is None:
+            return {"error": error}
+        return result
+    
+    async def _extract_map_reduce(
+        self,
+        message_type: str,
+        transcription: str,
+        on_partial: Optional[PartialCallback] = None
+    ) -> Dict[str, Any]:
+        """
+        Извлечение по частям: части обрабатываются параллельно (число
+        одновременных запросов ограничено по провайдеру), результаты
+        сливаются без повторов, резюме частей сокращается одним запросом.
+        Время ответа определяется самой медленной частью.
+        """
+        chunks = self._split(transcription)
+        logger.info(f"Длинная расшифровка ({message_type}): {len(chunks)} частей")
         
+        async def run(index: int, chunk: str):
+            return index, await self._extract_single(message_type, chunk, part=(index + 1, len(chunks)))
+        
+        results: Dict[int, Dict[str, Any]] = {}
+        tasks = [asyncio.create_task(run(i, chunk)) for i, chunk in enumerate(chunks)]
         try:
-            response = response.strip()
-            if response.startswith("```"):
-                response = response.split("```")[1]
-                if response.startswith("json"):
-                    response = response[4:]
-            response = response.strip()
-            
-            result = json.loads(response)
-            return result
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка парсинга JSON: {e}, ответ: {response}")
+            for next_done in asyncio.as_completed(tasks):
+                index, result = await next_done
+                if "error" in result:
+                    logger.warning(f"Часть {index + 1}/{len(chunks)} не обработана: {result['error']}")
+                    continue
+                results[index] = result
+                if on_partial is not None:
+                    await on_partial(message_type, merge_extractions([results[i] for i in sorted(results)]))
+        finally:
+            # Обработку прервали (отмена, ошибка on_partial) - оставшиеся
+            # части не должны занимать слоты провайдеров
+            for task in tasks:
+                task.cancel()
+        
+        if not results:
             return {"error": "Ошибка обработки"}
-    
-    async def process_reminder(self, transcription: str) -> Dict[str, Any]:
-        """Обработать напоминание."""
-        prompt = f"""Проанализируй расшифровку напоминания и извлеки информацию.
-
-Расшифровка:
-{transcription}
-
-Создай JSON в формате:
-{{
-    "text": "текст напоминания",
-    "reminder_date": "дата/время если указано явно (YYYY-MM-DD HH:MM или null)",
-    "relative_time": "относительное время если указано ('через час', 'завтра', 'через неделю' или null)",
-    "needs_clarification": true/false
-}}"""
         
+        merged = merge_extractions([results[i] for i in sorted(results)])
+        if len(results) > 1 and merged.get("summary"):
+            merged["summary"] = await self._reduce_summary(merged["summary"])
+        return merged
+    
+    async def _reduce_summary(self, summaries: str) -> str:
+        """Сократить склеенные резюме частей до одного."""
         messages = [
-            {"role": "system", "content": "Ты помощник для обработки напоминаний. Отвечай только валидным JSON."},
-            {"role": "user", "content": prompt}
+            {"role": "system", "content": "Ты помощник для составления кратких резюме."},
+            {"role": "user", "content": (
+                "Ниже резюме последовательных частей одной записи. Объедини их в одно "
+                "краткое резюме (2-3 предложения). Ответь только текстом резюме.\n\n"
+                f"{summaries}"
+            )}
         ]
-        
         response = await self.chat(messages)
-        if not response:
-            return {"error": "LLM недоступен"}
-        
-        try:
-            response = response.strip()
-            if response.startswith("```"):
-                response = response.split("```")[1]
-                if response.startswith("json"):
-                    response = response[4:]
-            response = response.strip()
-            
-            result = json.loads(response)
-            return result
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка парсинга JSON: {e}, ответ: {response}")
-            return {"error": "Ошибка обработки"}
+        return response.strip() if response else summaries
+    
+    async def process_meeting(self, transcription: str) -> Dict[str, Any]:
+        """Обработать собрание и извлечь задачи."""
+        return await self.extract("meeting", transcription)
+    
+    async def process_reminder(self, transcription: str) -> Dict[str, Any]:
+        """Обработать напоминание."""
+        return await self.extract("reminder", transcription)
     
     async def process_archive(self, transcription: str) -> Dict[str, Any]:
         """Обработать архивную заметку."""
-        prompt = f"""Преобразуй расшифровку в структурированную статью/заметку.
+        return await self.extract("archive", transcription)
+    
+    async def process_diary(self, transcription: str) -> Dict[str, Any]:
+        """Обработать запись дневника."""
+        return await self.extract("diary", transcription)
+    
+    async def process_work(self, transcription: str) -> Dict[str, Any]:
+        """Обработать рабочую заметку."""
+        return await self.extract("work", transcription)
+    
+    async def process_home(self, transcription: str) -> Dict[str, Any]:
+        """Обработать бытовые задачи."""
+        return await self.extract("home", transcription)
+    
+    async def process_study(self, transcription: str) -> Dict[str, Any]:
+        """Обработать учебный конспект."""
+        return await self.extract("study", transcription)
+    
+    async def process_ideas(self, transcription: str) -> Dict[str, Any]:
+        """Обработать идеи/брейншторм."""
+        return await self.extract("ideas", transcription)
+    
+    async def process_health(self, transcription: str) -> Dict[str, Any]:
+        """Обработать запись о здоровье."""
+        return await self.extract("health", transcription)
+    
+    async def process_finance(self, transcription: str) -> Dict[str, Any]:
+        """Обработать финансовую операцию."""
+        return await self.extract("finance", transcription)
+    
+    async def _classify_and_extract_combined(
+        self,
+        transcription: str,
+        on_partial: Optional[PartialCallback] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Один запрос к LLM: тип сообщения и данные для этого типа."""
+        schemas = "\n\n".join(
+            f"{message_type.upper()}:\n{schema}"
+            for message_type, (_, _, schema) in EXTRACTION_SPECS.items()
+        )
+        prompt = f"""Проанализируй следующую расшифровку аудио: определи её тип и сразу извлеки данные для этого типа.
+
+{MESSAGE_TYPES_DESCRIPTION}
+
+Формат поля "data" для каждого типа:
+
+{schemas}
 
 Расшифровка:
 {transcription}
 
-Создай JSON в формате:
+Верни JSON в формате:
 {{
-    "title": "заголовок статьи",
-    "summary": "краткое резюме (2-3 предложения)",
-    "content": "структурированный текст с подзаголовками и списками (markdown формат)",
-    "tags": ["тег1", "тег2", ...]
+    "type": {TYPE_CHOICES},
+    "confidence": 0.0-1.0,
+    "reason": "краткое объяснение",
+    "data": {{...данные в формате для выбранного типа...}}
 }}"""
         
         messages = [
-            {"role": "system", "content": "Ты помощник для создания структурированных заметок. Отвечай только валидным JSON."},
+            {"role": "system", "content": "Ты помощник для классификации и обработки сообщений. Отвечай только валидным JSON."},
             {"role": "user", "content": prompt}
         ]
         
-        response = await self.chat(messages)
-        if not response:
-            return {"error": "LLM недоступен"}
+        def data_valid(result: Dict[str, Any]) -> bool:
+            # Данные известного типа должны пройти его схему (см. classify_and_extract)
+            message_type = result["type"].lower()
+            return message_type not in RESULT_SCHEMAS or validate_result(message_type, result["data"]) is not None
         
-        try:
-            response = response.strip()
-            if response.startswith("```"):
-                response = response.split("```")[1]
-                if response.startswith("json"):
-                    response = response[4:]
-            response = response.strip()
+        result, _ = await self._structured(
+            messages, CombinedResult, on_text=_partial_json_callback(on_partial), accept=data_valid
+        )
+        return result
+    
+    async def classify_and_extract(
+        self,
+        transcription: str,
+        on_partial: Optional[PartialCallback] = None
+    ) -> Dict[str, Any]:
+        """
+        Классифицировать сообщение и извлечь данные.
+        
+        Сначала пробуется локальный классификатор (fast_classifier): если он
+        уверен, к LLM уходит только запрос на извлечение данных.
+        В комбинированном режиме (llm_combined_mode) тип и данные возвращает
+        один запрос. Если уверенность ниже llm_combined_min_confidence или
+        данные не разобраны, используется двухшаговый путь:
+        classify_message, затем обработка по типу.
+        
+        Args:
+            transcription: Текст расшифровки
+            on_partial: Вызывается с типом и частично полученными данными
+                по мере потокового ответа (для предпросмотра)
+        
+        Returns:
+            Словарь {"type": "meeting" | ... | "unknown", "confidence", "reason", "data"}
+        """
+        if settings.fast_classifier_enabled:
+            fast = get_fast_classifier().classify(transcription)
+            if fast is not None:
+                # Тип известен без LLM, остаётся только извлечение данных
+                return {
+                    "type": fast.type.value,
+                    "confidence": fast.confidence,
+                    "reason": f"Локальная классификация ({fast.source})",
+                    "data": await self.extract(fast.type.value, transcription, on_partial)
+                }
+        
+        # Длинный текст целиком в один запрос не помещается: тип
+        # определяется по началу, данные извлекаются по частям
+        long_input = self._is_long(transcription)
+        
+        combined = None
+        if settings.llm_combined_mode and not long_input:
+            combined = await self._classify_and_extract_combined(transcription, on_partial)
+        
+        combined_type = None
+        combined_data = None
+        if combined:
+            combined_type = combined["type"].lower()
+            # Данные проверяются схемой выбранного типа
+            combined_data = validate_result(combined_type, combined["data"])
+            confidence = combined["confidence"]
             
-            result = json.loads(response)
-            return result
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка парсинга JSON: {e}, ответ: {response}")
-            return {"error": "Ошибка обработки"}
+            if (
+                combined_type in EXTRACTION_SPECS
+                and combined_data is not None
+                and confidence >= settings.llm_combined_min_confidence
+            ):
+                return {
+                    "type": combined_type,
+                    "confidence": confidence,
+                    "reason": combined.get("reason", ""),
+                    "data": combined_data
+                }
+            
+            logger.info(
+                f"Комбинированный запрос: тип {combined_type}, уверенность {confidence:.2f}, "
+                f"переход на двухшаговую обработку"
+            )
+        
+        classification = await self.classify_message(self._split(transcription)[0] if long_input else transcription)
+        message_type = str(classification.get("type", "UNKNOWN")).lower()
+        
+        if message_type not in EXTRACTION_SPECS:
+            data = {}
+        elif message_type == combined_type and combined_data is not None:
+            # Классификация подтвердила тип, данные уже получены
+            data = combined_data
+        else:
+            data = await self.extract(message_type, transcription, on_partial)
+        
+        return {
+            "type": message_type if message_type in EXTRACTION_SPECS else "unknown",
+            "confidence": classification.get("confidence", 0.0),
+            "reason": classification.get("reason", ""),
+            "data": data
+        }
+
+
+# Общий клиент на процесс
+_llm_client: Optional[LLMClient] = None
+
 
+def get_llm_client() -> LLMClient:
+    """Получить общий экземпляр LLMClient."""
+    global _llm_client
+    
+    if _llm_client is None:
+        _llm_client = LLMClient()
+    
+    return _llm_client
+
+
+async def close_llm_client():
+    """Закрыть соединения общего LLMClient."""
+    global _llm_client
+    
+    if _llm_client is not None:
+        await _llm_client.aclose()
+        _llm_client = None
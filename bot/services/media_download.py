@@ -0,0 +1,112 @@
+"""Скачивание медиа из Telegram в память без лишних копий."""
+import io
+import tempfile
+import hashlib
+import asyncio
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+
+from aiogram import Bot
+
+from config import settings
+
+
+# Аудио: байты или открытый файл (в памяти или на диске)
+AudioSource = Union[bytes, BinaryIO]
+
+# Размер блока при чтении файла с диска
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+async def download_media(bot: Bot, file_path: str, file_size: Optional[int] = None) -> BinaryIO:
+    """
+    Скачать файл из Telegram.
+
+    Файл пишется блоками прямо в буфер в памяти (io.BytesIO), а если
+    по file_size он больше settings.media_spool_max_size - во временный
+    файл на диске. Вызывающий код должен закрыть возвращённый файл.
+
+    Returns:
+        Файл, перемотанный в начало
+    """
+    if file_size is not None and file_size > settings.media_spool_max_size:
+        temp_dir = Path(tempfile.gettempdir()) / "bot_hnushka"
+        temp_dir.mkdir(exist_ok=True)
+        buffer = tempfile.TemporaryFile(dir=temp_dir)
+    else:
+        buffer = io.BytesIO()
+    try:
+        await bot.download_file(file_path, destination=buffer, seek=True)
+    except BaseException:
+        buffer.close()
+        raise
+    return buffer
+
+
+def _memory_view(source: AudioSource):
+    """memoryview на содержимое, если оно в памяти, иначе None."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source)
+    if isinstance(source, io.BytesIO):
+        return source.getbuffer()
+    return None
+
+
+def media_size(source: AudioSource) -> int:
+    """Размер аудио в байтах."""
+    view = _memory_view(source)
+    if view is not None:
+        with view:
+            return view.nbytes
+
+    position = source.tell()
+    size = source.seek(0, io.SEEK_END)
+    source.seek(position)
+    return size
+
+
+def open_audio(source: AudioSource) -> BinaryIO:
+    """Файловый объект для декодера, перемотанный в начало (без копирования данных)."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+
+    source.seek(0)
+    return source
+
+
+def upload_content(source: AudioSource) -> Union[bytes, BinaryIO]:
+    """
+    Содержимое аудио для multipart-запроса httpx.
+
+    Буфер в памяти отдаётся как есть (длину httpx узнаёт через seek, без
+    копирования), файл на диске - файловым объектом, который читается
+    блоками. SpooledTemporaryFile сюда передавать не стоит: httpx вызывает
+    fileno(), и буфер сбрасывается на диск.
+    """
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    return open_audio(source)
+
+
+def _hash_source(source: AudioSource) -> str:
+    view = _memory_view(source)
+    if view is not None:
+        with view:
+            return hashlib.sha256(view).hexdigest()
+
+    digest = hashlib.sha256()
+    source.seek(0)
+    while True:
+        block = source.read(READ_CHUNK_SIZE)
+        if not block:
+            break
+        digest.update(block)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+async def hash_media(source: AudioSource) -> str:
+    """sha256 содержимого аудио (считается в отдельном потоке)."""
+    return await asyncio.to_thread(_hash_source, source)
@@ -1,135 +1,921 @@
 """Сервис очереди задач."""
 import asyncio
 import json
-from datetime import datetime
-from typing import Optional
+import os
+import socket
+import sqlite3
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Tuple, Iterable
 
-from sqlalchemy import select, func
+from aiogram import Bot
+from aiogram.enums import ChatType
+from aiogram.types import Chat, Message, User as TelegramUser
+from sqlalchemy import select, func, update, and_
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
-from bot.models.database import ProcessingTask, TaskStatus, MessageType
-from bot.services.whisper_service import WhisperService
-from bot.services.llm_service import LLMClient
+from bot.models.database import User, ProcessingTask, TaskStatus, MessageType
+from bot.services.whisper_service import get_whisper_service
+from bot.services.llm_service import get_llm_client
+from bot.services.transcription_cache import transcription_cache
+from bot.services.media_download import download_media, media_size, hash_media
+from bot.services.results import analyze, deliver_result
+from bot.storage.database import AsyncSessionLocal
 from config import settings
 from bot.utils.logger import logger
 
 
+# Статусы задач, которые уже взяты в работу
+IN_PROGRESS_STATUSES = (TaskStatus.TRANSCRIBING, TaskStatus.PROCESSING)
+
+# Лимит Bot API на скачивание - 50 МБ, для надёжности ограничиваем 20 МБ
+MAX_DOWNLOAD_SIZE = 20 * 1024 * 1024
+
+# Примерная скорость расшифровки на CPU: секунд работы на секунду аудио
+MODEL_REALTIME_FACTORS = {
+    "tiny": 0.05, "base": 0.08, "small": 0.15, "medium": 0.4, "large": 0.8
+}
+DEFAULT_REALTIME_FACTOR = 0.4
+
+# Байт в секунду по типу файла (если длительность неизвестна):
+# голосовые - Opus ~16 кбит/с, кружки - видео, аудио - MP3 ~128 кбит/с
+BYTES_PER_SECOND = {"voice": 2000, "video_note": 60000, "audio": 16000}
+
+# Точка отсчёта ожидания в queue_rank
+EPOCH = datetime(1970, 1, 1)
+
+
+def estimate_task_cost(
+    file_type: str,
+    duration: Optional[float],
+    file_size: Optional[int],
+    model_name: Optional[str]
+) -> float:
+    """
+    Ожидаемое время обработки задачи, сек.
+    
+    Расшифровка - длительность аудио (или оценка по размеру файла),
+    умноженная на скорость модели; плюс queue_cost_overhead на LLM и
+    отправку результата.
+    """
+    if not duration and file_size:
+        duration = file_size / BYTES_PER_SECOND.get(file_type, BYTES_PER_SECOND["audio"])
+    
+    factor = DEFAULT_REALTIME_FACTOR
+    for prefix, model_factor in MODEL_REALTIME_FACTORS.items():
+        if model_name and model_name.startswith(prefix):
+            factor = model_factor
+            break
+    return (duration or 0) * factor + settings.queue_cost_overhead
+
+
+class TaskRejected(Exception):
+    """Задачу нельзя обработать; текст исключения показывается пользователю."""
+
+
+class QueueLimitExceeded(Exception):
+    """У пользователя уже max_tasks_per_user незавершённых задач."""
+    
+    def __init__(self, active: int, limit: int):
+        super().__init__(f"Незавершённых задач: {active} (максимум {limit})")
+        self.active = active
+        self.limit = limit
+
+
+class DeficitRoundRobin:
+    """
+    Справедливый выбор пользователя для следующей задачи (deficit round-robin).
+    
+    Пользователи с задачами в очереди обходятся по кругу. Становясь
+    первым в круге, пользователь получает quantum к дефициту и берёт
+    задачу, если дефицит покрывает её стоимость. Пользователь с двадцатью
+    лекциями получает ту же долю воркеров, что и остальные, а не всю очередь.
+    
+    Состояние хранится в памяти процесса; при нескольких процессах каждый
+    честен в пределах своих воркеров.
+    """
+    
+    def __init__(self, quantum: float = 1.0):
+        self.quantum = quantum
+        self._ring: deque = deque()
+        self._deficits: Dict[int, float] = {}
+        # Чей сейчас ход и получил ли он уже quantum на этот ход
+        self._head: Optional[int] = None
+        self._head_credited = False
+    
+    def pick(self, costs: Dict[int, float], waiting: Iterable[int]) -> Optional[int]:
+        """
+        Выбрать пользователя.
+        
+        Args:
+            costs: Стоимость следующей задачи пользователей, которым можно
+                выдать задачу сейчас
+            waiting: Все пользователи с задачами в очереди (новые встают
+                в конец круга в этом порядке)
+        """
+        waiting = list(waiting)
+        active = set(waiting)
+        for user_id in [user_id for user_id in self._ring if user_id not in active]:
+            # Очередь пользователя опустела - дефицит не копится
+            self._ring.remove(user_id)
+            del self._deficits[user_id]
+        for user_id in waiting:
+            if user_id not in self._deficits:
+                self._ring.append(user_id)
+                self._deficits[user_id] = 0.0
+        
+        if not any(user_id in self._deficits for user_id in costs):
+            return None
+        
+        if self._ring[0] != self._head:
+            self._head, self._head_credited = self._ring[0], False
+        while True:
+            user_id = self._ring[0]
+            cost = costs.get(user_id)
+            if cost is not None:
+                if not self._head_credited:
+                    self._deficits[user_id] += self.quantum
+                    self._head_credited = True
+                if self._deficits[user_id] >= cost:
+                    self._deficits[user_id] -= cost
+                    return user_id
+            # Ход переходит к следующему
+            self._ring.rotate(-1)
+            self._head, self._head_credited = self._ring[0], False
+    
+    def refund(self, user_id: int, cost: float):
+        """Вернуть дефицит, если выбранную задачу не удалось занять."""
+        if user_id in self._deficits:
+            self._deficits[user_id] += cost
+    
+    def stats(self) -> Dict[int, float]:
+        return dict(self._deficits)
+
+
 class QueueService:
-    """Сервис для управления очередью задач."""
+    """
+    Сервис для управления очередью задач.
+    
+    Очередь хранится в таблице ProcessingTask. add_task будит воркеров
+    через asyncio.Event, поэтому новая задача берётся в работу сразу;
+    опрос базы раз в queue_poll_interval нужен только для задач, которые
+    добавил другой процесс. Одновременно работают max_concurrent_tasks
+    воркеров.
     
-    def __init__(self, db_session: AsyncSession):
-        self.db = db_session
-        self.whisper = WhisperService()
-        self.llm = LLMClient()
+    Задача занимается атомарно (одним UPDATE ... RETURNING, в PostgreSQL -
+    с SKIP LOCKED) и арендуется на queue_lease_seconds. Пока задача
+    обрабатывается, аренда продлевается; задачи с истёкшей арендой
+    (процесс упал или завис) возвращаются в очередь, после
+    queue_max_attempts попыток - помечаются ошибкой.
+    """
+    
+    def __init__(self):
+        self.whisper = get_whisper_service()
+        self.llm = get_llm_client()
+        self.bot: Optional[Bot] = None
         self._running = False
-        self._worker_task = None
-        self._semaphore = asyncio.Semaphore(settings.max_concurrent_tasks)
+        self._workers: List[asyncio.Task] = []
+        self._reaper: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._scheduler = DeficitRoundRobin(settings.queue_drr_quantum)
+        # Идентификатор процесса в worker_id задач
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        # Ограничения стадий конвейера
+        transcribe_limit = settings.queue_transcribe_concurrency or (
+            self.whisper.pool.size if self.whisper.pool else settings.queue_download_concurrency
+        )
+        self._stages: Dict[str, asyncio.Semaphore] = {
+            "download": asyncio.Semaphore(settings.queue_download_concurrency),
+            "transcribe": asyncio.Semaphore(transcribe_limit),
+            "llm": asyncio.Semaphore(settings.queue_llm_concurrency)
+        }
     
     async def add_task(
         self,
+        session: AsyncSession,
         user_id: int,
         file_id: str,
-        file_type: str
+        file_type: str,
+        file_unique_id: Optional[str] = None,
+        duration: Optional[float] = None,
+        file_size: Optional[int] = None,
+        language: Optional[str] = None,
+        chat_id: Optional[int] = None,
+        message_id: Optional[int] = None,
+        status_message_id: Optional[int] = None
     ) -> ProcessingTask:
-        """Добавить задачу в очередь."""
+        """
+        Добавить задачу в очередь.
+        
+        chat_id, message_id и status_message_id нужны воркеру, чтобы
+        обновлять статусное сообщение и ответить на исходное. По
+        длительности, размеру и модели расшифровки оценивается стоимость
+        задачи (estimated_cost), от неё зависит очерёдность.
+        
+        Raises:
+            QueueLimitExceeded: у пользователя уже max_tasks_per_user
+                незавершённых задач (задача не добавляется)
+        """
         task = ProcessingTask(
             user_id=user_id,
             file_id=file_id,
+            file_unique_id=file_unique_id,
             file_type=file_type,
+            duration=duration,
+            file_size=file_size,
+            estimated_cost=estimate_task_cost(
+                file_type, duration, file_size, self.whisper.route_model(duration)
+            ),
+            language=language,
+            chat_id=chat_id,
+            message_id=message_id,
+            status_message_id=status_message_id,
             status=TaskStatus.QUEUED
         )
+        task.queue_rank = self.task_rank(task)
         
-        self.db.add(task)
-        await self.db.commit()
-        await self.db.refresh(task)
+        limit = settings.max_tasks_per_user
+        if limit and session.get_bind().dialect.name == "postgresql":
+            # Одновременные добавления одного пользователя - по очереди
+            await session.execute(select(User.id).where(User.id == user_id).with_for_update())
         
+        session.add(task)
+        await session.flush()
+        if limit:
+            # Считаем после вставки в той же транзакции: пачка пересланных
+            # сообщений не проскочит лимит (SQLite блокирует запись до commit)
+            active = await self.active_tasks(session, user_id)
+            if active > limit:
+                await session.rollback()
+                raise QueueLimitExceeded(active - 1, limit)
+        await session.commit()
+        await session.refresh(task)
+        
+        self.notify()
         logger.info(f"Задача {task.id} добавлена в очередь для пользователя {user_id}")
         return task
     
-    async def get_next_task(self) -> Optional[ProcessingTask]:
-        """Получить следующую задачу из очереди."""
-        stmt = select(ProcessingTask).where(
-            ProcessingTask.status == TaskStatus.QUEUED
-        ).order_by(ProcessingTask.created_at).limit(1)
+    def notify(self):
+        """Разбудить воркеров: в очереди появилась задача."""
+        self._wakeup.set()
+    
+    async def active_tasks(self, session: AsyncSession, user_id: int) -> int:
+        """Число незавершённых задач пользователя (в очереди и в работе)."""
+        stmt = select(func.count()).select_from(ProcessingTask).where(
+            ProcessingTask.user_id == user_id,
+            ProcessingTask.status.in_((TaskStatus.QUEUED,) + IN_PROGRESS_STATUSES)
+        )
+        return (await session.execute(stmt)).scalar_one()
+    
+    async def queue_position(self, session: AsyncSession, task: ProcessingTask) -> Tuple[int, float]:
+        """
+        Примерное место задачи в очереди и время до готовности.
+        
+        Пользователи обслуживаются по кругу, поэтому перед k-й задачей
+        пользователя окажутся его k-1 задач и до k задач каждого другого
+        пользователя. Ожидание считается по средней длительности последних
+        задач и числу воркеров, обработка - по estimated_cost задачи.
+        
+        Returns:
+            (задач впереди, секунд до готовности)
+        """
+        rank = (await session.execute(
+            select(func.count()).select_from(ProcessingTask).where(
+                ProcessingTask.user_id == task.user_id,
+                ProcessingTask.status == TaskStatus.QUEUED,
+                ProcessingTask.created_at <= task.created_at
+            )
+        )).scalar_one()
+        others = (await session.execute(
+            select(func.count()).select_from(ProcessingTask).where(
+                ProcessingTask.user_id != task.user_id,
+                ProcessingTask.status == TaskStatus.QUEUED
+            ).group_by(ProcessingTask.user_id)
+        )).scalars()
+        ahead = max(0, rank - 1) + sum(min(count, rank) for count in others)
+        
+        in_flight = (await session.execute(
+            select(func.count()).select_from(ProcessingTask).where(
+                ProcessingTask.status.in_(IN_PROGRESS_STATUSES)
+            )
+        )).scalar_one()
+        workers = max(1, settings.max_concurrent_tasks)
+        # Очередь сдвигается, когда освобождается воркер
+        waves = max(0, ahead + in_flight - workers + 1) / workers
+        task_time = await self.average_task_time(session)
+        return ahead, waves * task_time + (task.estimated_cost or task_time)
+    
+    async def average_task_time(self, session: AsyncSession) -> float:
+        """Средняя длительность обработки последних задач, сек."""
+        rows = (await session.execute(
+            select(ProcessingTask.started_at, ProcessingTask.completed_at)
+            .where(
+                ProcessingTask.status == TaskStatus.DONE,
+                ProcessingTask.started_at.is_not(None),
+                ProcessingTask.completed_at.is_not(None)
+            )
+            .order_by(ProcessingTask.completed_at.desc())
+            .limit(50)
+        )).all()
+        if not rows:
+            return settings.queue_default_task_seconds
+        return sum((completed - started).total_seconds() for started, completed in rows) / len(rows)
+    
+    async def queue_size(self) -> int:
+        """Число задач, ожидающих в очереди."""
+        async with AsyncSessionLocal() as session:
+            stmt = select(func.count()).select_from(ProcessingTask).where(
+                ProcessingTask.status == TaskStatus.QUEUED
+            )
+            return (await session.execute(stmt)).scalar_one()
+    
+    def _lease_until(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=settings.queue_lease_seconds)
+    
+    def task_rank(self, task: ProcessingTask) -> float:
+        """
+        Ключ выбора задачи внутри очереди пользователя (меньше - раньше).
+        
+        Сначала короткие задачи (по estimated_cost), приоритет сдвигает
+        задачу на queue_priority_step секунд, а ожидание - на
+        queue_aging_factor секунд за каждую секунду в очереди, поэтому
+        длинная задача со временем обгоняет новые короткие. Ожидание
+        отсчитывается от общей для всех задач точки (EPOCH), поэтому ключ
+        не меняется со временем: он сохраняется в queue_rank при
+        добавлении задачи и очередь упорядочивается индексом.
+        """
+        return (
+            task.estimated_cost
+            - task.priority * settings.queue_priority_step
+            + (task.created_at - EPOCH).total_seconds() * settings.queue_aging_factor
+        )
+    
+    async def _user_queues(self, session: AsyncSession) -> Tuple[List[int], Dict[int, float], Dict[int, int]]:
+        """
+        Очереди пользователей и их следующие задачи.
+        
+        Одним запросом: пользователи с задачами в очереди и следующая
+        задача (наименьший queue_rank) только тех, у кого меньше
+        max_in_flight_per_user задач в работе.
+        
+        Returns:
+            (все пользователи с задачами в очереди в порядке самой старой задачи,
+             стоимость следующей задачи тех, кому можно выдать задачу сейчас,
+             id их следующих задач)
+        """
+        queued = ProcessingTask.status == TaskStatus.QUEUED
+        queues = (
+            select(ProcessingTask.user_id, func.min(ProcessingTask.created_at).label("oldest"))
+            .where(queued)
+            .group_by(ProcessingTask.user_id)
+            .subquery()
+        )
+        candidate = aliased(ProcessingTask)
+        head_id = (
+            select(candidate.id)
+            .where(candidate.user_id == queues.c.user_id, candidate.status == TaskStatus.QUEUED)
+            .order_by(candidate.queue_rank, candidate.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        eligible = ProcessingTask.id == head_id
+        limit = settings.max_in_flight_per_user
+        if limit:
+            running = aliased(ProcessingTask)
+            in_flight = (
+                select(func.count())
+                .select_from(running)
+                .where(running.user_id == queues.c.user_id, running.status.in_(IN_PROGRESS_STATUSES))
+                .scalar_subquery()
+            )
+            eligible = and_(eligible, in_flight < limit)
+        
+        rows = (await session.execute(
+            select(queues.c.user_id, ProcessingTask.id, ProcessingTask.estimated_cost)
+            .select_from(queues)
+            .outerjoin(ProcessingTask, eligible)
+            .order_by(queues.c.oldest, queues.c.user_id)
+        )).all()
+        
+        waiting = [row.user_id for row in rows]
+        # Дефицит DRR считается в секундах ожидаемой обработки
+        costs = {row.user_id: max(1.0, row.estimated_cost) for row in rows if row.id is not None}
+        heads = {row.user_id: row.id for row in rows if row.id is not None}
+        return waiting, costs, heads
+    
+    async def get_next_task(self, session: AsyncSession, worker_id: str) -> Optional[ProcessingTask]:
+        """
+        Атомарно взять следующую задачу из очереди.
+        
+        Пользователь выбирается по кругу (DeficitRoundRobin, дефицит - в
+        секундах ожидаемой обработки) среди тех, у кого меньше
+        max_in_flight_per_user задач в работе; у него берётся задача
+        с наименьшим queue_rank. Задача помечается TRANSCRIBING и
+        арендуется воркером worker_id. Снимок очередей может устареть,
+        поэтому лимит задач в работе проверяется ещё раз при занятии.
+        """
+        while True:
+            waiting, costs, heads = await self._user_queues(session)
+            user_id = self._scheduler.pick(costs, waiting)
+            if user_id is None:
+                return None
+            
+            task_id = await self._claim(session, worker_id, heads[user_id], user_id)
+            if task_id is not None:
+                return await session.get(ProcessingTask, task_id)
+            # Задачу или последний слот пользователя успел занять другой воркер
+            self._scheduler.refund(user_id, costs[user_id])
+    
+    async def _claim(self, session: AsyncSession, worker_id: str, task_id: int, user_id: int) -> Optional[int]:
+        """
+        Атомарно занять задачу, если она ещё в очереди, а у пользователя
+        меньше max_in_flight_per_user задач в работе.
+        """
+        dialect = session.get_bind().dialect.name
+        values = dict(
+            status=TaskStatus.TRANSCRIBING,
+            started_at=datetime.utcnow(),
+            worker_id=worker_id,
+            lease_expires_at=self._lease_until(),
+            attempts=ProcessingTask.attempts + 1
+        )
+        queued = [ProcessingTask.id == task_id, ProcessingTask.status == TaskStatus.QUEUED]
+        
+        limit = settings.max_in_flight_per_user
+        if limit:
+            running = aliased(ProcessingTask)
+            in_flight = (
+                select(func.count())
+                .select_from(running)
+                .where(running.user_id == ProcessingTask.user_id, running.status.in_(IN_PROGRESS_STATUSES))
+                .scalar_subquery()
+            )
+            queued.append(in_flight < limit)
+            if dialect == "postgresql":
+                # Занятия задач одного пользователя - по очереди, иначе
+                # параллельные транзакции не видят занятые друг другом слоты
+                await session.execute(select(User.id).where(User.id == user_id).with_for_update())
+        
+        if dialect == "sqlite" and sqlite3.sqlite_version_info < (3, 35):
+            # Без RETURNING: условный UPDATE
+            result = await session.execute(update(ProcessingTask).where(*queued).values(**values))
+            await session.commit()
+            return task_id if result.rowcount else None
+        
+        claimed_id = select(ProcessingTask.id).where(*queued)
+        if dialect == "postgresql":
+            # Строку, занятую другой транзакцией, пропускаем без ожидания
+            claimed_id = claimed_id.with_for_update(skip_locked=True)
+        
+        result = await session.execute(
+            update(ProcessingTask)
+            .where(ProcessingTask.id == claimed_id.scalar_subquery())
+            .values(**values)
+            .returning(ProcessingTask.id)
+        )
+        claimed = result.scalar_one_or_none()
+        await session.commit()
+        return claimed
+    
+    async def _extend_lease(self, task_id: int, worker_id: str) -> bool:
+        """Продлить аренду задачи. False - аренда потеряна (задачу забрали)."""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(ProcessingTask)
+                .where(
+                    ProcessingTask.id == task_id,
+                    ProcessingTask.worker_id == worker_id,
+                    ProcessingTask.status.in_(IN_PROGRESS_STATUSES)
+                )
+                .values(lease_expires_at=self._lease_until())
+            )
+            await session.commit()
+            return bool(result.rowcount)
+    
+    async def _heartbeat(self, task_id: int, worker_id: str, processing: asyncio.Task):
+        """Продлевать аренду, пока задача обрабатывается; при потере аренды - прервать обработку."""
+        while not processing.done():
+            await asyncio.sleep(settings.queue_heartbeat_interval)
+            try:
+                if not await self._extend_lease(task_id, worker_id):
+                    logger.warning(f"Аренда задачи {task_id} потеряна, обработка прервана")
+                    processing.cancel()
+                    return
+            except Exception as e:
+                # Временная ошибка базы: аренда ещё действует, попробуем позже
+                logger.warning(f"Не удалось продлить аренду задачи {task_id}: {e}")
+    
+    async def reclaim_expired(self) -> int:
+        """
+        Вернуть в очередь задачи с истёкшей арендой.
+        
+        Задачи, исчерпавшие queue_max_attempts попыток, помечаются ошибкой,
+        а пользователю сообщается об этом, как при обычной ошибке обработки.
         
-        result = await self.db.execute(stmt)
-        return result.scalar_one_or_none()
+        Returns:
+            Число задач, возвращённых в очередь
+        """
+        now = datetime.utcnow()
+        expired = (
+            ProcessingTask.status.in_(IN_PROGRESS_STATUSES),
+            ProcessingTask.lease_expires_at < now
+        )
+        failed: List[Tuple[ProcessingTask, User]] = []
+        async with AsyncSessionLocal() as session:
+            exhausted = (await session.execute(
+                select(ProcessingTask, User)
+                .join(User, User.id == ProcessingTask.user_id)
+                .where(*expired, ProcessingTask.attempts >= settings.queue_max_attempts)
+            )).all()
+            for task, user in exhausted:
+                # По одной: задачу мог уже обработать другой процесс
+                marked = await session.execute(
+                    update(ProcessingTask)
+                    .where(ProcessingTask.id == task.id, *expired)
+                    .values(
+                        status=TaskStatus.ERROR,
+                        error_message="Превышено число попыток обработки",
+                        completed_at=now,
+                        worker_id=None,
+                        lease_expires_at=None
+                    )
+                )
+                if marked.rowcount:
+                    failed.append((task, user))
+            result = await session.execute(
+                update(ProcessingTask)
+                .where(*expired)
+                .values(status=TaskStatus.QUEUED, started_at=None, worker_id=None, lease_expires_at=None)
+            )
+            await session.commit()
+        
+        if failed:
+            logger.error(f"Задач с исчерпанными попытками: {len(failed)}")
+            for task, user in failed:
+                await self._notify_exhausted(task, user)
+        if result.rowcount:
+            logger.warning(f"Возвращено в очередь задач с истёкшей арендой: {result.rowcount}")
+            self.notify()
+        return result.rowcount
     
-    async def start_worker(self):
-        """Запустить воркер обработки задач."""
+    async def _notify_exhausted(self, task: ProcessingTask, user: User):
+        """Сообщить пользователю, что задача снята после queue_max_attempts попыток."""
+        if self.bot is None or task.chat_id is None or task.message_id is None:
+            return
+        message, status_msg = self._bind_messages(task, user)
+        await self._notify_error(
+            message,
+            status_msg,
+            "❌ Не удалось обработать задачу: обработка несколько раз прерывалась.\n"
+            "Попробуй отправить аудио ещё раз."
+        )
+    
+    async def reload_pending(self) -> int:
+        """
+        Вернуть в очередь задачи с истёкшей арендой и разбудить воркеров.
+        
+        Задачи, которые сейчас обрабатывают другие процессы, не трогаются.
+        
+        Returns:
+            Число задач, ожидающих обработки
+        """
+        await self.reclaim_expired()
+        pending = await self.queue_size()
+        if pending:
+            logger.info(f"В очереди задач: {pending}")
+            self.notify()
+        return pending
+    
+    async def _reap(self):
+        """Периодически возвращать в очередь задачи с истёкшей арендой."""
+        while self._running:
+            await asyncio.sleep(settings.queue_heartbeat_interval)
+            try:
+                await self.reclaim_expired()
+            except Exception as e:
+                logger.error(f"Ошибка проверки аренды задач: {e}")
+    
+    async def start_worker(self, bot: Bot):
+        """Запустить воркеров обработки задач (max_concurrent_tasks штук)."""
         if self._running:
             logger.warning("Воркер уже запущен")
             return
         
+        self.bot = bot
         self._running = True
-        logger.info("Воркер очереди запущен")
+        try:
+            await self.reload_pending()
+        except Exception as e:
+            logger.error(f"Не удалось загрузить очередь задач: {e}")
+        self._workers = [
+            asyncio.create_task(self._worker(number), name=f"queue-worker-{number}")
+            for number in range(max(1, settings.max_concurrent_tasks))
+        ]
+        self._reaper = asyncio.create_task(self._reap(), name="queue-reaper")
+        logger.info(f"Воркер очереди запущен ({len(self._workers)} воркеров, {self.instance_id})")
+    
+    async def stop_worker(self):
+        """Остановить воркеров; прерванные задачи сразу возвращаются в очередь."""
+        self._running = False
+        tasks = self._workers + ([self._reaper] if self._reaper else [])
+        for worker in tasks:
+            worker.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._reaper = None
         
+        try:
+            await self._release_leases()
+        except Exception as e:
+            logger.error(f"Не удалось вернуть задачи в очередь: {e}")
+        logger.info("Воркер очереди остановлен")
+    
+    async def _release_leases(self):
+        """Вернуть в очередь задачи этого процесса (остановка не считается попыткой)."""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(ProcessingTask)
+                .where(
+                    ProcessingTask.worker_id.startswith(f"{self.instance_id}/"),
+                    ProcessingTask.status.in_(IN_PROGRESS_STATUSES)
+                )
+                .values(
+                    status=TaskStatus.QUEUED,
+                    started_at=None,
+                    worker_id=None,
+                    lease_expires_at=None,
+                    attempts=ProcessingTask.attempts - 1
+                )
+            )
+            await session.commit()
+        if result.rowcount:
+            logger.info(f"Возвращено в очередь прерванных задач: {result.rowcount}")
+    
+    async def _worker(self, number: int):
+        """Цикл воркера: брать задачи, пока они есть, иначе ждать уведомления."""
+        worker_id = f"{self.instance_id}/{number}"
         while self._running:
             try:
-                async with self._semaphore:
-                    task = await self.get_next_task()
-                    if task:
-                        await self._process_task(task)
-                    else:
-                        await asyncio.sleep(2)  # Ждём, если очередь пуста
+                # Сбрасываем до выборки: уведомление после неё не потеряется
+                self._wakeup.clear()
+                # Сессия нужна только для выборки: обработка идёт минутами,
+                # стадии пишут в базу каждая своей короткой сессией
+                async with AsyncSessionLocal() as session:
+                    task = await self.get_next_task(session, worker_id)
+                if task is not None:
+                    wait = (task.started_at - task.created_at).total_seconds()
+                    logger.info(f"Воркер {number} взял задачу {task.id} (ожидание {wait:.2f} с)")
+                    # Уведомление могло быть сброшено выше, пока другой воркер
+                    # выбирал задачу: пусть свободные воркеры проверят очередь ещё раз
+                    self.notify()
+                    
+                    processing = asyncio.create_task(self._process_task(task.id))
+                    heartbeat = asyncio.create_task(self._heartbeat(task.id, worker_id, processing))
+                    try:
+                        await asyncio.wait({processing})
+                    finally:
+                        heartbeat.cancel()
+                        processing.cancel()
+                    continue
+                
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.queue_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"Ошибка в воркере: {e}")
+                logger.error(f"Ошибка в воркере {number}: {e}")
                 await asyncio.sleep(5)
     
-    async def stop_worker(self):
-        """Остановить воркер."""
-        self._running = False
-        logger.info("Воркер очереди остановлен")
+    def _bind_messages(self, task: ProcessingTask, user: User) -> Tuple[Message, Optional[Message]]:
+        """
+        Восстановить исходное и статусное сообщения задачи, привязанные к боту.
+        
+        Из сохранённых идентификаторов собираются объекты Message, у которых
+        работают answer, edit_text и т.п. - как у сообщений из обработчика.
+        """
+        chat = Chat(id=task.chat_id, type=ChatType.PRIVATE if task.chat_id > 0 else ChatType.GROUP)
+        message = Message(
+            message_id=task.message_id,
+            date=task.created_at,
+            chat=chat,
+            from_user=TelegramUser(
+                id=user.telegram_id,
+                is_bot=False,
+                first_name=user.first_name or "",
+                username=user.username
+            )
+        ).as_(self.bot)
+        
+        status_msg = None
+        if task.status_message_id:
+            status_msg = Message(
+                message_id=task.status_message_id,
+                date=task.created_at,
+                chat=chat
+            ).as_(self.bot)
+        return message, status_msg
     
-    async def _process_task(self, task: ProcessingTask):
-        """Обработать задачу."""
+    async def _process_task(self, task_id: int):
+        """
+        Обработать задачу конвейером стадий.
+        
+        Скачивание -> расшифровка (с декодированием) -> анализ через LLM
+        (классификация и извлечение) -> сохранение -> отправка результата.
+        Скачивание, расшифровка и анализ ограничены каждая своим семафором,
+        поэтому задачи на разных стадиях идут параллельно: пока одна
+        расшифровывается, другая уже обрабатывается LLM. Соединение с базой
+        на время стадий не занимается.
+        """
+        async with AsyncSessionLocal() as session:
+            task = await session.get(ProcessingTask, task_id)
+            user = await session.get(User, task.user_id)
+        
+        if task.chat_id is None or task.message_id is None:
+            await self._finish(task_id, TaskStatus.ERROR, "Нет данных чата для ответа")
+            return
+        
+        message, status_msg = self._bind_messages(task, user)
+        
         try:
-            task.status = TaskStatus.TRANSCRIBING
-            task.started_at = datetime.utcnow()
-            await self.db.commit()
-            
             logger.info(f"Начата обработка задачи {task.id}")
+            if status_msg is None:
+                status_msg = await message.answer(f"🎤 Задача #{task.id} взята в работу...")
             
-            # Здесь нужно скачать файл через Telegram API
-            # Пока что оставляем заглушку
-            # В реальной реализации нужно передать bot экземпляр
-            
-            # Расшифровка
-            # transcription = await self.whisper.transcribe(audio_data)
-            # task.transcription = transcription
-            
-            # Классификация
-            task.status = TaskStatus.PROCESSING
-            await self.db.commit()
+            transcription = await self._transcribe(task, status_msg)
+            # Сохраняем сразу: если анализ не удастся, расшифровка не потеряется
+            await self._update_task(task_id, transcription=transcription)
             
-            # classification = await self.llm.classify_message(transcription)
-            # task.message_type = MessageType(classification["type"].lower())
+            async with self._stages["llm"]:
+                await self._update_task(task_id, status=TaskStatus.PROCESSING)
+                analysis = await analyze(self.llm, transcription, status_msg)
             
-            # Обработка в зависимости от типа
-            # result = await self._process_by_type(transcription, task.message_type)
-            # task.result_data = json.dumps(result)
-            
-            task.status = TaskStatus.DONE
-            task.completed_at = datetime.utcnow()
-            await self.db.commit()
-            
-            logger.info(f"Задача {task.id} успешно обработана")
+            # Сохранение результата
+            try:
+                message_type = MessageType(analysis["type"])
+            except ValueError:
+                message_type = MessageType.UNKNOWN
+            await self._update_task(
+                task_id,
+                message_type=message_type,
+                result_data=json.dumps(analysis["data"], ensure_ascii=False)
+            )
             
+            await deliver_result(analysis, transcription, message, status_msg, task_id)
+            await self._finish(task_id, TaskStatus.DONE)
+            logger.info(f"Задача {task_id} успешно обработана")
+        
+        except TaskRejected as e:
+            await self._notify_error(message, status_msg, str(e))
+            await self._finish(task_id, TaskStatus.ERROR, str(e))
         except Exception as e:
-            logger.error(f"Ошибка обработки задачи {task.id}: {e}")
-            task.status = TaskStatus.ERROR
-            task.error_message = str(e)
-            task.completed_at = datetime.utcnow()
-            await self.db.commit()
-    
-    async def _process_by_type(self, transcription: str, message_type: MessageType) -> dict:
-        """Обработать в зависимости от типа сообщения."""
-        if message_type == MessageType.MEETING:
-            return await self.llm.process_meeting(transcription)
-        elif message_type == MessageType.REMINDER:
-            return await self.llm.process_reminder(transcription)
-        elif message_type == MessageType.ARCHIVE:
-            return await self.llm.process_archive(transcription)
+            logger.error(f"Ошибка обработки задачи {task_id}: {e}", exc_info=True)
+            await self._notify_error(message, status_msg, f"❌ Произошла ошибка при обработке: {str(e)}")
+            await self._finish(task_id, TaskStatus.ERROR, str(e))
+    
+    async def _transcribe(self, task: ProcessingTask, status_msg: Message) -> str:
+        """Стадии скачивания и расшифровки (с кэшем расшифровок)."""
+        # Модель выбирается по длительности и нагрузке на пул расшифровки
+        whisper_model = self.whisper.route_model(task.duration)
+        task.whisper_model = whisper_model
+        await self._update_task(task.id, whisper_model=whisper_model)
+        
+        # Тот же файл уже расшифровывался (пересланное сообщение) - не скачиваем
+        transcription = await transcription_cache.get(
+            whisper_model,
+            language=task.language,
+            file_unique_id=task.file_unique_id
+        )
+        if transcription is not None:
+            logger.info(f"Расшифровка задачи {task.id} найдена в кэше")
         else:
-            return {"type": "unknown", "transcription": transcription}
+            async with self._stages["download"]:
+                audio_file = await self._download(task, status_msg)
+            
+            with audio_file:
+                # То же аудио могли отправить заново другим файлом
+                content_hash = await hash_media(audio_file)
+                transcription = await transcription_cache.get(
+                    whisper_model,
+                    language=task.language,
+                    content_hash=content_hash
+                )
+                
+                if transcription is None:
+                    async def update_transcription_progress(progress: int):
+                        """Обновить прогресс расшифровки."""
+                        try:
+                            await status_msg.edit_text(f"🎤 Расшифровываю аудио...\n📊 Прогресс: {progress}%")
+                        except Exception as e:
+                            logger.warning(f"Не удалось обновить прогресс: {e}")
+                    
+                    async with self._stages["transcribe"]:
+                        await status_msg.edit_text("🎤 Расшифровываю аудио...\n📊 Прогресс: 0%")
+                        transcription, used_model = await self.whisper.transcribe(
+                            audio_file,
+                            language=task.language,
+                            progress_callback=update_transcription_progress,
+                            duration=task.duration,
+                            model_name=whisper_model
+                        )
+                    
+                    if used_model != whisper_model:
+                        # Сервер расшифровки под нагрузкой взял модель меньше:
+                        # в кэш и задачу записывается фактическая
+                        whisper_model = used_model
+                        task.whisper_model = whisper_model
+                        await self._update_task(task.id, whisper_model=whisper_model)
+                    
+                    if transcription and transcription.strip():
+                        await transcription_cache.put(
+                            transcription,
+                            whisper_model,
+                            language=task.language,
+                            file_unique_id=task.file_unique_id,
+                            content_hash=content_hash
+                        )
+        
+        if not transcription or not transcription.strip():
+            raise TaskRejected("❌ Не удалось расшифровать аудио. Попробуй ещё раз.")
+        return transcription
+    
+    async def _download(self, task: ProcessingTask, status_msg: Message):
+        """Скачать файл задачи из Telegram (вызывающий код закрывает файл)."""
+        await status_msg.edit_text("📥 Скачиваю файл...")
+        file = await self.bot.get_file(task.file_id)
+        
+        # Лимит Bot API для скачивания: 50 МБ, но лучше ограничить до 20 МБ для надежности
+        file_size = getattr(file, "file_size", None)
+        if file_size and file_size > MAX_DOWNLOAD_SIZE:
+            raise TaskRejected(
+                f"❌ Файл слишком большой ({file_size / 1024 / 1024:.1f} MB).\n"
+                f"Максимальный размер: 20 MB.\n"
+                f"Пожалуйста, отправьте файл меньшего размера."
+            )
+        
+        try:
+            # Скачиваем файл в буфер в памяти (на диск - только очень большие)
+            audio_file = await download_media(self.bot, file.file_path, file_size)
+        except Exception as e:
+            if "too big" in str(e).lower():
+                raise TaskRejected(
+                    "❌ Файл слишком большой для скачивания через Bot API.\n"
+                    "Максимальный размер: 20 MB.\n"
+                    "Пожалуйста, отправьте файл меньшего размера или разделите его на части."
+                ) from e
+            raise TaskRejected(
+                f"❌ Ошибка скачивания файла: {e}\n"
+                f"Попробуйте отправить файл ещё раз."
+            ) from e
+        
+        downloaded_size = media_size(audio_file)
+        if downloaded_size == 0:
+            audio_file.close()
+            raise TaskRejected("❌ Файл не был скачан или пуст. Попробуйте отправить файл ещё раз.")
+        
+        await status_msg.edit_text(
+            f"🎤 Файл скачан ({downloaded_size / 1024 / 1024:.1f} MB), начинаю расшифровку...\n"
+            f"📝 Задача #{task.id} в очереди"
+        )
+        return audio_file
+    
+    async def _notify_error(self, message: Message, status_msg: Optional[Message], text: str):
+        """Показать ошибку в статусном сообщении (или ответом, если его нет)."""
+        try:
+            if status_msg is not None:
+                await status_msg.edit_text(text)
+            else:
+                await message.answer(text)
+        except Exception as e:
+            logger.warning(f"Не удалось сообщить об ошибке: {e}")
+    
+    async def _update_task(self, task_id: int, **values):
+        """Записать поля задачи (своей короткой сессией)."""
+        async with AsyncSessionLocal() as session:
+            await session.execute(update(ProcessingTask).where(ProcessingTask.id == task_id).values(**values))
+            await session.commit()
+    
+    async def _finish(self, task_id: int, status: TaskStatus, error_message: Optional[str] = None):
+        await self._update_task(
+            task_id,
+            status=status,
+            error_message=error_message,
+            completed_at=datetime.utcnow(),
+            lease_expires_at=None
+        )
+
 
+_queue_service: Optional[QueueService] = None
+
+
+def get_queue_service() -> QueueService:
+    """Получить общий экземпляр QueueService."""
+    global _queue_service
+    
+    if _queue_service is None:
+        _queue_service = QueueService()
+    
+    return _queue_service
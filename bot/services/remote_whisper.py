@@ -0,0 +1,140 @@
+"""Асинхронный клиент OpenAI-совместимого API расшифровки."""
+import random
+import asyncio
+from typing import Optional, Tuple
+
+import httpx
+
+from config import settings
+from bot.services.media_download import AudioSource, upload_content
+from bot.utils.logger import logger
+
+
+# Ответы, после которых запрос стоит повторить
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """Задержка из заголовка Retry-After (в секундах), если он есть."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def _make_transport(base_url: str):
+    """
+    Базовый URL и транспорт.
+
+    Адрес вида unix:/path/to/socket означает сервер на Unix-сокете.
+    """
+    if base_url.startswith("unix:"):
+        path = base_url[len("unix:"):]
+        transport = httpx.AsyncHTTPTransport(uds=path, retries=0)
+        return "http://localhost/v1", transport
+    return base_url, None
+
+
+class RemoteWhisperClient:
+    """
+    Клиент /audio/transcriptions (OpenAI, совместимый сервер или
+    transcription_server).
+
+    Использует один пул HTTP-соединений, ограничивает число одновременных
+    запросов, повторяет запросы при сетевых ошибках, 429 и 5xx с
+    экспоненциальной задержкой. Аудио в памяти отправляется из того же
+    буфера, файл на диске - потоково, блоками, без чтения целиком в память.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        model: str = "whisper-1"
+    ):
+        self.model = model
+        self.max_retries = settings.remote_whisper_max_retries
+
+        headers = {}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+
+        base_url, transport = _make_transport(base_url or settings.openai_api_base_url)
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            transport=transport,
+            headers=headers,
+            timeout=settings.remote_whisper_timeout,
+            limits=httpx.Limits(
+                max_connections=settings.remote_whisper_max_concurrency,
+                max_keepalive_connections=settings.remote_whisper_max_concurrency
+            )
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.remote_whisper_max_concurrency)
+        return self._semaphore
+
+    async def transcribe(
+        self,
+        audio: AudioSource,
+        language: Optional[str] = None,
+        filename: str = "audio.ogg",
+        model: Optional[str] = None,
+        duration: Optional[float] = None
+    ) -> Tuple[str, str]:
+        """
+        Расшифровать аудио через API.
+
+        Args:
+            audio: Байты или файл с аудио
+            language: Язык (опционально, для автоопределения - None)
+            filename: Имя файла (по расширению сервер определяет формат)
+            model: Модель (по умолчанию self.model)
+            duration: Длительность (поле понимает только transcription_server)
+
+        Returns:
+            (текст расшифровки, модель, которой она выполнена: transcription_server
+             под нагрузкой может взять модель меньше запрошенной)
+        """
+        data = {"model": model or self.model, "response_format": "json"}
+        if language:
+            data["language"] = language
+        if duration is not None:
+            data["duration"] = str(duration)
+
+        async with self._get_semaphore():
+            for attempt in range(self.max_retries + 1):
+                delay = None
+                try:
+                    # Файл перематывается в начало на каждой попытке
+                    files = {"file": (filename, upload_content(audio), "application/octet-stream")}
+                    response = await self._client.post("/audio/transcriptions", data=data, files=files)
+
+                    if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                        delay = _retry_after(response)
+                        logger.warning(f"API расшифровки вернул {response.status_code}, повтор {attempt + 1}/{self.max_retries}")
+                    else:
+                        response.raise_for_status()
+                        payload = response.json()
+                        return payload.get("text", ""), payload.get("model") or data["model"]
+                except httpx.TransportError as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    logger.warning(f"Ошибка соединения с API расшифровки: {e}, повтор {attempt + 1}/{self.max_retries}")
+
+                if delay is None:
+                    # Экспоненциальная задержка со случайным разбросом
+                    delay = settings.remote_whisper_backoff * (2 ** attempt) * (0.5 + random.random())
+                await asyncio.sleep(delay)
+
+        raise RuntimeError("API расшифровки недоступен")
+
+    async def aclose(self):
+        """Закрыть пул соединений."""
+        await self._client.aclose()
@@ -1,8 +1,11 @@
-"""Вспомогательные функции для отправки результатов обработки."""
+"""Анализ расшифровки через LLM и отправка результатов обработки в чат."""
+import time
 import asyncio
 import tempfile
 from pathlib import Path
+from typing import Optional
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from config import settings
 from bot.utils.logger import logger
 
 # Максимальная длина сообщения Telegram (4096 символов)
@@ -67,6 +70,227 @@ async def _send_text_or_file(
         await status_msg.edit_text(text, reply_markup=keyboard)
 
 
+# Значки типов и подписи полей для предпросмотра во время потокового ответа
+PREVIEW_ICONS = {
+    "meeting": "👥", "reminder": "⏰", "archive": "📚", "diary": "📔", "work": "💼",
+    "home": "🏠", "study": "📚", "ideas": "💡", "health": "🏥", "finance": "💰"
+}
+PREVIEW_LABELS = {
+    "participants": "👤 Участники", "tasks": "✅ Задачи", "decisions": "💡 Решения",
+    "key_points": "🔑 Ключевые моменты", "tags": "🏷 Теги", "thoughts": "💭 Мысли",
+    "emotions": "😊 Эмоции", "done": "✅ Выполнено", "planned": "📅 Запланировано",
+    "problems": "⚠️ Проблемы/Риски", "ideas": "💡 Идеи", "definitions": "📖 Определения",
+    "examples": "💡 Примеры", "questions": "❓ Вопросы", "follow_up_tasks": "📝 Следующие шаги",
+    "symptoms": "🤒 Симптомы", "actions": "💊 Действия", "triggers": "⚡ Триггеры",
+    "transactions": "💰 Операции"
+}
+# Поля-заголовки (показываются первой строкой)
+PREVIEW_TITLE_FIELDS = ("title", "topic", "text")
+
+
+def _preview_item(item) -> str:
+    """Элемент списка в предпросмотре: строка или главное поле объекта."""
+    if isinstance(item, dict):
+        for key in ("title", "description", "amount"):
+            if item.get(key) not in (None, ""):
+                return clean_text(str(item[key]))
+        return ""
+    return clean_text(str(item))
+
+
+def render_partial_result(message_type: Optional[str], result: dict) -> str:
+    """Текст предпросмотра по уже полученным полям результата."""
+    icon = PREVIEW_ICONS.get(message_type or "", "📝")
+    title = next((result[key] for key in PREVIEW_TITLE_FIELDS if isinstance(result.get(key), str) and result[key]), None)
+    
+    text = f"{icon} {clean_text(title)}\n\n" if title else f"{icon} Формирую результат...\n\n"
+    for key, value in result.items():
+        if key in PREVIEW_TITLE_FIELDS and value == title:
+            continue
+        if isinstance(value, str) and value:
+            text += f"{clean_text(value)}\n\n"
+        elif isinstance(value, list) and value:
+            items = [item for item in (_preview_item(v) for v in value) if item]
+            if items:
+                text += f"{PREVIEW_LABELS.get(key, key)}:\n"
+                text += "".join(f"{i}. {item}\n" for i, item in enumerate(items, 1))
+                text += "\n"
+    return text + "⏳ ..."
+
+
+class StreamingPreview:
+    """
+    Предпросмотр результата в статусном сообщении по мере потокового
+    ответа LLM. Правки не чаще llm_stream_edit_interval (лимиты Telegram),
+    close() выводит последнее пропущенное обновление. Итоговый результат
+    потом выводит соответствующий _send_*_result.
+    """
+    
+    def __init__(self, status_msg: Message):
+        self.status_msg = status_msg
+        self.shown = False
+        self._last_edit: Optional[float] = None
+        self._last_text = ""
+        self._pending: Optional[tuple] = None
+    
+    async def update(self, message_type: Optional[str], partial: dict):
+        self._pending = (message_type, partial)
+        if self._last_edit is not None and time.monotonic() - self._last_edit < settings.llm_stream_edit_interval:
+            return
+        await self._show()
+    
+    async def close(self):
+        """Показать последнее обновление, если его пропустили из-за интервала."""
+        if self._pending is not None:
+            await self._show()
+    
+    async def _show(self):
+        message_type, partial = self._pending
+        self._pending = None
+        
+        text = render_partial_result(message_type, partial)
+        if len(text) > MAX_MESSAGE_LENGTH:
+            text = text[:MAX_MESSAGE_LENGTH - 4] + "\n..."
+        if text == self._last_text:
+            return
+        
+        self._last_edit = time.monotonic()
+        self._last_text = text
+        try:
+            await self.status_msg.edit_text(text)
+            self.shown = True
+        except Exception as e:
+            logger.debug(f"Не удалось обновить предпросмотр: {e}")
+
+
+async def _send_meeting_result(
+    message: Message,
+    status_msg: Message,
+    result: dict,
+    task_id: int
+):
+    """Отправить результат обработки собрания."""
+    if "error" in result:
+        await status_msg.edit_text(f"❌ Ошибка обработки: {result['error']}")
+        return
+    
+    title = clean_text(str(result.get('title', 'Собрание')))
+    summary = clean_text(str(result.get('summary', '')))
+    
+    text = f"👥 {title}\n\n"
+    text += f"📋 {summary}\n\n"
+    
+    if result.get("participants"):
+        participants = [clean_text(str(p)) for p in result['participants']]
+        text += f"👤 Участники: {', '.join(participants)}\n\n"
+    
+    if result.get("tasks"):
+        text += "✅ Задачи:\n"
+        for i, task in enumerate(result["tasks"], 1):
+            task_title = clean_text(str(task.get('title', '')))
+            text += f"{i}. {task_title}"
+            if task.get("assignee"):
+                assignee = clean_text(str(task['assignee']))
+                text += f" → {assignee}"
+            if task.get("due_date"):
+                due_date = clean_text(str(task['due_date']))
+                text += f" (до {due_date})"
+            text += "\n"
+        text += "\n"
+    
+    if result.get("decisions"):
+        text += "💡 Решения:\n"
+        for i, decision in enumerate(result["decisions"], 1):
+            decision_text = clean_text(str(decision))
+            text += f"{i}. {decision_text}\n"
+        text += "\n"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="🔄 Переформулировать", callback_data=f"reprocess_{task_id}"),
+            InlineKeyboardButton(text="✏️ Изменить тип", callback_data=f"change_type_{task_id}")
+        ],
+        [
+            InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_{task_id}")
+        ]
+    ])
+    
+    await _send_text_or_file(message, status_msg, text, "Собрание", keyboard)
+
+
+async def _send_reminder_result(
+    message: Message,
+    status_msg: Message,
+    result: dict,
+    task_id: int
+):
+    """Отправить результат обработки напоминания."""
+    if "error" in result:
+        await status_msg.edit_text(f"❌ Ошибка обработки: {result['error']}")
+        return
+    
+    reminder_text = clean_text(str(result.get('text', '')))
+    text = f"⏰ Напоминание создано\n\n"
+    text += f"📝 {reminder_text}\n\n"
+    
+    if result.get("reminder_date"):
+        date = clean_text(str(result['reminder_date']))
+        text += f"📅 Дата: {date}\n"
+    elif result.get("relative_time"):
+        time = clean_text(str(result['relative_time']))
+        text += f"⏱ Время: {time}\n"
+    
+    if result.get("needs_clarification"):
+        text += "\n⚠️ Нужно уточнить дату/время"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="📅 Уточнить время", callback_data=f"clarify_time_{task_id}")
+        ],
+        [
+            InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_{task_id}")
+        ]
+    ])
+    
+    await _send_text_or_file(message, status_msg, text, "Напоминание", keyboard)
+
+
+async def _send_archive_result(
+    message: Message,
+    status_msg: Message,
+    result: dict,
+    task_id: int
+):
+    """Отправить результат обработки архива."""
+    if "error" in result:
+        await status_msg.edit_text(f"❌ Ошибка обработки: {result['error']}")
+        return
+    
+    title = clean_text(str(result.get('title', 'Заметка')))
+    summary = clean_text(str(result.get('summary', '')))
+    content = clean_text(str(result.get('content', '')))
+    
+    text = f"📚 {title}\n\n"
+    text += f"📋 {summary}\n\n"
+    text += f"{content}\n\n"
+    
+    if result.get("tags"):
+        tags = [clean_text(str(tag)) for tag in result['tags']]
+        text += f"🏷 Теги: {', '.join(tags)}\n"
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="🔄 Переформулировать", callback_data=f"reprocess_{task_id}"),
+            InlineKeyboardButton(text="✏️ Изменить тип", callback_data=f"change_type_{task_id}")
+        ],
+        [
+            InlineKeyboardButton(text="🗑 Удалить", callback_data=f"delete_{task_id}")
+        ]
+    ])
+    
+    await _send_text_or_file(message, status_msg, text, "Собрание", keyboard)
+
+
 async def _send_diary_result(
     message: Message,
     status_msg: Message,
@@ -423,3 +647,63 @@ async def _send_finance_result(
     
     await _send_text_or_file(message, status_msg, text, "Финансы", keyboard)
 
+
+async def analyze_and_send(llm, transcription: str, message: Message, status_msg: Message, task_id: int):
+    """Классифицировать расшифровку, обработать через LLM и отправить результат."""
+    analysis = await analyze(llm, transcription, status_msg)
+    await deliver_result(analysis, transcription, message, status_msg, task_id)
+
+
+async def analyze(llm, transcription: str, status_msg: Message) -> dict:
+    """Классифицировать расшифровку и извлечь данные, показывая предпросмотр в статусе."""
+    # Классификация и извлечение данных (один запрос в комбинированном режиме)
+    await status_msg.edit_text("🤖 Анализирую содержимое...\n📊 Прогресс обработки: 20%")
+    # Поля результата выводятся в статусное сообщение по мере ответа LLM
+    preview = StreamingPreview(status_msg)
+    analysis = await llm.classify_and_extract(transcription, on_partial=preview.update)
+    await preview.close()
+    
+    if not preview.shown:
+        await status_msg.edit_text("📝 Формирую результат...\n📊 Прогресс обработки: 60%")
+    return analysis
+
+
+async def deliver_result(analysis: dict, transcription: str, message: Message, status_msg: Message, task_id: int):
+    """Отправить результат анализа в чат по типу сообщения."""
+    message_type = analysis["type"]
+    result = analysis["data"]
+    
+    if message_type == "meeting":
+        await _send_meeting_result(message, status_msg, result, task_id)
+    elif message_type == "reminder":
+        await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
+        await _send_reminder_result(message, status_msg, result, task_id)
+    elif message_type == "archive":
+        await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
+        await _send_archive_result(message, status_msg, result, task_id)
+    elif message_type == "diary":
+        await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
+        await _send_diary_result(message, status_msg, result, task_id)
+    elif message_type == "work":
+        await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
+        await _send_work_result(message, status_msg, result, task_id)
+    elif message_type == "home":
+        await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
+        await _send_home_result(message, status_msg, result, task_id)
+    elif message_type == "study":
+        await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
+        await _send_study_result(message, status_msg, result, task_id)
+    elif message_type == "ideas":
+        await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
+        await _send_ideas_result(message, status_msg, result, task_id)
+    elif message_type == "health":
+        await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
+        await _send_health_result(message, status_msg, result, task_id)
+    elif message_type == "finance":
+        await status_msg.edit_text("📊 Прогресс обработки: 100%\n✅ Готово!")
+        await _send_finance_result(message, status_msg, result, task_id)
+    else:
+        await status_msg.edit_text(
+            f"📝 Расшифровка:\n\n{transcription}\n\n"
+            f"⚠️ Не удалось определить тип сообщения."
+        )
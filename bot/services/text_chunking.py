@@ -0,0 +1,116 @@
+"""Нарезка длинных расшифровок для LLM и слияние результатов по частям."""
+import re
+from typing import List, Dict, Any
+
+
+# Разбиение на предложения: после . ! ? … и пробела
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?…])\s+")
+NORMALIZE_RE = re.compile(r"[^\w]+", re.UNICODE)
+
+# Поля, которые при слиянии склеиваются, а не берутся из первой части
+CONCAT_FIELDS = ("content",)
+
+
+def estimate_tokens(text: str, chars_per_token: float) -> int:
+    """
+    Оценка числа токенов без токенизатора.
+
+    Для русского текста у распространённых моделей выходит около
+    3 символов на токен, для английского - около 4.
+    """
+    return int(len(text) / chars_per_token) + 1
+
+
+def split_text(text: str, max_tokens: int, overlap_tokens: int, chars_per_token: float) -> List[str]:
+    """
+    Разбить текст на части не длиннее max_tokens по границам предложений.
+
+    Соседние части перекрываются последними предложениями (до overlap_tokens),
+    чтобы не терять контекст на стыке. Слишком длинное предложение
+    режется по словам.
+    """
+    max_chars = max(1, int(max_tokens * chars_per_token))
+    overlap_chars = int(overlap_tokens * chars_per_token)
+
+    sentences: List[str] = []
+    for sentence in SENTENCE_SPLIT_RE.split(text.strip()):
+        if len(sentence) <= max_chars:
+            sentences.append(sentence)
+            continue
+        # Расшифровки бывают без знаков препинания - режем по словам
+        piece: List[str] = []
+        size = 0
+        for word in sentence.split():
+            if piece and size + len(word) + 1 > max_chars:
+                sentences.append(" ".join(piece))
+                piece, size = [], 0
+            piece.append(word)
+            size += len(word) + 1
+        if piece:
+            sentences.append(" ".join(piece))
+
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for sentence in sentences:
+        if current and size + len(sentence) + 1 > max_chars:
+            chunks.append(" ".join(current))
+            # Перекрытие: последние предложения предыдущей части
+            overlap: List[str] = []
+            overlap_size = 0
+            for previous in reversed(current):
+                if overlap_size + len(previous) + 1 > overlap_chars:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += len(previous) + 1
+            current, size = overlap, overlap_size
+        current.append(sentence)
+        size += len(sentence) + 1
+
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def _item_key(item: Any) -> str:
+    """Ключ для поиска повторов: текст без регистра и знаков препинания."""
+    if isinstance(item, dict):
+        item = item.get("title") or item.get("description") or sorted(item.items())
+    return NORMALIZE_RE.sub(" ", str(item).lower()).strip()
+
+
+def merge_extractions(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Слить результаты извлечения по частям текста (в порядке частей).
+
+    Списки (задачи, решения, ключевые моменты и т.п.) объединяются без
+    повторов, поля из CONCAT_FIELDS склеиваются, остальные значения берутся
+    из первой части, где они заполнены. Поле summary собирается из всех
+    частей (его можно потом сократить отдельным запросом).
+    """
+    merged: Dict[str, Any] = {}
+    seen: Dict[str, set] = {}
+    summaries: List[str] = []
+
+    for result in results:
+        for key, value in result.items():
+            if isinstance(value, list):
+                items = merged.setdefault(key, [])
+                keys = seen.setdefault(key, set())
+                for item in value:
+                    item_key = _item_key(item)
+                    if item_key and item_key not in keys:
+                        keys.add(item_key)
+                        items.append(item)
+            elif key == "summary":
+                if value:
+                    summaries.append(str(value))
+            elif key in CONCAT_FIELDS:
+                if value:
+                    merged[key] = f"{merged[key]}\n\n{value}" if merged.get(key) else value
+            elif merged.get(key) in (None, ""):
+                merged[key] = value
+
+    if summaries:
+        merged["summary"] = " ".join(summaries)
+    return merged
@@ -0,0 +1,150 @@
+"""Кэш расшифровок аудио."""
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict
+
+from sqlalchemy import select, delete, func
+
+from config import settings
+from bot.models.database import TranscriptionCache as CacheEntry
+from bot.services.whisper_models import get_model_tiers
+from bot.storage.database import AsyncSessionLocal
+from bot.utils.logger import logger
+
+
+# Как часто (в записях) запускать вытеснение старых записей
+EVICT_EVERY = 100
+
+
+def acceptable_models(model_name: str) -> List[str]:
+    """Модели, расшифровка которых подходит вместо model_name: она сама и более точные."""
+    tiers = get_model_tiers()
+    if model_name not in tiers:
+        return [model_name]
+    return tiers[tiers.index(model_name):]
+
+
+class TranscriptionCache:
+    """
+    Постоянный кэш расшифровок.
+
+    Поиск идёт по file_unique_id (без скачивания файла) или по хэшу
+    содержимого (для одинакового аудио, отправленного заново). Запись
+    подходит, если совпадает язык, а модель не хуже запрошенной.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+
+    async def get(
+        self,
+        model_name: str,
+        language: Optional[str] = None,
+        file_unique_id: Optional[str] = None,
+        content_hash: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Найти расшифровку в кэше.
+
+        Args:
+            model_name: Модель, которой была бы выполнена расшифровка
+            language: Язык расшифровки (None - автоопределение)
+            file_unique_id: Постоянный ID файла в Telegram
+            content_hash: sha256 содержимого аудио
+
+        Returns:
+            Текст расшифровки или None
+        """
+        if not settings.transcription_cache_enabled or not (file_unique_id or content_hash):
+            return None
+
+        if file_unique_id:
+            key_filter = CacheEntry.file_unique_id == file_unique_id
+        else:
+            key_filter = CacheEntry.content_hash == content_hash
+
+        ttl_border = datetime.utcnow() - timedelta(days=settings.transcription_cache_ttl_days)
+        stmt = select(CacheEntry).where(
+            key_filter,
+            CacheEntry.language == (language or "auto"),
+            CacheEntry.whisper_model.in_(acceptable_models(model_name)),
+            CacheEntry.created_at >= ttl_border
+        ).order_by(CacheEntry.created_at.desc()).limit(1)
+
+        try:
+            async with AsyncSessionLocal() as session:
+                entry = (await session.execute(stmt)).scalar_one_or_none()
+                if entry is None:
+                    self.misses += 1
+                    return None
+
+                entry.hits += 1
+                entry.last_used_at = datetime.utcnow()
+                await session.commit()
+                self.hits += 1
+                return entry.transcription
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кэша расшифровок: {e}")
+            self.misses += 1
+            return None
+
+    async def put(
+        self,
+        transcription: str,
+        model_name: str,
+        language: Optional[str] = None,
+        file_unique_id: Optional[str] = None,
+        content_hash: Optional[str] = None
+    ):
+        """Сохранить расшифровку в кэш."""
+        if not settings.transcription_cache_enabled or not transcription:
+            return
+
+        try:
+            async with AsyncSessionLocal() as session:
+                session.add(CacheEntry(
+                    file_unique_id=file_unique_id,
+                    content_hash=content_hash,
+                    whisper_model=model_name,
+                    language=language or "auto",
+                    transcription=transcription
+                ))
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка записи в кэш расшифровок: {e}")
+            return
+
+        self._puts += 1
+        if self._puts % EVICT_EVERY == 0:
+            await self.evict()
+
+    async def evict(self):
+        """Удалить устаревшие записи и самые давно использованные сверх лимита."""
+        ttl_border = datetime.utcnow() - timedelta(days=settings.transcription_cache_ttl_days)
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(delete(CacheEntry).where(CacheEntry.created_at < ttl_border))
+
+                count = (await session.execute(select(func.count(CacheEntry.id)))).scalar_one()
+                excess = count - settings.transcription_cache_max_entries
+                if excess > 0:
+                    oldest = select(CacheEntry.id).order_by(CacheEntry.last_used_at).limit(excess)
+                    await session.execute(delete(CacheEntry).where(CacheEntry.id.in_(oldest)))
+
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"Ошибка очистки кэша расшифровок: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        """Счётчики попаданий и промахов."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+# Общий экземпляр кэша
+transcription_cache = TranscriptionCache()
@@ -0,0 +1,135 @@
+"""Пул воркеров расшифровки."""
+import os
+import asyncio
+from typing import Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import settings
+from bot.utils.logger import logger
+
+
+def resolve_pool_size() -> int:
+    """Размер пула: из настроек или по числу ядер CPU."""
+    if settings.whisper_pool_size > 0:
+        return settings.whisper_pool_size
+
+    cpu_count = os.cpu_count() or 1
+    return max(1, cpu_count // max(1, settings.whisper_cpu_threads))
+
+
+class TranscriptionPool:
+    """
+    Пул воркеров расшифровки.
+
+    Каждый воркер - поток, который вызывает модель. Модель загружается
+    с num_workers = размер пула, поэтому CTranslate2 держит столько же
+    реплик и выполняет вызовы из разных потоков параллельно (GIL на время
+    декодирования отпускается). Задачи ждут свободный воркер в порядке
+    поступления.
+    """
+
+    def __init__(self, size: Optional[int] = None):
+        self.size = size or resolve_pool_size()
+        self.executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="whisper")
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._active = 0
+        self._waiting = 0
+        logger.info(f"Пул расшифровки: {self.size} воркеров по {settings.whisper_cpu_threads} потоков CPU")
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        # Семафор создаётся лениво, внутри работающего event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        return self._slots
+
+    @property
+    def active(self) -> int:
+        """Число занятых воркеров."""
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        """Число задач, ожидающих свободный воркер."""
+        return self._waiting
+
+    @property
+    def queue_depth(self) -> int:
+        """Нагрузка на пул: выполняющиеся и ожидающие задачи."""
+        return self._active + self._waiting
+
+    async def acquire(self):
+        """Дождаться свободного воркера."""
+        self._waiting += 1
+        try:
+            await self._get_slots().acquire()
+        finally:
+            self._waiting -= 1
+        self._active += 1
+
+    def release(self):
+        """Освободить воркер."""
+        self._active -= 1
+        self._get_slots().release()
+
+    def _release_threadsafe(self, loop: asyncio.AbstractEventLoop):
+        try:
+            loop.call_soon_threadsafe(self.release)
+        except RuntimeError:
+            # Event loop уже закрыт
+            pass
+
+    async def submit(self, func, *args) -> asyncio.Future:
+        """
+        Дождаться свободного воркера и запустить на нём синхронную функцию.
+
+        Воркер освобождается, когда функция действительно завершилась в потоке,
+        даже если ожидающая корутина была отменена раньше.
+        """
+        await self.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self.executor.submit(func, *args)
+        except Exception:
+            self.release()
+            raise
+        future.add_done_callback(lambda _: self._release_threadsafe(loop))
+        return asyncio.wrap_future(future)
+
+    async def run(self, func, *args):
+        """Выполнить синхронную функцию на свободном воркере."""
+        return await (await self.submit(func, *args))
+
+    def stats(self) -> Dict[str, int]:
+        """Состояние пула для мониторинга."""
+        return {
+            "size": self.size,
+            "active": self._active,
+            "waiting": self._waiting
+        }
+
+    def shutdown(self):
+        """Остановить пул."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Общий пул на процесс
+_transcription_pool: Optional[TranscriptionPool] = None
+
+
+def get_transcription_pool() -> TranscriptionPool:
+    """Получить общий пул расшифровки."""
+    global _transcription_pool
+
+    if _transcription_pool is None:
+        _transcription_pool = TranscriptionPool()
+
+    return _transcription_pool
+
+
+def shutdown_transcription_pool():
+    """Остановить общий пул расшифровки."""
+    global _transcription_pool
+
+    if _transcription_pool is not None:
+        _transcription_pool.shutdown()
+        _transcription_pool = None
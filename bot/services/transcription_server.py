@@ -0,0 +1,171 @@
+"""
+Сервер расшифровки: одна копия моделей Whisper на несколько процессов бота.
+
+Запуск:
+    python -m bot.services.transcription_server --port 8700
+    python -m bot.services.transcription_server --unix /run/bot_hnushka/whisper.sock
+
+В .env бота:
+    WHISPER_SERVER_URL=http://127.0.0.1:8700/v1
+    WHISPER_SERVER_URL=unix:/run/bot_hnushka/whisper.sock
+
+API совместимо с OpenAI (POST /v1/audio/transcriptions). Дополнительно
+принимается поле duration, а GET /v1/queue возвращает глубину очереди.
+"""
+import asyncio
+import argparse
+import tempfile
+from typing import Dict, Tuple, Optional
+
+from aiohttp import web
+
+from config import settings
+from bot.services.whisper_service import WhisperService, shutdown_whisper
+from bot.services.whisper_models import model_registry
+from bot.services.media_download import hash_media
+from bot.utils.logger import logger
+
+
+# Ключ одинакового запроса: (хэш аудио, модель, язык)
+RequestKey = Tuple[str, str, Optional[str]]
+
+
+class TranscriptionServer:
+    """
+    Сервер расшифровки поверх WhisperService.
+
+    Запросы всех клиентов распределяются по общему пулу воркеров, модели
+    загружены один раз. Одинаковые запросы, пришедшие одновременно
+    (то же аудио, модель и язык), выполняются одной расшифровкой.
+    """
+
+    def __init__(self):
+        self.whisper = WhisperService(local_only=True)
+        self._in_flight: Dict[RequestKey, asyncio.Future] = {}
+        self.requests_total = 0
+        self.requests_coalesced = 0
+
+    async def _read_request(self, request: web.Request):
+        """Прочитать multipart-запрос: аудио пишется в буфер потоково."""
+        fields = {}
+        audio_file = None
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == "file":
+                audio_file = tempfile.SpooledTemporaryFile(max_size=settings.media_spool_max_size)
+                while True:
+                    chunk = await part.read_chunk()
+                    if not chunk:
+                        break
+                    audio_file.write(chunk)
+                audio_file.seek(0)
+            else:
+                fields[part.name] = await part.text()
+        return audio_file, fields
+
+    async def handle_transcription(self, request: web.Request) -> web.Response:
+        """POST /v1/audio/transcriptions."""
+        try:
+            audio_file, fields = await self._read_request(request)
+        except Exception as e:
+            return web.json_response({"error": {"message": f"Некорректный запрос: {e}"}}, status=400)
+
+        if audio_file is None:
+            return web.json_response({"error": {"message": "Нет поля file"}}, status=400)
+
+        with audio_file:
+            language = fields.get("language") or None
+            try:
+                duration = float(fields["duration"]) if fields.get("duration") else None
+            except ValueError:
+                duration = None
+            model_name = self.whisper.route_model(duration, model_name=fields.get("model"))
+
+            key: RequestKey = (await hash_media(audio_file), model_name, language)
+            self.requests_total += 1
+
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.requests_coalesced += 1
+                try:
+                    text, model_name = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    if not future.cancelled():
+                        raise
+                    # Запрос-владелец прерван (клиент отключился, остановка сервера)
+                    return web.json_response({"error": {"message": "Расшифровка прервана"}}, status=503)
+                except Exception as e:
+                    return web.json_response({"error": {"message": str(e)}}, status=500)
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self._in_flight[key] = future
+                try:
+                    text, model_name = await self.whisper.transcribe(
+                        audio_file,
+                        language=language,
+                        duration=duration,
+                        model_name=model_name
+                    )
+                    future.set_result((text, model_name))
+                except Exception as e:
+                    future.set_exception(e)
+                    # Исключение получат ожидающие клиенты, здесь отвечаем сами
+                    future.exception()
+                    logger.error(f"Ошибка расшифровки на сервере: {e}")
+                    return web.json_response({"error": {"message": str(e)}}, status=500)
+                finally:
+                    # Ожидающие клиенты не должны зависнуть, если обработку
+                    # прервали (CancelledError не ловится выше)
+                    if not future.done():
+                        future.cancel()
+                    self._in_flight.pop(key, None)
+
+        return web.json_response({"text": text, "model": model_name})
+
+    async def handle_queue(self, request: web.Request) -> web.Response:
+        """GET /v1/queue: глубина очереди и загруженные модели."""
+        pool = self.whisper.pool
+        return web.json_response({
+            "pool": pool.stats(),
+            "queue_depth": pool.queue_depth,
+            "in_flight": len(self._in_flight),
+            "requests_total": self.requests_total,
+            "requests_coalesced": self.requests_coalesced,
+            "models": model_registry.stats()
+        })
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/v1/audio/transcriptions", self.handle_transcription)
+        app.router.add_get("/v1/queue", self.handle_queue)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def _on_startup(self, app: web.Application):
+        if settings.whisper_preload:
+            logger.info("Загрузка моделей Whisper...")
+            await asyncio.to_thread(self.whisper.preload)
+
+    async def _on_cleanup(self, app: web.Application):
+        await shutdown_whisper()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сервер расшифровки Whisper")
+    parser.add_argument("--host", default=settings.whisper_server_host)
+    parser.add_argument("--port", type=int, default=settings.whisper_server_port)
+    parser.add_argument("--unix", default=settings.whisper_server_socket, help="Путь к Unix-сокету")
+    options = parser.parse_args()
+
+    app = TranscriptionServer().make_app()
+    if options.unix:
+        logger.info(f"Сервер расшифровки на {options.unix}")
+        web.run_app(app, path=options.unix)
+    else:
+        logger.info(f"Сервер расшифровки на {options.host}:{options.port}")
+        web.run_app(app, host=options.host, port=options.port)
+
+
+if __name__ == "__main__":
+    main()
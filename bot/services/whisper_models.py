@@ -0,0 +1,161 @@
+"""Общий реестр моделей Whisper на процесс."""
+import gc
+import time
+import threading
+from typing import Dict, List, Tuple, Optional, TYPE_CHECKING
+
+from config import settings
+from bot.services.transcription_pool import resolve_pool_size
+from bot.utils.logger import logger
+
+if TYPE_CHECKING:
+    from faster_whisper import WhisperModel
+
+
+# Ключ модели: (название, устройство, тип вычислений)
+ModelKey = Tuple[str, str, str]
+
+
+def resolve_device() -> Tuple[str, str]:
+    """Определить устройство и тип вычислений из настроек."""
+    device = "cuda" if settings.whisper_device == "cuda" else "cpu"
+    compute_type = "float16" if device == "cuda" else "int8"
+    return device, compute_type
+
+
+def get_model_tiers() -> List[str]:
+    """Ступени моделей от быстрой к точной (settings.whisper_model_tiers)."""
+    tiers = [name.strip() for name in settings.whisper_model_tiers.split(",") if name.strip()]
+    for model_name in (settings.whisper_fast_model, settings.whisper_model):
+        if model_name not in tiers:
+            tiers.append(model_name)
+    return tiers
+
+
+class WhisperModelRegistry:
+    """
+    Реестр загруженных моделей Whisper.
+
+    Каждая модель загружается ровно один раз на процесс и используется
+    совместно всеми сервисами (обработчики, очередь, воркеры).
+    """
+
+    def __init__(self):
+        self._models: Dict[ModelKey, "WhisperModel"] = {}
+        self._load_times: Dict[ModelKey, float] = {}
+        self._key_locks: Dict[ModelKey, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _get_key_lock(self, key: ModelKey) -> threading.Lock:
+        """Получить блокировку для конкретной модели."""
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = threading.Lock()
+                self._key_locks[key] = lock
+            return lock
+
+    def get(
+        self,
+        model_name: Optional[str] = None,
+        device: Optional[str] = None,
+        compute_type: Optional[str] = None
+    ) -> "WhisperModel":
+        """
+        Получить модель, загрузив её при первом обращении.
+
+        Args:
+            model_name: Название модели (по умолчанию settings.whisper_model)
+            device: Устройство (по умолчанию из настроек)
+            compute_type: Тип вычислений (по умолчанию из настроек)
+
+        Returns:
+            Загруженная модель WhisperModel
+        """
+        default_device, default_compute_type = resolve_device()
+        key: ModelKey = (
+            model_name or settings.whisper_model,
+            device or default_device,
+            compute_type or default_compute_type
+        )
+
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        # Загрузка одной модели не блокирует обращения к другим
+        with self._get_key_lock(key):
+            model = self._models.get(key)
+            if model is not None:
+                return model
+
+            # Импорт здесь: процесс, работающий через сервер расшифровки, не загружает faster-whisper
+            from faster_whisper import WhisperModel
+
+            name, dev, ctype = key
+            started = time.perf_counter()
+            try:
+                # num_workers реплик позволяют параллельно вызывать модель из воркеров пула
+                model = WhisperModel(
+                    name,
+                    device=dev,
+                    compute_type=ctype,
+                    cpu_threads=settings.whisper_cpu_threads,
+                    num_workers=resolve_pool_size()
+                )
+            except Exception as e:
+                logger.error(f"Ошибка загрузки модели Whisper {name}: {e}")
+                raise
+            load_time = time.perf_counter() - started
+
+            with self._lock:
+                self._models[key] = model
+                self._load_times[key] = load_time
+
+            logger.info(f"Модель Whisper загружена: {name} на {dev} ({ctype}) за {load_time:.2f} сек.")
+            return model
+
+    def is_loaded(self, key: ModelKey) -> bool:
+        """Проверить, загружена ли модель."""
+        return key in self._models
+
+    def load_time(self, key: ModelKey) -> Optional[float]:
+        """Время загрузки модели в секундах."""
+        return self._load_times.get(key)
+
+    def stats(self) -> Dict[str, float]:
+        """Статистика загруженных моделей: ключ -> время загрузки."""
+        with self._lock:
+            return {"/".join(key): load_time for key, load_time in self._load_times.items()}
+
+    def unload(self, key: ModelKey):
+        """Выгрузить модель и освободить память."""
+        with self._lock:
+            model = self._models.pop(key, None)
+            self._load_times.pop(key, None)
+
+        if model is None:
+            return
+
+        # Явно освобождаем веса CTranslate2, не дожидаясь сборщика мусора
+        ct2_model = getattr(model, "model", None)
+        if ct2_model is not None and hasattr(ct2_model, "unload_model"):
+            try:
+                ct2_model.unload_model()
+            except Exception as e:
+                logger.warning(f"Не удалось выгрузить модель {key[0]}: {e}")
+
+        del model
+        gc.collect()
+        logger.info(f"Модель Whisper выгружена: {key[0]}")
+
+    def unload_all(self):
+        """Выгрузить все модели (при остановке бота)."""
+        with self._lock:
+            keys = list(self._models.keys())
+        for key in keys:
+            self.unload(key)
+
+
+# Глобальный реестр моделей
+model_registry = WhisperModelRegistry()
@@ -1,118 +1,405 @@
 """Сервис для расшифровки аудио через Whisper."""
-import io
+import time
 import asyncio
-from typing import Optional
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from typing import Optional, Callable, Tuple, Any
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-from faster_whisper import WhisperModel
-from openai import OpenAI
 
 from config import settings
+from bot.services.whisper_models import model_registry, get_model_tiers
+from bot.services.transcription_pool import TranscriptionPool, get_transcription_pool, shutdown_transcription_pool
+from bot.services.audio_chunking import SAMPLE_RATE, plan_chunks, merge_chunk_texts
+from bot.services.media_download import AudioSource
+from bot.services.remote_whisper import RemoteWhisperClient
 from bot.utils.logger import logger
 
 
+# Шаг прогресса (в процентах), с которым вызывается progress_callback
+PROGRESS_STEP = 5
+
+
+class TranscriptionStream:
+    """
+    Асинхронный поток сегментов расшифровки.
+
+    Декодирование (итерация по ленивому генератору faster-whisper) выполняется
+    на воркере пула расшифровки, сегменты передаются в event loop через ограниченную
+    очередь. Если потребитель не успевает, поток-воркер ждёт свободного места.
+    """
+    
+    def __init__(self, pool: TranscriptionPool, transcribe_fn: Callable[[], Tuple[Any, Any]]):
+        self._pool = pool
+        self._transcribe_fn = transcribe_fn
+        self._queue: Optional[asyncio.Queue] = None
+        self._stop = threading.Event()
+        self._producer: Optional[asyncio.Future] = None
+        self._done = False
+        self.info = None
+    
+    def _put(self, loop: asyncio.AbstractEventLoop, item: Tuple[str, Any]):
+        """Положить элемент в очередь из потока-воркера (с ожиданием места)."""
+        if self._stop.is_set():
+            return
+        try:
+            future = asyncio.run_coroutine_threadsafe(self._queue.put(item), loop)
+        except RuntimeError:
+            # Event loop уже закрыт
+            self._stop.set()
+            return
+        
+        while True:
+            try:
+                future.result(timeout=0.5)
+                return
+            except FutureTimeoutError:
+                if self._stop.is_set():
+                    future.cancel()
+                    return
+    
+    def _produce(self, loop: asyncio.AbstractEventLoop):
+        """Расшифровка в потоке-воркере."""
+        try:
+            segments, info = self._transcribe_fn()
+            self._put(loop, ("info", info))
+            
+            # Именно здесь происходит декодирование
+            for segment in segments:
+                if self._stop.is_set():
+                    break
+                self._put(loop, ("segment", segment))
+        except Exception as e:
+            self._put(loop, ("error", e))
+        finally:
+            self._put(loop, ("end", None))
+    
+    async def _start(self):
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=settings.whisper_stream_queue_size)
+        # Ждём свободный воркер пула
+        self._producer = await self._pool.submit(self._produce, loop)
+    
+    def progress(self, segment) -> int:
+        """Прогресс расшифровки (0-100) по концу сегмента и длительности аудио."""
+        duration = getattr(self.info, "duration", 0) or 0
+        if duration <= 0:
+            return 0
+        return max(0, min(100, int(segment.end / duration * 100)))
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self):
+        if self._done:
+            raise StopAsyncIteration
+        if self._producer is None:
+            await self._start()
+        
+        while True:
+            kind, payload = await self._queue.get()
+            if kind == "info":
+                self.info = payload
+            elif kind == "segment":
+                return payload, self.progress(payload)
+            elif kind == "error":
+                await self.aclose()
+                raise payload
+            else:
+                self._done = True
+                raise StopAsyncIteration
+    
+    async def aclose(self):
+        """Прервать расшифровку и освободить поток-воркер."""
+        self._done = True
+        self._stop.set()
+        if self._queue is not None:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
 class WhisperService:
-    """Сервис для расшифровки аудио."""
+    """
+    Сервис для расшифровки аудио.
+    
+    Режимы: локальная модель (faster-whisper), сервер расшифровки
+    (settings.whisper_server_url, faster-whisper в процессе бота не
+    импортируется) или OpenAI Whisper API.
+    """
     
-    def __init__(self):
-        self.model = None
-        self.openai_client = None
-        self.executor = ThreadPoolExecutor(max_workers=1)
+    def __init__(self, local_only: bool = False):
+        self.remote_client: Optional[RemoteWhisperClient] = None
+        self.server_mode = False
+        self.pool: Optional[TranscriptionPool] = None
+        self.tiers = get_model_tiers()
         
-        if settings.use_openai_whisper_api:
+        if local_only:
+            pass
+        elif settings.whisper_server_url:
+            self.remote_client = RemoteWhisperClient(base_url=settings.whisper_server_url)
+            self.server_mode = True
+            logger.info(f"Используется сервер расшифровки {settings.whisper_server_url}")
+        elif settings.use_openai_whisper_api:
             if settings.openai_api_key:
-                self.openai_client = OpenAI(api_key=settings.openai_api_key)
-                logger.info("Используется OpenAI Whisper API")
+                self.remote_client = RemoteWhisperClient(api_key=settings.openai_api_key)
+                logger.info(f"Используется OpenAI Whisper API ({settings.openai_api_base_url})")
             else:
                 logger.warning("OpenAI API key не указан, используем локальный Whisper")
-                self._init_local_model()
-        else:
-            self._init_local_model()
+        
+        if self.remote_client is None:
+            self.pool = get_transcription_pool()
     
-    def _init_local_model(self):
-        """Инициализация локальной модели Whisper."""
-        try:
-            device = "cuda" if settings.whisper_device == "cuda" else "cpu"
-            compute_type = "float16" if device == "cuda" else "int8"
-            
-            self.model = WhisperModel(
-                settings.whisper_model,
-                device=device,
-                compute_type=compute_type
+    def preload(self):
+        """Загрузить основные модели заранее (блокирующий вызов)."""
+        if self.remote_client:
+            return
+        for model_name in {settings.whisper_model, settings.whisper_fast_model}:
+            model_registry.get(model_name)
+    
+    def route_model(self, duration: Optional[float] = None, model_name: Optional[str] = None) -> str:
+        """
+        Выбрать модель для расшифровки.
+        
+        Короткие сообщения идут в быструю модель, длинные - в точную.
+        Если пул расшифровки перегружен, выбирается модель на ступень меньше.
+        
+        Args:
+            duration: Длительность аудио в секундах
+            model_name: Запрошенная модель (вместо выбора по длительности)
+        """
+        if self.remote_client and not self.server_mode:
+            return self.remote_client.model
+        
+        if model_name not in self.tiers:
+            if duration is not None and duration <= settings.whisper_fast_max_duration:
+                model_name = settings.whisper_fast_model
+            else:
+                model_name = settings.whisper_model
+        
+        # С сервером расшифровки ступень по нагрузке выбирает сам сервер
+        if self.pool is None:
+            return model_name
+        
+        threshold = settings.whisper_downgrade_queue_depth or self.pool.size * 2
+        if self.pool.queue_depth >= threshold and model_name in self.tiers:
+            index = self.tiers.index(model_name)
+            if index > 0:
+                logger.info(f"Пул расшифровки перегружен ({self.pool.queue_depth}), модель {model_name} -> {self.tiers[index - 1]}")
+                model_name = self.tiers[index - 1]
+        
+        return model_name
+    
+    def transcribe_stream(
+        self,
+        audio_data: AudioSource,
+        language: Optional[str] = None,
+        model_name: Optional[str] = None
+    ) -> TranscriptionStream:
+        """
+        Потоковая расшифровка локальной моделью.
+        
+        Использование:
+            async with whisper.transcribe_stream(audio) as stream:
+                async for segment, progress in stream:
+                    ...
+        
+        Args:
+            audio_data: Байты или файл с аудио
+            language: Язык (опционально, для автоопределения - None)
+            model_name: Модель (по умолчанию settings.whisper_model)
+        
+        Returns:
+            Асинхронный поток пар (сегмент, прогресс в процентах)
+        """
+        from bot.services.audio_preprocess import preprocess_audio
+        
+        def run_transcribe():
+            # Декодирование и модель из реестра - в потоке воркера, не в event loop
+            prepared = preprocess_audio(audio_data)
+            if prepared.audio.size == 0:
+                return iter(()), None
+            model = model_registry.get(model_name)
+            return model.transcribe(
+                prepared.audio,
+                language=language,
+                beam_size=settings.whisper_beam_size
             )
-            logger.info(f"Локальная модель Whisper загружена: {settings.whisper_model} на {device}")
-        except Exception as e:
-            logger.error(f"Ошибка загрузки локальной модели Whisper: {e}")
-            raise
+        
+        return TranscriptionStream(self.pool, run_transcribe)
+    
+    def _prepare_chunks(self, audio_data: AudioSource):
+        """Декодировать аудио и разбить его по паузам (выполняется на воркере пула)."""
+        from faster_whisper.vad import VadOptions, get_speech_timestamps
+        from bot.services.audio_preprocess import preprocess_audio
+        
+        audio = preprocess_audio(audio_data).audio
+        speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=500))
+        chunks = plan_chunks(
+            speech,
+            len(audio),
+            chunk_seconds=settings.whisper_chunk_seconds,
+            overlap_seconds=settings.whisper_chunk_overlap
+        )
+        return audio, chunks
+    
+    def _transcribe_chunk(self, audio, language: Optional[str], model_name: Optional[str]) -> str:
+        """Расшифровать один фрагмент целиком (выполняется на воркере пула)."""
+        model = model_registry.get(model_name)
+        segments, _ = model.transcribe(
+            audio,
+            language=language,
+            beam_size=settings.whisper_beam_size
+        )
+        return " ".join(segment.text.strip() for segment in segments)
+    
+    async def transcribe_chunked(
+        self,
+        audio_data: AudioSource,
+        language: Optional[str] = None,
+        progress_callback=None,
+        model_name: Optional[str] = None
+    ) -> str:
+        """
+        Расшифровать длинное аудио параллельно по фрагментам.
+        
+        Аудио режется в паузах, найденных VAD, на перекрывающиеся фрагменты,
+        которые расшифровываются одновременно на всех воркерах пула и
+        склеиваются по порядку без повторов на стыках.
+        """
+        audio, chunks = await self.pool.run(self._prepare_chunks, audio_data)
+        if not chunks:
+            return ""
+        
+        logger.info(f"Аудио {len(audio) / SAMPLE_RATE:.0f} сек. разбито на {len(chunks)} фрагментов")
+        
+        async def run_chunk(index: int, start: int, end: int):
+            # Срез numpy - представление без копирования
+            text = await self.pool.run(self._transcribe_chunk, audio[start:end], language, model_name)
+            return index, text, end - start
+        
+        tasks = [
+            asyncio.create_task(run_chunk(index, start, end))
+            for index, (start, end) in enumerate(chunks)
+        ]
+        texts = [""] * len(chunks)
+        total = sum(end - start for start, end in chunks)
+        processed = 0
+        
+        try:
+            for completed in asyncio.as_completed(tasks):
+                index, text, size = await completed
+                texts[index] = text
+                processed += size
+                
+                if progress_callback:
+                    try:
+                        await progress_callback(int(processed / total * 100))
+                    except Exception as e:
+                        logger.warning(f"Ошибка обновления прогресса: {e}")
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        return merge_chunk_texts(texts)
     
-    async def transcribe(self, audio_data: bytes, language: Optional[str] = None, progress_callback=None) -> str:
+    async def transcribe(
+        self,
+        audio_data: AudioSource,
+        language: Optional[str] = None,
+        progress_callback=None,
+        duration: Optional[float] = None,
+        model_name: Optional[str] = None
+    ) -> Tuple[str, str]:
         """
         Расшифровать аудио.
         
         Args:
-            audio_data: Байты аудио файла
+            audio_data: Байты или файл с аудио (см. media_download)
             language: Язык (опционально, для автоопределения - None)
+            duration: Длительность в секундах (если известна), длинное аудио
+                расшифровывается параллельно по фрагментам
+            model_name: Модель (см. route_model), по умолчанию settings.whisper_model
         
         Returns:
-            Текст расшифровки
+            (текст расшифровки, модель, которой она выполнена на самом деле)
         """
         try:
-            if self.openai_client:
-                # Используем OpenAI API
-                audio_file = io.BytesIO(audio_data)
-                audio_file.name = "audio.ogg"
-                
-                transcript = self.openai_client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language=language
+            if self.server_mode:
+                # Сервер расшифровки сам выбирает ступень модели по своей нагрузке
+                return await self.remote_client.transcribe(
+                    audio_data,
+                    language=language,
+                    model=model_name,
+                    duration=duration
                 )
-                return transcript.text
+            elif self.remote_client:
+                # Используем OpenAI API (асинхронно, event loop не блокируется)
+                return await self.remote_client.transcribe(audio_data, language=language)
+            
+            model_name = model_name or settings.whisper_model
+            if (
+                duration
+                and duration >= settings.whisper_chunk_min_duration
+                and self.pool.size > 1
+            ):
+                text = await self.transcribe_chunked(audio_data, language, progress_callback, model_name)
+                return text, model_name
             else:
-                # Используем локальную модель (синхронный вызов в executor)
-                audio_file = io.BytesIO(audio_data)
-                
-                # Функция для отслеживания прогресса
-                def transcribe_with_progress():
-                    segments, info = self.model.transcribe(
-                        audio_file,
-                        language=language,
-                        beam_size=5
-                    )
-                    return segments, info
-                
-                loop = asyncio.get_event_loop()
-                segments, info = await loop.run_in_executor(
-                    self.executor,
-                    transcribe_with_progress
-                )
-                
-                # Собираем текст из сегментов с отслеживанием прогресса
                 text_parts = []
-                total_segments = 0
-                processed_segments = 0
+                last_progress = 0
+                started = time.perf_counter()
                 
-                # Сначала считаем общее количество сегментов
-                segments_list = list(segments)
-                total_segments = len(segments_list)
+                async with self.transcribe_stream(audio_data, language=language, model_name=model_name) as stream:
+                    async for segment, progress in stream:
+                        text_parts.append(segment.text)
+                        
+                        # Обновляем прогресс не чаще, чем раз в PROGRESS_STEP процентов
+                        if progress_callback and progress - last_progress >= PROGRESS_STEP:
+                            last_progress = progress
+                            try:
+                                await progress_callback(progress)
+                            except Exception as e:
+                                logger.warning(f"Ошибка обновления прогресса: {e}")
+                    info = stream.info
                 
-                for i, segment in enumerate(segments_list):
-                    text_parts.append(segment.text)
-                    processed_segments = i + 1
-                    
-                    # Обновляем прогресс каждые 10% или каждые 5 сегментов
-                    if progress_callback and (processed_segments % max(1, total_segments // 10) == 0 or processed_segments % 5 == 0):
-                        progress = int((processed_segments / total_segments) * 100) if total_segments > 0 else 0
-                        try:
-                            await progress_callback(progress)
-                        except Exception as e:
-                            logger.warning(f"Ошибка обновления прогресса: {e}")
-                
-                full_text = " ".join(text_parts)
-                logger.info(f"Расшифровка завершена, язык: {info.language}, вероятность: {info.language_probability:.2f}")
-                return full_text
+                full_text = " ".join(part.strip() for part in text_parts)
+                if info is not None:
+                    logger.info(
+                        f"Расшифровка завершена за {time.perf_counter() - started:.2f} сек. (с декодированием), "
+                        f"язык: {info.language}, вероятность: {info.language_probability:.2f}"
+                    )
+                return full_text, model_name
                 
         except Exception as e:
             logger.error(f"Ошибка расшифровки аудио: {e}")
             raise
 
+
+# Общий экземпляр сервиса на процесс
+_whisper_service: Optional[WhisperService] = None
+
+
+def get_whisper_service() -> WhisperService:
+    """Получить общий экземпляр WhisperService (создаётся один раз)."""
+    global _whisper_service
+    
+    if _whisper_service is None:
+        _whisper_service = WhisperService()
+    
+    return _whisper_service
+
+
+async def shutdown_whisper():
+    """Освободить общий сервис и все загруженные модели."""
+    global _whisper_service
+    
+    if _whisper_service is not None and _whisper_service.remote_client:
+        await _whisper_service.remote_client.aclose()
+    _whisper_service = None
+    shutdown_transcription_pool()
+    model_registry.unload_all()
@@ -0,0 +1,65 @@
+"""
+Локальная заглушка OpenAI-совместимого API расшифровки для нагрузочных тестов.
+
+Запуск:
+    python -m bot.services.whisper_stub_server --port 8765 --latency 0.5 --error-rate 0.1
+
+В .env бота:
+    USE_OPENAI_WHISPER_API=true
+    OPENAI_API_KEY=stub
+    OPENAI_API_BASE_URL=http://127.0.0.1:8765/v1
+"""
+import asyncio
+import argparse
+import random
+
+from aiohttp import web
+
+
+async def handle_transcription(request: web.Request) -> web.Response:
+    """POST /v1/audio/transcriptions: принять файл и вернуть фиктивный текст."""
+    options = request.app["options"]
+
+    size = 0
+    fields = {}
+    reader = await request.multipart()
+    async for part in reader:
+        if part.name == "file":
+            # Файл читается потоково, как настоящим сервером
+            while True:
+                chunk = await part.read_chunk()
+                if not chunk:
+                    break
+                size += len(chunk)
+        else:
+            fields[part.name] = await part.text()
+
+    if random.random() < options.error_rate:
+        return web.json_response(
+            {"error": {"message": "Rate limit exceeded (stub)"}},
+            status=429,
+            headers={"Retry-After": "1"}
+        )
+
+    await asyncio.sleep(options.latency)
+    return web.json_response({
+        "text": f"Тестовая расшифровка: {size} байт, модель {fields.get('model', '-')}, язык {fields.get('language', 'auto')}"
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка OpenAI Whisper API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Задержка ответа, сек.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 429")
+    options = parser.parse_args()
+
+    app = web.Application(client_max_size=50 * 1024 * 1024)
+    app["options"] = options
+    app.router.add_post("/v1/audio/transcriptions", handle_transcription)
+    web.run_app(app, host=options.host, port=options.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,16 @@
 """Управление базой данных."""
 from sqlmodel import SQLModel
+from sqlalchemy import inspect, text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 
 from config import settings
+from bot.utils.logger import logger
 
 # Импортируем все модели для регистрации в SQLModel.metadata
 from bot.models.database import (
     User, ProcessingTask, Task, Reminder, ArchiveItem,
-    DiaryEntry, WorkNote, HomeTask, StudyNote, Idea, HealthLog, FinanceTransaction
+    DiaryEntry, WorkNote, HomeTask, StudyNote, Idea, HealthLog, FinanceTransaction,
+    TranscriptionCache, LLMResponseCache
 )
 
 
@@ -26,10 +29,60 @@ AsyncSessionLocal = async_sessionmaker(
 )
 
 
+def _add_missing_columns(sync_conn):
+    """
+    Добавить в существующие таблицы колонки, появившиеся в моделях.
+    
+    create_all создаёт только новые таблицы, поэтому новые поля моделей
+    в уже существующей БД добавляются через ALTER TABLE.
+    """
+    inspector = inspect(sync_conn)
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            
+            column_type = column.type.compile(dialect=sync_conn.dialect)
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            if not column.nullable:
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if default is None:
+                    logger.warning(f"Колонка {table.name}.{column.name} без значения по умолчанию, пропускаем")
+                    continue
+                default = getattr(default, "value", default)
+                if isinstance(default, bool):
+                    default = int(default)
+                literal = f"'{default}'" if isinstance(default, str) else default
+                ddl += f" NOT NULL DEFAULT {literal}"
+            
+            sync_conn.execute(text(ddl))
+            logger.info(f"Добавлена колонка {table.name}.{column.name}")
+
+
+def _add_missing_indexes(sync_conn):
+    """Создать индексы моделей, которых нет в существующих таблицах."""
+    inspector = inspect(sync_conn)
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(sync_conn)
+                logger.info(f"Создан индекс {index.name}")
+
+
 async def init_db():
     """Инициализация базы данных."""
     async with async_engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_add_missing_indexes)
 
 
 async def get_session() -> AsyncSession:
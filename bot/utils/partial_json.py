@@ -0,0 +1,83 @@
+"""Разбор неполного JSON из потокового ответа LLM."""
+import json
+from typing import Optional, Dict, Any, List
+
+
+def _closers(stack: List[str]) -> str:
+    return "".join("}" if opener == "{" else "]" for opener in reversed(stack))
+
+
+def parse_partial_json(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Разобрать начало JSON-объекта, который ещё дописывается.
+
+    Незакрытые объекты и массивы закрываются, недописанное строковое
+    значение обрезается по текущему месту, недописанные ключи, числа и
+    литералы отбрасываются. Текст до первой "{" (например, ```json)
+    пропускается.
+
+    Returns:
+        Словарь с уже полученными полями или None, если разобрать нечего
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    text = text[start:]
+
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    string_is_key = False
+    expect_key = False
+    # Последнее место, где можно обрезать текст и закрыть скобки
+    safe_end = 0
+    safe_closers = ""
+
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+                if not string_is_key:
+                    safe_end, safe_closers = i + 1, _closers(stack)
+            continue
+
+        if ch == '"':
+            in_string = True
+            string_is_key = bool(stack) and stack[-1] == "{" and expect_key
+        elif ch in "{[":
+            stack.append(ch)
+            expect_key = ch == "{"
+            safe_end, safe_closers = i + 1, _closers(stack)
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            expect_key = False
+            safe_end, safe_closers = i + 1, _closers(stack)
+            if not stack:
+                # Объект закончен, дальше может быть мусор (```)
+                break
+        elif ch == ":":
+            expect_key = False
+        elif ch == ",":
+            safe_end, safe_closers = i, _closers(stack)
+            expect_key = bool(stack) and stack[-1] == "{"
+
+    candidates = []
+    if in_string and not string_is_key:
+        # Недописанная строка-значение: показываем то, что уже пришло
+        body = text[:-1] if escape else text
+        candidates.append(body + '"' + _closers(stack))
+    candidates.append(text[:safe_end] + safe_closers)
+
+    for candidate in candidates:
+        try:
+            result = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        return result if isinstance(result, dict) else None
+    return None
@@ -22,8 +22,39 @@ class Settings(BaseSettings):
     # Whisper
     whisper_model: str = "medium"
     whisper_device: str = "cpu"
+    whisper_preload: bool = True  # Загружать модель при старте, а не на первом сообщении
+    whisper_stream_queue_size: int = 16  # Размер очереди сегментов между потоком расшифровки и event loop
+    whisper_beam_size: int = 5
+    # Обрезка тишины в начале и конце аудио перед расшифровкой
+    audio_trim_silence: bool = True
+    audio_silence_threshold_db: float = -45.0  # Порог тишины, dBFS
+    audio_silence_padding: float = 0.3  # Оставлять по краям, сек.
+    # Выбор модели по длительности и нагрузке
+    whisper_model_tiers: str = "base,small,medium"  # От быстрой к точной, через запятую
+    whisper_fast_model: str = "small"  # Для коротких голосовых
+    whisper_fast_max_duration: int = 60  # До скольки секунд сообщение считается коротким
+    whisper_downgrade_queue_depth: int = 0  # При такой нагрузке на пул - модель на ступень меньше (0 - 2 x размер пула)
+    # Сервер расшифровки (python -m bot.services.transcription_server), например
+    # http://127.0.0.1:8700/v1 или unix:/run/bot_hnushka/whisper.sock
+    whisper_server_url: Optional[str] = None
+    whisper_server_host: str = "127.0.0.1"
+    whisper_server_port: int = 8700
+    whisper_server_socket: Optional[str] = None
     use_openai_whisper_api: bool = False
     openai_api_key: Optional[str] = None
+    openai_api_base_url: str = "https://api.openai.com/v1"  # Можно указать совместимый сервер (см. whisper_stub_server)
+    remote_whisper_max_concurrency: int = 4  # Одновременных запросов к API расшифровки
+    remote_whisper_timeout: float = 120.0
+    remote_whisper_max_retries: int = 3
+    remote_whisper_backoff: float = 1.0  # Базовая задержка между повторами, сек.
+    
+    # Файлы до этого размера скачиваются в память, больше - во временный файл на диске
+    media_spool_max_size: int = 10 * 1024 * 1024
+    
+    # Кэш расшифровок
+    transcription_cache_enabled: bool = True
+    transcription_cache_ttl_days: int = 30
+    transcription_cache_max_entries: int = 10000
     
     # FreeQwenApi
     freewen_api_url: str = "http://localhost:3264"
@@ -40,6 +71,73 @@ class Settings(BaseSettings):
     local_llm_model: str = "qwen:4b"  # Qwen 2.5 4B через Ollama (локальный fallback)
     local_llm_api_type: str = "ollama"  # ollama, lmstudio, textgen
     
+    # Локальная быстрая классификация (правила + опциональная модель, см. bot/services/fast_classifier.py)
+    fast_classifier_enabled: bool = True
+    fast_classifier_min_confidence: float = 0.7  # Порог уверенности правил
+    fast_classifier_max_words: int = 40  # Правила применяются только к коротким сообщениям
+    fast_classifier_model_path: Optional[str] = None  # Обученная модель (.npz)
+    fast_classifier_model_min_confidence: float = 0.85
+    
+    # Классификация и извлечение одним запросом
+    llm_combined_mode: bool = True
+    llm_combined_min_confidence: float = 0.6  # Ниже - двухшаговая обработка
+    
+    # Хеджирование: резервный провайдер запускается параллельно, если основной медлит
+    llm_hedging: bool = True
+    llm_hedge_percentile: float = 0.95  # Задержка = этот перцентиль времени ответа основного
+    llm_hedge_min_samples: int = 5  # Меньше замеров - используется llm_hedge_default_delay
+    llm_hedge_default_delay: float = 10.0
+    llm_hedge_min_delay: float = 1.0
+    llm_latency_window: int = 100  # Сколько последних ответов учитывать
+    
+    # Автомат отключения недоступных провайдеров LLM
+    llm_breaker_enabled: bool = True
+    llm_breaker_window: int = 20  # Последних вызовов в окне
+    llm_breaker_window_seconds: float = 300.0  # Старые вызовы из окна забываются
+    llm_breaker_min_calls: int = 5  # Меньше вызовов - не отключать
+    llm_breaker_error_rate: float = 0.5  # Доля неудачных вызовов для отключения
+    llm_breaker_slow_call: float = 30.0  # Ответ дольше, сек., считается неудачным
+    llm_breaker_open_seconds: float = 30.0  # Пауза до пробного запроса
+    
+    # Потоковые ответы LLM с предпросмотром результата
+    llm_streaming: bool = True
+    llm_stream_edit_interval: float = 1.5  # Минимальный интервал правок статусного сообщения, сек.
+    
+    # Длинные расшифровки: обработка по частям (map-reduce)
+    llm_chunk_max_tokens: int = 6000  # Размер части, токенов
+    llm_chunk_overlap_tokens: int = 200  # Перекрытие соседних частей
+    llm_chars_per_token: float = 3.0  # Оценка длины токена для русского текста
+    
+    # Одновременные запросы к провайдеру: предел подстраивается (AIMD) -
+    # растёт на успешных ответах, падает при 429/503, таймаутах и резком
+    # росте времени ответа. Остальные запросы ждут своей очереди.
+    llm_provider_max_concurrency: int = 4  # Верхний предел для облачных провайдеров
+    local_llm_max_concurrency: int = 2  # Верхний предел для локальной LLM
+    llm_limit_initial: int = 2  # Начальный предел
+    llm_limit_min: int = 1  # Нижний предел
+    llm_limit_increase: float = 1.0  # Прибавка за каждые limit успешных ответов
+    llm_limit_backoff: float = 0.5  # Множитель предела при перегрузке
+    llm_limit_latency_factor: float = 3.0  # Ответ дольше медианы в N раз - перегрузка (0 - не учитывать)
+    llm_retry_after_default: float = 5.0  # Пауза при 429/503 без Retry-After, секунд
+    llm_retry_after_max: float = 120.0  # Предел паузы по Retry-After, секунд
+    llm_rate_limit_retries: int = 1  # Повторов запроса после 429/503 (после паузы)
+    
+    # Кэш ответов LLM: LRU в памяти и (опционально) таблица в базе бота
+    llm_cache_enabled: bool = True
+    llm_cache_persistent: bool = True
+    llm_cache_ttl: int = 7 * 24 * 3600  # Время жизни ответа, сек.
+    llm_cache_max_entries: int = 1000  # Записей в памяти
+    llm_cache_max_db_entries: int = 20000
+    
+    # Структурированный вывод: off, json (режим JSON провайдера) или schema (JSON Schema)
+    llm_json_mode: str = "json"
+    
+    # HTTP-клиенты LLM (общие на процесс, с keep-alive)
+    llm_http2: bool = True
+    llm_max_connections: int = 20
+    llm_max_keepalive_connections: int = 10
+    llm_keepalive_expiry: float = 60.0
+    
     # Database
     database_url: str = "sqlite+aiosqlite:///./bot.db"
     use_appwrite: bool = False  # Использовать Appwrite вместо SQLite
@@ -53,8 +151,28 @@ class Settings(BaseSettings):
     log_level: str = "INFO"
     
     # Queue settings
-    max_concurrent_tasks: int = 3
-    max_tasks_per_user: int = 5
+    max_concurrent_tasks: int = 8  # Задач в работе одновременно (на разных стадиях конвейера)
+    max_tasks_per_user: int = 5  # Незавершённых задач у пользователя (в очереди и в работе), 0 - без лимита
+    max_in_flight_per_user: int = 2  # Задач пользователя в работе одновременно, 0 - без лимита
+    queue_default_task_seconds: float = 60.0  # Оценка длительности задачи, пока нет статистики
+    # Очерёдность: сначала короткие задачи (по ожидаемому времени обработки)
+    queue_drr_quantum: float = 20.0  # Квант справедливого круга, сек. ожидаемой обработки
+    queue_aging_factor: float = 1.0  # На сколько секунд сдвигает задачу каждая секунда ожидания
+    queue_priority_step: float = 300.0  # На сколько секунд сдвигает задачу единица priority
+    queue_cost_overhead: float = 10.0  # Оценка LLM и отправки результата, сек.
+    queue_poll_interval: float = 30.0  # Опрос очереди (для задач других процессов), сек.
+    queue_lease_seconds: int = 120  # Аренда задачи воркером, сек.
+    queue_heartbeat_interval: float = 30.0  # Продление аренды и проверка истёкших, сек.
+    queue_max_attempts: int = 3  # Попыток обработки задачи (после падений процесса)
+    # Одновременных задач на стадиях конвейера
+    queue_download_concurrency: int = 4
+    queue_transcribe_concurrency: int = 0  # 0 - по числу воркеров пула расшифровки
+    queue_llm_concurrency: int = 4
+    whisper_pool_size: int = 0  # Воркеров расшифровки (реплик модели), 0 - по числу ядер CPU
+    whisper_cpu_threads: int = 2  # Потоков CTranslate2 на одну реплику
+    whisper_chunk_min_duration: int = 300  # С какой длительности (сек.) аудио режется на фрагменты
+    whisper_chunk_seconds: int = 120  # Желаемая длина фрагмента
+    whisper_chunk_overlap: float = 1.0  # Перекрытие фрагментов (сек.)
 
 
 # Глобальный экземпляр настроек
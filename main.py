@@ -12,6 +12,9 @@ from bot.utils.logger import logger
 from bot.handlers import common, media
 from bot.storage.database import init_db
 from bot.storage.appwrite_storage import get_appwrite_storage
+from bot.services.whisper_service import get_whisper_service, shutdown_whisper
+from bot.services.llm_service import close_llm_client
+from bot.services.queue_service import get_queue_service
 
 
 async def main():
@@ -32,6 +35,11 @@ async def main():
         await init_db()
         logger.info("База данных инициализирована")
     
+    # Загрузка модели Whisper один раз на процесс
+    if settings.whisper_preload:
+        logger.info("Загрузка модели Whisper...")
+        await asyncio.to_thread(get_whisper_service().preload)
+    
     # Создание бота и диспетчера
     bot = Bot(
         token=settings.bot_token,
@@ -43,6 +51,10 @@ async def main():
     dp.include_router(common.router)
     dp.include_router(media.router)
     
+    # Воркеры очереди задач (прерванные задачи возвращаются в очередь)
+    queue_service = get_queue_service()
+    await queue_service.start_worker(bot)
+    
     logger.info("Бот запущен")
     
     # Запуск polling
@@ -51,7 +63,10 @@ async def main():
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}", exc_info=True)
     finally:
+        await queue_service.stop_worker()
         await bot.session.close()
+        await close_llm_client()
+        await shutdown_whisper()
 
 
 if __name__ == "__main__":
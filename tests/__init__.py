@@ -0,0 +1 @@
+"""Тесты."""
@@ -0,0 +1,8 @@
+"""Общие настройки тестов."""
+import os
+import tempfile
+
+# Settings требует токен бота; к Telegram тесты не обращаются
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+# Тесты не трогают рабочую базу
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/test.db")
@@ -0,0 +1,155 @@
+"""Тесты адаптивного предела запросов к провайдеру LLM."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from bot.services.llm_service import AdaptiveLimiter, LatencyWindow, _parse_retry_after
+from config import settings
+
+
+@pytest.fixture(autouse=True)
+def limiter_settings(monkeypatch):
+    monkeypatch.setattr(settings, "llm_limit_initial", 2)
+    monkeypatch.setattr(settings, "llm_limit_min", 1)
+    monkeypatch.setattr(settings, "llm_limit_increase", 1.0)
+    monkeypatch.setattr(settings, "llm_limit_backoff", 0.5)
+    monkeypatch.setattr(settings, "llm_limit_latency_factor", 3.0)
+    monkeypatch.setattr(settings, "llm_hedge_min_samples", 5)
+    monkeypatch.setattr(settings, "llm_retry_after_max", 120.0)
+
+
+def make_limiter(max_limit=4, latencies=()):
+    window = LatencyWindow(100)
+    for latency in latencies:
+        window.record(latency)
+    return AdaptiveLimiter("test", max_limit, window)
+
+
+def test_parse_retry_after():
+    assert _parse_retry_after(None) is None
+    assert _parse_retry_after("") is None
+    assert _parse_retry_after("7") == 7.0
+    assert _parse_retry_after("-3") == 0.0
+    assert _parse_retry_after("завтра") is None
+    moment = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < _parse_retry_after(format_datetime(moment, usegmt=True)) <= 30
+    assert _parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_waiters_are_served_in_order():
+    async def scenario():
+        limiter = make_limiter()
+        first = await limiter.acquire()
+        second = await limiter.acquire()
+        order = []
+
+        async def waiter(name):
+            started = await limiter.acquire()
+            order.append(name)
+            return started
+
+        waiters = [asyncio.create_task(waiter(name)) for name in ("a", "b", "c")]
+        await asyncio.sleep(0)
+        assert limiter.stats()["waiting"] == 3
+
+        limiter.release(first, True, 0.1)
+        limiter.release(second, True, 0.1)
+        await asyncio.sleep(0)
+        assert order == ["a", "b"]
+        assert limiter.in_flight == 2
+        limiter.release(await waiters[0], True, 0.1)
+        await asyncio.gather(*waiters)
+        assert order == ["a", "b", "c"]
+
+    asyncio.run(scenario())
+
+
+def test_limit_grows_while_saturated():
+    async def scenario():
+        limiter = make_limiter(max_limit=3)
+        started = [await limiter.acquire(), await limiter.acquire()]
+        limiter.release(started[0], True, 0.1)
+        assert limiter.limit == pytest.approx(2.5)
+        limiter.release(started[1], True, 0.1)
+        # Предел не упирался в запросы - не растёт
+        assert limiter.limit == pytest.approx(2.5)
+
+        for _ in range(10):
+            calls = [await limiter.acquire() for _ in range(int(limiter.limit))]
+            for call in calls:
+                limiter.release(call, True, 0.1)
+        assert limiter.limit == 3
+
+    asyncio.run(scenario())
+
+
+def test_overload_decreases_once_per_wave():
+    async def scenario():
+        limiter = make_limiter(max_limit=8)
+        limiter.limit = 8.0
+        wave = [await limiter.acquire() for _ in range(4)]
+        limiter.overloaded(wave[0])
+        limiter.overloaded(wave[1])
+        assert limiter.limit == 4.0
+        assert limiter.decreases == 1
+
+        later = await limiter.acquire()
+        limiter.overloaded(later)
+        assert limiter.limit == 2.0
+        limiter.overloaded(wave[2])
+        assert limiter.limit == 2.0  # Запрос из первой волны
+        limiter.release(wave[3], True, 0.1)
+
+        await asyncio.sleep(0.01)
+        limiter.overloaded(await limiter.acquire())
+        await asyncio.sleep(0.01)
+        limiter.overloaded(await asyncio.wait_for(limiter.acquire(), 1))
+        assert limiter.limit == 1.0  # Не ниже llm_limit_min
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_slow_response_decreases_limit():
+    async def scenario():
+        limiter = make_limiter(latencies=[1.0] * 10)
+        started = await limiter.acquire()
+        limiter.release(started, True, 10.0)
+        assert limiter.limit == 1.0
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_pauses_queue():
+    async def scenario():
+        limiter = make_limiter()
+        started = await limiter.acquire()
+        limiter.overloaded(started, retry_after=0.2)
+        assert limiter.paused_for > 0
+
+        loop = asyncio.get_running_loop()
+        requested = loop.time()
+        await asyncio.wait_for(limiter.acquire(), 2)
+        assert loop.time() - requested >= 0.15
+        assert limiter.throttled == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def scenario():
+        limiter = make_limiter()
+        limiter.limit = 1.0
+        started = await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+        limiter.release(started, True, 0.1)
+        assert limiter.in_flight == 0
+        await asyncio.wait_for(limiter.acquire(), 1)
+
+    asyncio.run(scenario())
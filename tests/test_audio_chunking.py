@@ -0,0 +1,71 @@
+"""Тесты нарезки аудио на фрагменты и склейки расшифровок."""
+from bot.services.audio_chunking import plan_chunks, merge_chunk_texts
+
+RATE = 100  # Сэмплов в секунду - для наглядности
+
+
+def speech(*intervals):
+    return [{"start": start * RATE, "end": end * RATE} for start, end in intervals]
+
+
+def test_plan_chunks_without_speech():
+    assert plan_chunks([], 1000, chunk_seconds=10, overlap_seconds=1, sample_rate=RATE) == []
+
+
+def test_plan_chunks_short_audio_is_one_chunk():
+    chunks = plan_chunks(speech((1, 12)), 15 * RATE, chunk_seconds=10, overlap_seconds=1, sample_rate=RATE)
+    assert chunks == [(0, 13 * RATE)]
+
+
+def test_plan_chunks_cuts_in_pauses():
+    timestamps = speech((0, 9), (11, 19), (21, 29), (31, 40))
+    chunks = plan_chunks(timestamps, 40 * RATE, chunk_seconds=10, overlap_seconds=0, sample_rate=RATE)
+    # Разрезы - в серединах пауз (10, 20, 30 с)
+    assert chunks == [(0, 10 * RATE), (10 * RATE, 20 * RATE), (20 * RATE, 30 * RATE), (30 * RATE, 40 * RATE)]
+
+
+def test_plan_chunks_prefers_pause_near_target():
+    timestamps = speech((0, 12), (13, 30))
+    chunks = plan_chunks(timestamps, 30 * RATE, chunk_seconds=10, overlap_seconds=0, sample_rate=RATE)
+    # Пауза на 12.5 с ближе всего к желаемым 10 с - режем там, а не посреди речи
+    assert chunks[0] == (0, int(12.5 * RATE))
+
+
+def test_plan_chunks_adds_overlap_within_bounds():
+    timestamps = speech((0, 9), (11, 19), (21, 30))
+    chunks = plan_chunks(timestamps, 30 * RATE, chunk_seconds=10, overlap_seconds=1, sample_rate=RATE)
+    assert chunks[0] == (0, 11 * RATE)
+    assert chunks[-1][1] == 30 * RATE
+    for (_, prev_end), (next_start, _) in zip(chunks, chunks[1:]):
+        assert next_start < prev_end
+
+
+def test_plan_chunks_without_pauses_cuts_at_target():
+    chunks = plan_chunks(speech((0, 35)), 35 * RATE, chunk_seconds=10, overlap_seconds=0, sample_rate=RATE)
+    # Хвост короче полутора фрагментов не дробится
+    assert chunks == [(0, 10 * RATE), (10 * RATE, 20 * RATE), (20 * RATE, 35 * RATE)]
+
+
+def test_merge_removes_repeated_overlap():
+    texts = ["мы обсудили план на неделю", "План на неделю утвердили, и разошлись"]
+    assert merge_chunk_texts(texts) == "мы обсудили план на неделю утвердили, и разошлись"
+
+
+def test_merge_keeps_single_matching_word():
+    # Одно совпавшее слово на стыке - не перекрытие, слово не теряется
+    texts = ["купить хлеб и", "и молоко"]
+    assert merge_chunk_texts(texts) == "купить хлеб и и молоко"
+    assert merge_chunk_texts(["we met the", "the team"]) == "we met the the team"
+
+
+def test_merge_min_overlap_is_configurable():
+    assert merge_chunk_texts(["купить хлеб и", "и молоко"], min_overlap_words=1) == "купить хлеб и молоко"
+
+
+def test_merge_without_overlap_and_empty_chunks():
+    assert merge_chunk_texts(["первый фрагмент", "", "второй фрагмент"]) == "первый фрагмент второй фрагмент"
+    assert merge_chunk_texts([]) == ""
+
+
+def test_merge_ignores_punctuation_only_match():
+    assert merge_chunk_texts(["конец - —", "- — начало"]) == "конец - — - — начало"
@@ -0,0 +1,122 @@
+"""Тесты автомата отключения провайдера LLM."""
+import pytest
+
+from bot.services.llm_service import CircuitBreaker, CircuitState
+from config import settings
+
+
+@pytest.fixture(autouse=True)
+def breaker_settings(monkeypatch):
+    monkeypatch.setattr(settings, "llm_breaker_window", 10)
+    monkeypatch.setattr(settings, "llm_breaker_window_seconds", 300.0)
+    monkeypatch.setattr(settings, "llm_breaker_min_calls", 4)
+    monkeypatch.setattr(settings, "llm_breaker_error_rate", 0.5)
+    monkeypatch.setattr(settings, "llm_breaker_slow_call", 30.0)
+    monkeypatch.setattr(settings, "llm_breaker_open_seconds", 0.0)
+
+
+def record_calls(breaker, *results):
+    for success in results:
+        breaker.record(breaker.allow(), success)
+
+
+def trip(breaker):
+    record_calls(breaker, False, False, False, False)
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_stays_closed_below_min_calls():
+    breaker = CircuitBreaker("test")
+    record_calls(breaker, False, False, False)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.health == 1.0
+
+
+def test_opens_at_error_rate():
+    breaker = CircuitBreaker("test")
+    record_calls(breaker, True, True, False)
+    assert breaker.state == CircuitState.CLOSED
+    record_calls(breaker, False)
+    assert breaker.state == CircuitState.OPEN
+    assert breaker.trips == 1
+
+
+def test_slow_success_counts_as_failure():
+    breaker = CircuitBreaker("test")
+    for _ in range(4):
+        breaker.record(breaker.allow(), True, latency=60.0)
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_open_breaker_rejects_calls(monkeypatch):
+    monkeypatch.setattr(settings, "llm_breaker_open_seconds", 3600.0)
+    breaker = CircuitBreaker("test")
+    trip(breaker)
+    assert breaker.allow() is None
+    assert breaker.health == 0.0
+
+
+def test_single_probe_in_half_open():
+    breaker = CircuitBreaker("test")
+    trip(breaker)
+    probe = breaker.allow()
+    assert probe is not None
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert breaker.allow() is None
+
+    breaker.record(probe, True)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.calls == 0
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker("test")
+    trip(breaker)
+    breaker.record(breaker.allow(), False)
+    assert breaker.state == CircuitState.OPEN
+    assert breaker.trips == 2
+
+
+def test_released_probe_frees_the_slot():
+    breaker = CircuitBreaker("test")
+    trip(breaker)
+    probe = breaker.allow()
+    breaker.release(probe)
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert breaker.allow() is not None
+
+
+def test_stale_call_does_not_decide_half_open():
+    breaker = CircuitBreaker("test")
+    slow = breaker.allow()  # Начат до отключения, ответит позже
+    trip(breaker)
+    probe = breaker.allow()
+
+    breaker.record(slow, True)
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert breaker.allow() is None  # Пробный всё ещё один
+
+    breaker.record(probe, False)
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_stale_failure_after_close_is_ignored():
+    breaker = CircuitBreaker("test")
+    slow = [breaker.allow() for _ in range(4)]
+    trip(breaker)
+    breaker.record(breaker.allow(), True)
+    assert breaker.state == CircuitState.CLOSED
+
+    for call in slow:
+        breaker.record(call, False)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.calls == 0
+
+
+def test_unconfigured_provider_skipped_without_tripping(monkeypatch):
+    from bot.services.llm_service import LLMClient, LLMProvider
+
+    monkeypatch.setattr(settings, "openrouter_api_key", None)
+    client = LLMClient()
+    assert LLMProvider.OPENROUTER not in client._available_providers(client.provider_priority)
+    assert LLMProvider.LOCAL in client._available_providers(client.provider_priority)
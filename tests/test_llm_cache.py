@@ -0,0 +1,100 @@
+"""Тесты кэша ответов LLM и объединения одинаковых запросов."""
+import asyncio
+
+import pytest
+
+from bot.services import llm_service
+from bot.services.llm_cache import LLMCache
+from bot.services.llm_schemas import Classification
+from bot.services.llm_service import LLMClient, LLMProvider
+from config import settings
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "llm_cache_enabled", True)
+    monkeypatch.setattr(settings, "llm_cache_persistent", False)
+    monkeypatch.setattr(settings, "openrouter_api_key", "key")
+    monkeypatch.setattr(llm_service, "llm_cache", LLMCache())
+    return LLMClient()
+
+
+def messages(text):
+    return [{"role": "user", "content": text}]
+
+
+def test_invalid_response_is_not_cached(client):
+    calls = []
+
+    async def dispatch(providers, msgs, on_text=None, schema=None, validate=None):
+        calls.append(msgs)
+        # Первый ответ не проходит схему, исправленный - проходит
+        return ("извините, не могу" if len(msgs) == 1 else '{"type": "WORK", "confidence": 0.9}'), LLMProvider.LOCAL
+
+    client._dispatch = dispatch
+
+    async def scenario():
+        for _ in range(2):
+            data, error = await client._structured(messages("текст"), Classification)
+            assert error is None
+            assert data["type"] == "WORK"
+
+    asyncio.run(scenario())
+    # Исходный запрос повторяется (неверный ответ не кэшируется), исправление - из кэша
+    assert [len(msgs) for msgs in calls] == [1, 3, 1]
+
+
+def test_forced_provider_is_not_coalesced_with_fallback(client):
+    calls = []
+
+    async def dispatch(providers, msgs, on_text=None, schema=None, validate=None):
+        calls.append(list(providers))
+        await asyncio.sleep(0.05)
+        return f"ответ {providers[0].value}", providers[0]
+
+    client._dispatch = dispatch
+
+    async def scenario():
+        return await asyncio.gather(
+            client._chat(messages("вопрос")),
+            client._chat(messages("вопрос"), provider=LLMProvider.LOCAL)
+        )
+
+    (_, any_provider), (forced_text, forced_provider) = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert forced_provider == LLMProvider.LOCAL
+    assert forced_text == "ответ local"
+
+
+def test_identical_requests_share_call_and_stream(client):
+    calls = 0
+
+    async def dispatch(providers, msgs, on_text=None, schema=None, validate=None):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        if on_text is not None:
+            await on_text("част")
+        return "частичный ответ", providers[0]
+
+    client._dispatch = dispatch
+
+    async def scenario():
+        seen = {"first": [], "second": []}
+
+        def collector(name):
+            async def on_text(text):
+                seen[name].append(text)
+            return on_text
+
+        results = await asyncio.gather(
+            client._chat(messages("одно и то же"), on_text=collector("first")),
+            client._chat(messages("одно и то же"), on_text=collector("second"))
+        )
+        return results, seen
+
+    results, seen = asyncio.run(scenario())
+    assert calls == 1
+    assert [text for text, _ in results] == ["частичный ответ", "частичный ответ"]
+    assert seen == {"first": ["част"], "second": ["част"]}
+    assert client._listeners == {}
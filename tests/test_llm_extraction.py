@@ -0,0 +1,66 @@
+"""Тесты извлечения по частям (map-reduce) для длинных расшифровок."""
+import asyncio
+
+import pytest
+
+from bot.services.llm_service import LLMClient
+
+
+@pytest.fixture
+def client():
+    client = LLMClient()
+    client._split = lambda transcription: ["первая", "вторая", "третья"]
+    return client
+
+
+def test_pending_parts_cancelled_when_on_partial_fails(client):
+    cancelled = []
+
+    async def extract_single(message_type, chunk, on_partial=None, part=None):
+        if chunk == "первая":
+            return {"summary": chunk}
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(chunk)
+            raise
+
+    async def on_partial(message_type, data):
+        raise RuntimeError("сообщение удалено")
+
+    client._extract_single = extract_single
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await client._extract_map_reduce("work", "текст", on_partial)
+        await asyncio.sleep(0)
+        assert sorted(cancelled) == ["вторая", "третья"]
+
+    asyncio.run(scenario())
+
+
+def test_pending_parts_cancelled_with_caller(client):
+    started = []
+    cancelled = []
+
+    async def extract_single(message_type, chunk, on_partial=None, part=None):
+        started.append(chunk)
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(chunk)
+            raise
+
+    client._extract_single = extract_single
+
+    async def scenario():
+        extraction = asyncio.create_task(client._extract_map_reduce("work", "текст"))
+        while len(started) < 3:
+            await asyncio.sleep(0)
+        extraction.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await extraction
+        await asyncio.sleep(0)
+        assert sorted(cancelled) == sorted(started)
+
+    asyncio.run(scenario())
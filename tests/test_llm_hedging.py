@@ -0,0 +1,55 @@
+"""Тесты хеджированных запросов к провайдерам LLM."""
+import asyncio
+
+import pytest
+
+from bot.services.llm_schemas import Classification
+from bot.services.llm_service import LLMClient, LLMProvider
+from config import settings
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "llm_cache_enabled", False)
+    monkeypatch.setattr(settings, "llm_hedging", True)
+    monkeypatch.setattr(settings, "openrouter_api_key", "key")
+    client = LLMClient()
+    client.hedge_delay = lambda provider: 0.01
+    return client
+
+
+def test_invalid_fast_response_does_not_win(client):
+    calls = []
+    answers = {
+        LLMProvider.OPENROUTER: (0.0, "извините, не могу"),
+        LLMProvider.LOCAL: (0.05, '{"type": "WORK", "confidence": 0.9}')
+    }
+
+    async def call_provider(provider, messages, on_text=None, schema=None):
+        calls.append(provider)
+        delay, answer = answers[provider]
+        await asyncio.sleep(delay)
+        return answer
+
+    client._call_provider = call_provider
+    client._available_providers = lambda providers: [LLMProvider.OPENROUTER, LLMProvider.LOCAL]
+
+    data, error = asyncio.run(client._structured([{"role": "user", "content": "текст"}], Classification))
+    assert error is None
+    assert data["type"] == "WORK"
+    # Исправление не понадобилось
+    assert calls == [LLMProvider.OPENROUTER, LLMProvider.LOCAL]
+
+
+def test_invalid_response_returned_when_nothing_valid(client):
+    async def call_provider(provider, messages, on_text=None, schema=None):
+        return None if provider == LLMProvider.LOCAL else "не JSON"
+
+    client._call_provider = call_provider
+
+    result = asyncio.run(client._chat_hedged(
+        [LLMProvider.OPENROUTER, LLMProvider.LOCAL],
+        [{"role": "user", "content": "текст"}],
+        validate=lambda response: False
+    ))
+    assert result == ("не JSON", LLMProvider.OPENROUTER)
@@ -0,0 +1,62 @@
+"""Тесты разбора структурированных ответов LLM."""
+import pytest
+
+from bot.services.llm_schemas import (
+    extract_json_object, parse_result, validate_result,
+    Classification, MeetingResult, IdeasResult, FinanceResult
+)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": 1}', {"a": 1}),
+    ('Вот ответ:\n```json\n{"a": {"b": [1, 2]}}\n```\nГотово', {"a": {"b": [1, 2]}}),
+    ('{"a": [1, 2,], "b": "x",}', {"a": [1, 2], "b": "x"}),
+    ('{"text": "скобка } в строке и \\"кавычка\\""}', {"text": 'скобка } в строке и "кавычка"'}),
+    # Первая скобка не начинает корректный объект - берётся следующий
+    ('{не json} а тут {"a": 1}', {"a": 1}),
+])
+def test_extract_json_object(text, expected):
+    assert extract_json_object(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "нет json", '{"a": 1', "[1, 2]"])
+def test_extract_json_object_without_object(text):
+    assert extract_json_object(text) is None
+
+
+def test_parse_result_coerces_common_deviations():
+    data, error = parse_result(
+        '{"title": null, "participants": "Иван", "tasks": ["Отчёт", {"title": "Звонок"}],'
+        ' "decisions": null, "extra": 1}',
+        MeetingResult
+    )
+    assert error is None
+    assert data["title"] == "Собрание"
+    assert data["participants"] == ["Иван"]
+    assert [task["title"] for task in data["tasks"]] == ["Отчёт", "Звонок"]
+    assert data["decisions"] == []
+    assert data["extra"] == 1
+
+
+def test_parse_result_number_as_string():
+    data, error = parse_result('{"transactions": [{"amount": 500, "category": 12}]}', FinanceResult)
+    assert error is None
+    assert data["transactions"][0]["category"] == "12"
+
+
+def test_parse_result_reports_errors():
+    data, error = parse_result("модель ответила текстом", Classification)
+    assert data is None
+    assert "JSON" in error
+
+    data, error = parse_result('{"confidence": "высокая"}', Classification)
+    assert data is None
+    assert error.startswith("confidence:")
+
+
+def test_validate_result():
+    assert validate_result("ideas", {"ideas": ["Купить велосипед"]}) == IdeasResult(
+        ideas=[{"title": "Купить велосипед"}]
+    ).model_dump()
+    assert validate_result("meeting", {"tasks": 5}) is None
+    assert validate_result("unknown", {}) is None
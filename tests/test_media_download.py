@@ -0,0 +1,49 @@
+"""Тесты буферов скачанного аудио."""
+import io
+import tempfile
+
+import httpx
+
+from bot.services.media_download import media_size, open_audio, upload_content, _hash_source
+
+
+def test_memory_buffer_size_and_hash():
+    buffer = io.BytesIO(b"abc" * 1000)
+    buffer.seek(10)
+    assert media_size(buffer) == 3000
+    digest = _hash_source(buffer)
+    assert digest == _hash_source(b"abc" * 1000)
+    # Буфер можно дописывать: memoryview после подсчёта освобождён
+    buffer.write(b"x")
+
+
+def test_file_on_disk_size_and_hash():
+    with tempfile.TemporaryFile() as file:
+        file.write(b"abc" * 1000)
+        assert media_size(file) == 3000
+        assert _hash_source(file) == _hash_source(b"abc" * 1000)
+        assert file.tell() == 0
+
+
+def test_upload_content_keeps_memory_buffer():
+    buffer = io.BytesIO(b"audio")
+    buffer.seek(3)
+    content = upload_content(buffer)
+    assert content is buffer
+    assert content.tell() == 0
+    assert upload_content(bytearray(b"audio")) == b"audio"
+
+
+def test_multipart_upload_from_memory_buffer():
+    buffer = io.BytesIO(b"audio" * 100)
+    request = httpx.Request(
+        "POST", "http://localhost/v1/audio/transcriptions",
+        files={"file": ("audio.ogg", upload_content(buffer), "application/octet-stream")}
+    )
+    body = request.read()
+    assert b"audio" * 100 in body
+    assert int(request.headers["Content-Length"]) == len(body)
+
+
+def test_open_audio_wraps_bytes():
+    assert open_audio(b"data").read() == b"data"
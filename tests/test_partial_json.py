@@ -0,0 +1,41 @@
+"""Тесты разбора неполного JSON из потокового ответа."""
+import pytest
+
+from bot.utils.partial_json import parse_partial_json
+
+
+@pytest.mark.parametrize("text", ["", "```json\n", "нет json"])
+def test_nothing_to_parse(text):
+    assert parse_partial_json(text) is None
+
+
+def test_complete_object_with_garbage_around():
+    text = '```json\n{"type": "meeting", "data": {"title": "План"}}\n```'
+    assert parse_partial_json(text) == {"type": "meeting", "data": {"title": "План"}}
+
+
+def test_unfinished_string_value_is_cut():
+    assert parse_partial_json('{"type": "meeting", "data": {"title": "Пла') == {
+        "type": "meeting", "data": {"title": "Пла"}
+    }
+
+
+def test_unfinished_key_is_dropped():
+    assert parse_partial_json('{"type": "work", "da') == {"type": "work"}
+    assert parse_partial_json('{"type": "work", "data":') == {"type": "work"}
+
+
+def test_unfinished_number_and_literal_are_dropped():
+    assert parse_partial_json('{"a": "x", "confidence": 0.') == {"a": "x"}
+    assert parse_partial_json('{"a": "x", "flag": tr') == {"a": "x"}
+
+
+def test_unclosed_arrays_are_closed():
+    text = '{"tasks": [{"title": "Купить"}, {"title": "Позвонить'
+    assert parse_partial_json(text) == {"tasks": [{"title": "Купить"}, {"title": "Позвонить"}]}
+
+
+def test_escapes_inside_strings():
+    assert parse_partial_json('{"text": "он сказал \\"да\\" и {нет}"}') == {"text": 'он сказал "да" и {нет}'}
+    # Обрезка на середине экранирования
+    assert parse_partial_json('{"text": "abc\\') == {"text": "abc"}
@@ -0,0 +1,321 @@
+"""Тесты очереди задач (на временной SQLite)."""
+import asyncio
+import io
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlmodel import SQLModel
+
+from bot.models.database import User, ProcessingTask, TaskStatus
+from bot.services import queue_service
+from bot.services.queue_service import DeficitRoundRobin, QueueService
+from bot.services.transcription_cache import transcription_cache
+from bot.storage.database import AsyncSessionLocal, async_engine
+from config import settings
+
+
+def run(coro):
+    """Выполнить сценарий; соединения с базой не переживают event loop."""
+    async def scenario():
+        try:
+            return await coro
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(scenario())
+
+
+@pytest.fixture
+def service():
+    async def reset():
+        async with async_engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.drop_all)
+            await conn.run_sync(SQLModel.metadata.create_all)
+    run(reset())
+    return QueueService()
+
+
+async def add_user(telegram_id: int) -> int:
+    async with AsyncSessionLocal() as session:
+        user = User(telegram_id=telegram_id, first_name="Тест")
+        session.add(user)
+        await session.commit()
+        return user.id
+
+
+async def add_task(user_id: int, **fields) -> int:
+    fields.setdefault("file_id", "file")
+    fields.setdefault("file_type", "voice")
+    async with AsyncSessionLocal() as session:
+        task = ProcessingTask(user_id=user_id, **fields)
+        session.add(task)
+        await session.commit()
+        return task.id
+
+
+async def get_task(task_id: int) -> ProcessingTask:
+    async with AsyncSessionLocal() as session:
+        return await session.get(ProcessingTask, task_id)
+
+
+def test_reclaim_expired_requeues_and_fails_exhausted(service, monkeypatch):
+    notified = []
+
+    async def notify_error(message, status_msg, text):
+        notified.append((message.chat.id, status_msg.message_id))
+
+    monkeypatch.setattr(service, "_notify_error", notify_error)
+    service.bot = object()
+
+    async def scenario():
+        user_id = await add_user(1)
+        expired = datetime.utcnow() - timedelta(seconds=1)
+        retry = await add_task(
+            user_id, status=TaskStatus.TRANSCRIBING, lease_expires_at=expired, attempts=1, worker_id="old/0"
+        )
+        exhausted = await add_task(
+            user_id, status=TaskStatus.PROCESSING, lease_expires_at=expired,
+            attempts=settings.queue_max_attempts, chat_id=10, message_id=20, status_message_id=21
+        )
+        alive = await add_task(
+            user_id, status=TaskStatus.TRANSCRIBING, lease_expires_at=datetime.utcnow() + timedelta(minutes=1)
+        )
+
+        assert await service.reclaim_expired() == 1
+        assert (await get_task(retry)).status == TaskStatus.QUEUED
+        assert (await get_task(retry)).worker_id is None
+        assert (await get_task(exhausted)).status == TaskStatus.ERROR
+        assert (await get_task(alive)).status == TaskStatus.TRANSCRIBING
+
+        # Повторная проверка ничего не меняет и не сообщает ещё раз
+        assert await service.reclaim_expired() == 0
+
+    run(scenario())
+    assert notified == [(10, 21)]
+
+
+def test_drr_shares_turns_between_users():
+    scheduler = DeficitRoundRobin(quantum=10.0)
+    # У первого - очередь из длинных задач, у второго - вдвое короче:
+    # за круг оба получают поровну секунд обработки
+    picks = [scheduler.pick({1: 10.0, 2: 5.0}, [1, 2]) for _ in range(6)]
+    assert picks == [1, 2, 2, 1, 2, 2]
+
+
+def test_drr_waits_until_deficit_covers_cost():
+    scheduler = DeficitRoundRobin(quantum=10.0)
+    # Задача стоит два кванта: пользователь набирает дефицит за два хода
+    assert scheduler.pick({1: 20.0}, [1]) == 1
+    assert scheduler.stats() == {1: 0.0}
+    # Пользователь без выдаваемых задач не мешает остальным
+    assert scheduler.pick({2: 5.0}, [1, 2]) == 2
+    assert scheduler.pick({}, [1, 2]) is None
+
+
+def test_drr_refund_and_reset():
+    scheduler = DeficitRoundRobin(quantum=10.0)
+    assert scheduler.pick({1: 4.0}, [1]) == 1
+    scheduler.refund(1, 4.0)
+    assert scheduler.stats() == {1: 10.0}
+    # Очередь опустела - накопленный дефицит сгорает
+    assert scheduler.pick({2: 1.0}, [2]) == 2
+    assert 1 not in scheduler.stats()
+    # Возврат ушедшему пользователю игнорируется
+    scheduler.refund(1, 4.0)
+    assert 1 not in scheduler.stats()
+
+
+def test_claim_rechecks_in_flight_limit(service, monkeypatch):
+    monkeypatch.setattr(settings, "max_in_flight_per_user", 1)
+
+    async def scenario():
+        user_id = await add_user(1)
+        first = await add_task(user_id)
+        second = await add_task(user_id)
+        async with AsyncSessionLocal() as session:
+            # Оба воркера видят свободный слот до занятия
+            _, costs, _ = await service._user_queues(session)
+            assert user_id in costs
+            assert await service._claim(session, "a/0", first, user_id) == first
+            assert await service._claim(session, "b/0", second, user_id) is None
+        assert (await get_task(second)).status == TaskStatus.QUEUED
+
+    run(scenario())
+
+
+def test_get_next_task_respects_in_flight_limit(service, monkeypatch):
+    monkeypatch.setattr(settings, "max_in_flight_per_user", 1)
+
+    async def scenario():
+        busy = await add_user(1)
+        other = await add_user(2)
+        for _ in range(3):
+            await add_task(busy)
+        await add_task(other)
+
+        async def claim(worker_id):
+            async with AsyncSessionLocal() as session:
+                task = await service.get_next_task(session, worker_id)
+                return task and task.user_id
+
+        claimed = await asyncio.gather(*(claim(f"w/{n}") for n in range(4)))
+        assert sorted(claimed, key=str) == sorted([busy, other, None, None], key=str)
+
+    run(scenario())
+
+
+def test_user_queues_pick_head_by_rank(service, monkeypatch):
+    monkeypatch.setattr(settings, "max_in_flight_per_user", 1)
+    monkeypatch.setattr(settings, "queue_aging_factor", 1.0)
+    monkeypatch.setattr(settings, "queue_priority_step", 300.0)
+
+    async def add_ranked(user_id: int, age: float, **fields) -> int:
+        task = ProcessingTask(
+            user_id=user_id, file_id="file", file_type="voice",
+            created_at=datetime.utcnow() - timedelta(seconds=age), **fields
+        )
+        return await add_task(user_id, created_at=task.created_at, queue_rank=service.task_rank(task), **fields)
+
+    async def scenario():
+        first = await add_user(1)
+        second = await add_user(2)
+        busy = await add_user(3)
+        await add_ranked(first, 30, estimated_cost=600.0)
+        short = await add_ranked(first, 10, estimated_cost=20.0)
+        # Долго ждущая длинная задача обгоняет новую короткую
+        aged = await add_ranked(second, 1000, estimated_cost=600.0)
+        await add_ranked(second, 0, estimated_cost=20.0)
+        # Приоритет сдвигает задачу вперёд
+        await add_ranked(busy, 100, estimated_cost=20.0)
+        urgent = await add_ranked(busy, 0, estimated_cost=100.0, priority=1)
+        await add_task(busy, status=TaskStatus.TRANSCRIBING)
+
+        async with AsyncSessionLocal() as session:
+            waiting, costs, heads = await service._user_queues(session)
+        assert waiting == [second, busy, first]
+        assert heads == {first: short, second: aged}
+        assert costs == {first: 20.0, second: 600.0}
+
+        monkeypatch.setattr(settings, "max_in_flight_per_user", 0)
+        async with AsyncSessionLocal() as session:
+            _, _, heads = await service._user_queues(session)
+        assert heads[busy] == urgent
+
+    run(scenario())
+
+
+def test_transcribe_records_stepped_down_model(service, monkeypatch):
+    monkeypatch.setattr(settings, "transcription_cache_enabled", True)
+
+    class StatusMessage:
+        async def edit_text(self, text):
+            pass
+
+    async def download(task, status_msg):
+        return io.BytesIO(b"audio")
+
+    async def transcribe(audio, **kwargs):
+        assert kwargs["model_name"] == "medium"
+        return "текст", "small"
+
+    monkeypatch.setattr(service, "_download", download)
+    monkeypatch.setattr(service.whisper, "route_model", lambda duration: "medium")
+    monkeypatch.setattr(service.whisper, "transcribe", transcribe)
+
+    async def scenario():
+        user_id = await add_user(1)
+        task_id = await add_task(user_id, file_unique_id="unique")
+        task = await get_task(task_id)
+        assert await service._transcribe(task, StatusMessage()) == "текст"
+        assert (await get_task(task_id)).whisper_model == "small"
+
+        # Расшифровка меньшей моделью не выдаётся за расшифровку запрошенной
+        assert await transcription_cache.get("medium", file_unique_id="unique") is None
+        assert await transcription_cache.get("small", file_unique_id="unique") == "текст"
+
+    run(scenario())
+
+
+def test_transcription_saved_when_analysis_fails(service, monkeypatch):
+    async def transcribe(task, status_msg):
+        return "текст"
+
+    async def analyze(llm, transcription, status_msg):
+        raise RuntimeError("LLM недоступен")
+
+    async def notify_error(message, status_msg, text):
+        pass
+
+    monkeypatch.setattr(service, "_transcribe", transcribe)
+    monkeypatch.setattr(service, "_notify_error", notify_error)
+    monkeypatch.setattr(queue_service, "analyze", analyze)
+
+    async def scenario():
+        user_id = await add_user(1)
+        task_id = await add_task(
+            user_id, status=TaskStatus.TRANSCRIBING, chat_id=10, message_id=20, status_message_id=21
+        )
+        await service._process_task(task_id)
+        task = await get_task(task_id)
+        assert task.status == TaskStatus.ERROR
+        # Для «Переформулировать» расшифровка остаётся в задаче
+        assert task.transcription == "текст"
+
+    run(scenario())
+
+
+def test_claiming_worker_wakes_idle_workers(service, monkeypatch):
+    monkeypatch.setattr(settings, "queue_poll_interval", 60.0)
+
+    async def scenario():
+        now = datetime.utcnow()
+        queue = []
+        claimed = []
+        gate = asyncio.Event()
+        calls = {}
+
+        async def get_next_task(session, worker_id):
+            calls[worker_id] = calls.get(worker_id, 0) + 1
+            if worker_id.endswith("/1") and calls[worker_id] == 1:
+                # Воркер 1 выбирает задачу по снимку до добавления новых
+                await gate.wait()
+                return None
+            if queue:
+                return SimpleNamespace(id=queue.pop(0), started_at=now, created_at=now)
+            return None
+
+        async def process_task(task_id):
+            claimed.append(task_id)
+            await asyncio.sleep(3600)
+
+        async def heartbeat(task_id, worker_id, processing):
+            pass
+
+        monkeypatch.setattr(service, "get_next_task", get_next_task)
+        monkeypatch.setattr(service, "_process_task", process_task)
+        monkeypatch.setattr(service, "_heartbeat", heartbeat)
+
+        service._running = True
+        slow = asyncio.create_task(service._worker(1))
+        await asyncio.sleep(0.01)
+        busy = asyncio.create_task(service._worker(0))
+        await asyncio.sleep(0.01)
+
+        # Две задачи добавлены; воркер 0 сбросил уведомление и взял первую
+        queue.extend([1, 2])
+        service.notify()
+        await asyncio.sleep(0.01)
+        gate.set()
+        try:
+            for _ in range(100):
+                if len(claimed) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            assert sorted(claimed) == [1, 2]
+        finally:
+            service._running = False
+            for worker in (slow, busy):
+                worker.cancel()
+            await asyncio.gather(slow, busy, return_exceptions=True)
+
+    run(scenario())
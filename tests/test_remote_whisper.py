@@ -0,0 +1,41 @@
+"""Тесты клиента API расшифровки."""
+import asyncio
+
+import httpx
+
+from bot.services.remote_whisper import RemoteWhisperClient
+
+
+def make_client(handler) -> RemoteWhisperClient:
+    client = RemoteWhisperClient(base_url="http://whisper/v1", model="medium")
+    client._client = httpx.AsyncClient(base_url="http://whisper/v1", transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_transcribe_returns_model_used_by_server():
+    def handler(request):
+        return httpx.Response(200, json={"text": "текст", "model": "small"})
+
+    async def scenario():
+        client = make_client(handler)
+        try:
+            return await client.transcribe(b"audio", model="medium")
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(scenario()) == ("текст", "small")
+
+
+def test_transcribe_without_model_in_response():
+    # OpenAI не сообщает модель - считаем, что расшифровано запрошенной
+    def handler(request):
+        return httpx.Response(200, json={"text": "текст"})
+
+    async def scenario():
+        client = make_client(handler)
+        try:
+            return await client.transcribe(b"audio")
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(scenario()) == ("текст", "medium")
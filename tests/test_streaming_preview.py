@@ -0,0 +1,59 @@
+"""Тесты предпросмотра результата во время потокового ответа."""
+import asyncio
+
+import pytest
+
+from bot.services.results import StreamingPreview, render_partial_result
+from config import settings
+
+
+class FakeStatus:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_text(self, text, **kwargs):
+        self.edits.append(text)
+
+
+@pytest.fixture(autouse=True)
+def edit_interval(monkeypatch):
+    monkeypatch.setattr(settings, "llm_stream_edit_interval", 3600.0)
+
+
+def test_render_partial_result():
+    text = render_partial_result("meeting", {"title": "Планёрка", "tasks": [{"title": "Отчёт"}, "Звонок"]})
+    assert text.startswith("👥 Планёрка")
+    assert "1. Отчёт\n2. Звонок" in text
+    assert text.endswith("⏳ ...")
+
+
+def test_updates_are_throttled_and_flushed_on_close():
+    async def scenario():
+        status = FakeStatus()
+        preview = StreamingPreview(status)
+        await preview.update("meeting", {"title": "План"})
+        await preview.update("meeting", {"title": "План", "summary": "Обсудили"})
+        await preview.update("meeting", {"title": "План", "summary": "Обсудили сроки"})
+        assert len(status.edits) == 1
+
+        await preview.close()
+        assert len(status.edits) == 2
+        assert "Обсудили сроки" in status.edits[-1]
+        assert preview.shown
+
+        # Нечего показывать - повторный close ничего не правит
+        await preview.close()
+        assert len(status.edits) == 2
+
+    asyncio.run(scenario())
+
+
+def test_close_without_updates_does_nothing():
+    async def scenario():
+        status = FakeStatus()
+        preview = StreamingPreview(status)
+        await preview.close()
+        assert status.edits == []
+        assert not preview.shown
+
+    asyncio.run(scenario())
@@ -0,0 +1,64 @@
+"""Тесты нарезки длинных расшифровок и слияния результатов по частям."""
+from bot.services.text_chunking import estimate_tokens, split_text, merge_extractions
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("", 3.0) == 1
+    assert estimate_tokens("a" * 300, 3.0) == 101
+
+
+def test_short_text_is_one_chunk():
+    assert split_text("Одно предложение. И второе.", max_tokens=100, overlap_tokens=0, chars_per_token=1) == [
+        "Одно предложение. И второе."
+    ]
+
+
+def test_split_on_sentence_boundaries():
+    text = "Первое предложение. Второе предложение! Третье предложение? Четвёртое."
+    chunks = split_text(text, max_tokens=40, overlap_tokens=0, chars_per_token=1)
+    assert chunks == ["Первое предложение. Второе предложение!", "Третье предложение? Четвёртое."]
+    assert all(len(chunk) <= 40 for chunk in chunks)
+
+
+def test_chunks_overlap_by_last_sentences():
+    text = "Раз два. Три четыре. Пять шесть. Семь восемь."
+    assert split_text(text, max_tokens=24, overlap_tokens=12, chars_per_token=1) == [
+        "Раз два. Три четыре.", "Три четыре. Пять шесть.", "Пять шесть. Семь восемь."
+    ]
+    # Предложение длиннее перекрытия не повторяется
+    assert split_text(text, max_tokens=24, overlap_tokens=5, chars_per_token=1) == [
+        "Раз два. Три четыре.", "Пять шесть.", "Семь восемь."
+    ]
+
+
+def test_long_sentence_without_punctuation_is_split_by_words():
+    text = " ".join(f"слово{i}" for i in range(50))
+    chunks = split_text(text, max_tokens=30, overlap_tokens=0, chars_per_token=1)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 30 for chunk in chunks)
+    assert " ".join(chunks).split() == text.split()
+
+
+def test_merge_lists_without_repeats():
+    merged = merge_extractions([
+        {"tasks": [{"title": "Купить молоко"}, {"title": "Позвонить"}], "tags": ["дом"]},
+        {"tasks": [{"title": "купить  молоко!"}, {"title": "Отчёт"}], "tags": ["Дом", "работа"]}
+    ])
+    assert [task["title"] for task in merged["tasks"]] == ["Купить молоко", "Позвонить", "Отчёт"]
+    assert merged["tags"] == ["дом", "работа"]
+
+
+def test_merge_scalars_summary_and_content():
+    merged = merge_extractions([
+        {"title": "", "summary": "Начало.", "content": "Часть 1", "date": None},
+        {"title": "Встреча", "summary": "Конец.", "content": "Часть 2", "date": "2024-05-01"},
+        {"title": "Другое", "summary": "", "content": ""}
+    ])
+    assert merged["title"] == "Встреча"
+    assert merged["date"] == "2024-05-01"
+    assert merged["summary"] == "Начало. Конец."
+    assert merged["content"] == "Часть 1\n\nЧасть 2"
+
+
+def test_merge_empty():
+    assert merge_extractions([]) == {}
@@ -0,0 +1,75 @@
+"""Тесты объединения одинаковых запросов на сервере расшифровки."""
+import io
+import json
+import asyncio
+
+from bot.services.transcription_server import TranscriptionServer
+
+
+def make_server(transcribe):
+    server = TranscriptionServer()
+
+    async def read_request(request):
+        return io.BytesIO(b"same audio"), {"model": "small"}
+
+    server._read_request = read_request
+    server.whisper.transcribe = transcribe
+    return server
+
+
+def test_identical_requests_are_coalesced():
+    async def scenario():
+        calls = 0
+        release = asyncio.Event()
+
+        async def transcribe(audio, **kwargs):
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "текст", "small"
+
+        server = make_server(transcribe)
+        owner = asyncio.create_task(server.handle_transcription(None))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(server.handle_transcription(None))
+        await asyncio.sleep(0.05)
+        release.set()
+
+        responses = await asyncio.gather(owner, waiter)
+        assert calls == 1
+        assert server.requests_coalesced == 1
+        assert [json.loads(r.text)["text"] for r in responses] == ["текст", "текст"]
+
+    asyncio.run(scenario())
+
+
+def test_waiters_released_when_owner_cancelled():
+    async def scenario():
+        async def transcribe(audio, **kwargs):
+            await asyncio.sleep(3600)
+
+        server = make_server(transcribe)
+        owner = asyncio.create_task(server.handle_transcription(None))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(server.handle_transcription(None))
+        await asyncio.sleep(0.05)
+
+        owner.cancel()
+        response = await asyncio.wait_for(waiter, 1)
+        assert response.status == 503
+        assert server._in_flight == {}
+
+    asyncio.run(scenario())
+
+
+def test_response_reports_stepped_down_model():
+    async def scenario():
+        async def transcribe(audio, **kwargs):
+            # Под нагрузкой сервер расшифровал моделью меньше запрошенной
+            return "текст", "base"
+
+        server = make_server(transcribe)
+        response = await server.handle_transcription(None)
+        assert json.loads(response.text) == {"text": "текст", "model": "base"}
+
+    asyncio.run(scenario())